@@ -0,0 +1,50 @@
+"""Parsing of WM Auth Bot verification announcements.
+
+An announcement has one verification per line, in the form
+`<@1234> authenticated as User:Example`.
+"""
+import re
+from typing import List, NewType, Optional, Tuple
+
+_MARKER = " authenticated as User:"
+_MENTION_ID = re.compile(r"<@!?(\d+)>")
+
+# One verification: a (discord mention, wiki username) pair.  A plain
+# tuple at runtime, so `parse_all` can return `re.findall`'s tuples
+# as they are; copying each into a record class costs about as much as
+# finding it.
+AuthRecord = NewType('AuthRecord', Tuple[str, str])
+
+
+def discord_id(mention: str) -> Optional[int]:
+    """The mentioned user's ID, if the mention is an ID mention."""
+    match = _MENTION_ID.fullmatch(mention)
+    return int(match[1]) if match else None
+
+
+# The mention runs from the first `@` (or `<@`) on the line to the first
+# marker after it, matched a word at a time (faster than `.*?`); the
+# username is the rest of the line, less surrounding whitespace.
+_AUTH_LINE = re.compile(
+    r"((?:<@|@)[^ \n]*(?: [^ \n]*)*?)" + re.escape(_MARKER)
+    + r"[^\S\n]*(.*\S)"
+)
+
+
+def parse_all(content: str) -> List[AuthRecord]:
+    """Return every verification in a (possibly batched) message."""
+    if "\n" in content:
+        return _AUTH_LINE.findall(content)
+    # One line, the usual case: plain string operations are cheaper
+    # than the regex.
+    head, marker, wiki_user = content.partition(_MARKER)
+    mention = head.find("@")
+    if mention == -1:
+        # No mention, or it comes after the first marker.
+        return _AUTH_LINE.findall(content) if marker else []
+    wiki_user = wiki_user.strip()
+    if not wiki_user:
+        return []
+    if mention and head[mention - 1] == "<":
+        mention -= 1
+    return [AuthRecord((head[mention:], wiki_user))]
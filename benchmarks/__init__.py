@@ -0,0 +1 @@
+"""Micro-benchmarks.  Run each from the repo root with `python -m`."""
@@ -0,0 +1,102 @@
+"""Benchmark parsing of auth-bot announcements.
+
+Compares the old path (`re.findall` with an uncompiled, unanchored
+lazy pattern, keeping the first match) with `authparse.parse_all`,
+which returns every verification, over a corpus of single, batched,
+non-matching and malformed messages, in all and by kind.  First checks
+that `parse_all` agrees with `LINE_REGEX`, a line-anchored pattern for
+the same format.
+
+Locally, `parse_all` is about a third cheaper on single messages and a
+sixth on batched ones, though it returns every verification where the
+old path kept only the first.
+
+Usage: python -m benchmarks.authparse [--messages N] [--repeat N]
+"""
+import argparse
+import random
+import re
+import timeit
+from typing import List, Optional, Tuple
+
+import authparse
+
+OLD_REGEX = r"(@.*?) authenticated as User:(.*)"
+LINE_REGEX = re.compile(
+    r"^[^@\n]*?(<?@[^\n]*?) authenticated as User:([^\n]+)$", re.MULTILINE
+)
+
+
+def make_corpus(count: int, seed: int = 0) -> List[str]:
+    rng = random.Random(seed)
+
+    def line() -> str:
+        return (f"<@{rng.randrange(10**17, 10**18)}> authenticated as "
+                f"User:{rng.choice(['Example', 'Jane Doe', 'Foo_bar'])}"
+                f"{rng.randrange(10000)}")
+
+    corpus = []
+    for _ in range(count):
+        kind = rng.random()
+        if kind < 0.7:
+            corpus.append(line())
+        elif kind < 0.9:
+            corpus.append("\n".join(line() for _ in range(rng.randint(2, 8))))
+        elif kind < 0.97:
+            corpus.append(f"<@{rng.randrange(10**17, 10**18)}> failed to "
+                          "authenticate; please try again.")
+        else:
+            corpus.append(rng.choice([
+                "x authenticated as User:A <@1> authenticated as User:B",
+                "<@2> authenticated as User:   \n" + line(),
+                "@3 authenticated as User:C authenticated as User:D",
+                "No mention authenticated as User:E",
+            ]))
+    return corpus
+
+
+def old_path(content: str) -> Optional[Tuple[str, str]]:
+    match = re.findall(OLD_REGEX, content)
+    return (match[0][0], match[0][1]) if match else None
+
+
+def line_regex(content: str) -> List[Tuple[str, str]]:
+    return [(match[1], match[2].strip())
+            for match in LINE_REGEX.finditer(content)
+            if not match[2].isspace()]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--messages', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    corpus = make_corpus(args.messages)
+    for message in corpus:
+        assert authparse.parse_all(message) == line_regex(message), message
+    kinds = {
+        'all': corpus,
+        'single': [m for m in corpus
+                   if "\n" not in m and authparse.parse_all(m)],
+        'batched': [m for m in corpus if "\n" in m],
+        'other': [m for m in corpus
+                  if "\n" not in m and not authparse.parse_all(m)],
+    }
+    paths = {'re.findall': old_path, 'parse_all': authparse.parse_all}
+    best = {name: [float('inf')] * len(kinds) for name in paths}
+    # The paths take turns, so a change in machine load hits both.
+    for _ in range(args.repeat):
+        for name, func in paths.items():
+            for idx, messages in enumerate(kinds.values()):
+                seconds = timeit.timeit(lambda: [func(m) for m in messages],
+                                        number=1)
+                best[name][idx] = min(best[name][idx],
+                                      seconds / len(messages) * 1e6)
+    print(f"{'us/message':>10} " + " ".join(f"{kind:>8}" for kind in kinds))
+    for name, times in best.items():
+        print(f"{name:>10} " + " ".join(f"{t:8.2f}" for t in times))
+
+
+if __name__ == '__main__':
+    main()
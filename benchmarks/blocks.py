@@ -0,0 +1,130 @@
+"""Benchmark block extraction from a large globaluserinfo response.
+
+Compares the old path (`json.loads` on the whole body, then walk
+`merged`) with `jsonstream.ArrayItems` fed in network-sized chunks, on
+a synthetic account attached to 900 wikis.  Streaming trades CPU for
+memory: locally it takes about 2.4x the time of `json.loads` (4.85 vs
+2.01 ms) for under a third of the peak memory (259 vs 867 KiB).
+
+First checks that `ArrayItems` decodes awkward arrays the same in
+every chunk size from 1 to 7 bytes, so no item is cut short where a
+chunk ends: numbers with fractions and exponents, strings with
+escapes, and `true`, `false` or `null` last.
+
+Usage: python -m benchmarks.blocks [--wikis N] [--repeat N]
+"""
+import argparse
+import json
+import timeit
+import tracemalloc
+from typing import Any, Callable, Dict, List
+
+import jsonstream
+import projection
+
+CHUNK = 65536
+
+
+def make_payload(wikis: int) -> bytes:
+    merged = []
+    for i in range(wikis):
+        entry: Dict[str, Any] = {
+            'wiki': f"wiki{i}wiki",
+            'url': f"https://wiki{i}.wikipedia.org",
+            'timestamp': "2015-03-01T12:00:00Z",
+            'method': "login",
+            'editcount': i * 37,
+            'registration': "2015-03-01T12:00:00Z",
+            'groups': ["autoconfirmed", "extendedconfirmed"][:i % 3],
+        }
+        if i % 97 == 0:
+            entry['blocked'] = {'expiry': "infinity",
+                                'reason': "Long-term abuse " * 4}
+        merged.append(entry)
+    return json.dumps({
+        'batchcomplete': "",
+        'query': {'globaluserinfo': {
+            'home': "enwiki", 'id': 1234, 'registration': "",
+            'name': "Example", 'merged': merged, 'unattached': []
+        }}
+    }).encode()
+
+
+def old_path(payload: bytes) -> List[List[str]]:
+    data = json.loads(payload.decode())
+    return [[wiki['wiki'], f"{wiki['blocked']['reason']} until "
+             f"{wiki['blocked']['expiry']}"]
+            for wiki in data['query']['globaluserinfo']['merged']
+            if 'blocked' in wiki]
+
+
+# utils._BLOCK_TEMPLATE, copied so this benchmark doesn't need
+# discord.py installed.
+project = projection.compile_template(
+    {'wiki': None, 'blocked': {'reason': None, 'expiry': None}}
+).one
+
+
+def stream_path(payload: bytes) -> List[List[str]]:
+    merged = jsonstream.ArrayItems('merged', project=project)
+    blocks = []
+    for i in range(0, len(payload), CHUNK):
+        for wiki in merged.feed(payload[i:i + CHUNK]):
+            if 'blocked' in wiki:
+                blocks.append([wiki['wiki'], f"{wiki['blocked']['reason']} "
+                               f"until {wiki['blocked']['expiry']}"])
+    merged.close()
+    return blocks
+
+
+# Each is decoded whole and in small chunks, which must agree.
+EDGE_CASES = [
+    [1e5, 100000.5, 1.25e-7, -0.5, 10, 0],
+    ["a\\\"b", "\\", "\u00e9\n", "]", ",", "\"]\""],
+    [{'n': 1e5}, "x", True],
+    [1.5, False],
+    [{'s': "a\\"}, None],
+    [100000.5],
+    [1e5],
+]
+
+
+def check_chunking() -> None:
+    for items in EDGE_CASES:
+        payload = json.dumps({'query': {'merged': items}}).encode()
+        for size in range(1, 8):
+            merged = jsonstream.ArrayItems('merged')
+            decoded = []
+            for i in range(0, len(payload), size):
+                decoded += merged.feed(payload[i:i + size])
+            merged.close()
+            assert decoded == items, (items, size, decoded)
+
+
+def peak_kib(func: Callable[[bytes], Any], payload: bytes) -> float:
+    tracemalloc.start()
+    func(payload)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak / 1024
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--wikis', type=int, default=900)
+    parser.add_argument('--repeat', type=int, default=50)
+    args = parser.parse_args()
+
+    check_chunking()
+    payload = make_payload(args.wikis)
+    assert old_path(payload) == stream_path(payload)
+    print(f"payload: {len(payload) / 1024:.0f} KiB, {args.wikis} wikis")
+    for name, func in (('json.loads', old_path), ('stream', stream_path)):
+        per_call = min(timeit.repeat(lambda: func(payload),
+                                     number=args.repeat, repeat=3))
+        print(f"{name:>10}: {per_call / args.repeat * 1e3:7.2f} ms/call, "
+              f"peak {peak_kib(func, payload):8.0f} KiB")
+
+
+if __name__ == '__main__':
+    main()
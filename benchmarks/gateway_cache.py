@@ -0,0 +1,242 @@
+"""Compare the gateway cache under the old and new intents, offline.
+
+Builds a discord.py `ConnectionState` for each configuration and feeds
+it what the gateway would send for one large guild, made with the load
+test's payloads:
+  old  -- `Intents.all()`, discord.py's default member cache flags, and
+          chunking at startup (discord.py's default with members on);
+  new  -- `wmbot.buildIntents()`, `wmbot.buildMemberCacheFlags()`, and
+          chunking as set by CHUNK_GUILDS.
+Startup is a GUILD_CREATE (with the online members and their
+presences, if the presences intent is on) and, if chunking, every
+member in chunks of 1000.  Then --events events, in a mix typical of a
+large guild, mostly presence updates; those whose intent is off are
+never sent by Discord, so aren't fed in.
+
+Prints, for each, the memory held by the cache (by tracemalloc) after
+startup and after the events, the members, users and messages cached,
+the events received, and the time spent parsing them.
+
+Usage: python -m benchmarks.gateway_cache [--members N] [--online F]
+         [--events N]
+"""
+import argparse
+import asyncio
+import gc
+import random
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, Iterator, List, Tuple
+
+import discord
+from discord.state import ConnectionState
+
+# First, as it sets the environment constants reads at import.
+from benchmarks.loadtest import (BOT, FIRST_MEMBER, GENERAL, GUILD,
+                                 message_payload, user_payload)
+import constants
+import wmbot
+
+# Event, the intent Discord needs to send it, and its share of events.
+EVENTS: List[Tuple[str, str, float]] = [
+    ('PRESENCE_UPDATE', 'presences', 0.70),
+    ('TYPING_START', 'guild_typing', 0.10),
+    ('MESSAGE_CREATE', 'guild_messages', 0.08),
+    ('MESSAGE_REACTION_ADD', 'guild_reactions', 0.06),
+    ('VOICE_STATE_UPDATE', 'voice_states', 0.03),
+    ('GUILD_MEMBER_UPDATE', 'members', 0.02),
+    ('GUILD_MEMBER_ADD', 'members', 0.01),
+]
+VOICE = 1012
+JOINED = "2021-01-01T00:00:00+00:00"
+
+
+def configs() -> Dict[str, Dict[str, Any]]:
+    return {
+        'old': {'intents': discord.Intents.all(), 'max_messages': 1000},
+        'new': {'intents': wmbot.buildIntents(),
+                'member_cache_flags': wmbot.buildMemberCacheFlags(),
+                'chunk_guilds_at_startup': (constants.MEMBERS_INTENT
+                                            and constants.CHUNK_GUILDS),
+                'max_messages': constants.MAX_MESSAGES or None},
+    }
+
+
+def member_payload(member_id: int) -> Dict[str, Any]:
+    return {'user': user_payload(member_id), 'roles': [],
+            'joined_at': JOINED, 'deaf': False, 'mute': False}
+
+
+def presence_payload(member_id: int, status: str) -> Dict[str, Any]:
+    return {'user': user_payload(member_id), 'guild_id': str(GUILD),
+            'status': status, 'activities': [], 'roles': [],
+            'client_status': {'desktop': status}}
+
+
+def guild_payload(members: int, online: List[int],
+                  presences: bool) -> Dict[str, Any]:
+    role = {'permissions': "0", 'color': 0, 'hoist': False,
+            'managed': False, 'mentionable': False}
+    channel = {'position': 0, 'permission_overwrites': []}
+    # Without the presences intent, a large guild's GUILD_CREATE has
+    # only the bot's own member.
+    present = [BOT] + (online if presences else [])
+    return {
+        'id': str(GUILD), 'name': "Load test", 'large': True,
+        'member_count': members, 'unavailable': False,
+        'roles': [{**role, 'id': str(GUILD), 'name': "@everyone",
+                   'position': 0}],
+        'channels': [{**channel, 'type': 0, 'id': str(GENERAL),
+                      'name': "general"},
+                     {**channel, 'type': 2, 'id': str(VOICE),
+                      'name': "voice", 'bitrate': 64000, 'user_limit': 0}],
+        'members': [member_payload(member) for member in present],
+        'presences': ([presence_payload(member, 'online')
+                       for member in online] if presences else []),
+        'voice_states': [], 'emojis': [],
+    }
+
+
+def event_payloads(count: int, members: int, online: List[int],
+                   seed: int) -> Iterator[Tuple[str, str, Dict[str, Any]]]:
+    rng = random.Random(seed)
+    names = [name for name, _, _ in EVENTS]
+    intents = dict((name, intent) for name, intent, _ in EVENTS)
+    weights = [share for _, _, share in EVENTS]
+    message_ids: List[str] = []
+    joined = FIRST_MEMBER + members
+    for name in rng.choices(names, weights, k=count):
+        member = rng.choice(online)
+        if name == 'PRESENCE_UPDATE':
+            data = presence_payload(member, rng.choice(
+                ['online', 'idle', 'dnd', 'offline']
+            ))
+        elif name == 'TYPING_START':
+            data = {'channel_id': str(GENERAL), 'guild_id': str(GUILD),
+                    'user_id': str(member), 'timestamp': 1600000000,
+                    'member': member_payload(member)}
+        elif name == 'MESSAGE_CREATE':
+            data = message_payload(
+                "Hello " * rng.randrange(1, 40), user_payload(member),
+                channel_id=str(GENERAL), guild_id=str(GUILD),
+                member={'roles': [], 'joined_at': JOINED, 'deaf': False,
+                        'mute': False}, mentions=[], mention_roles=[]
+            )
+            message_ids.append(data['id'])
+        elif name == 'MESSAGE_REACTION_ADD':
+            data = {'user_id': str(member), 'channel_id': str(GENERAL),
+                    'guild_id': str(GUILD), 'emoji': {'id': None,
+                                                      'name': "👍"},
+                    'message_id': (rng.choice(message_ids) if message_ids
+                                   else "1"),
+                    'member': member_payload(member)}
+        elif name == 'VOICE_STATE_UPDATE':
+            data = {'guild_id': str(GUILD), 'user_id': str(member),
+                    'channel_id': rng.choice([str(VOICE), None]),
+                    'session_id': "x", 'deaf': False, 'mute': False,
+                    'self_deaf': False, 'self_mute': False,
+                    'self_video': False, 'suppress': False,
+                    'member': member_payload(member)}
+        elif name == 'GUILD_MEMBER_UPDATE':
+            data = {**member_payload(member), 'guild_id': str(GUILD),
+                    'nick': f"nick{rng.randrange(100)}"}
+        else:
+            data = {**member_payload(joined), 'guild_id': str(GUILD)}
+            joined += 1
+        yield name, intents[name], data
+
+
+async def measure(options: Dict[str, Any], args: argparse.Namespace,
+                  online: List[int]) -> Dict[str, Any]:
+    loop = asyncio.get_running_loop()
+    state = ConnectionState(dispatch=lambda *args: None, handlers={},
+                            hooks={}, syncer=None, http=None, loop=loop,
+                            **options)
+    intents: discord.Intents = state._intents
+    nonces: List[str] = []
+
+    async def chunker(guild_id: int, *, nonce: str) -> None:
+        nonces.append(nonce)
+    state.chunker = chunker  # type: ignore
+
+    gc.collect()
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    state.user = discord.ClientUser(state=state,
+                                    data=user_payload(BOT, is_bot=True))
+    state.parse_guild_create(guild_payload(args.members, online,
+                                           intents.presences))
+    guild = state._get_guild(GUILD)
+    if state._guild_needs_chunking(guild):
+        while not nonces:  # Let the chunk request start.
+            await asyncio.sleep(0)
+    for nonce in nonces:
+        ids = range(FIRST_MEMBER, FIRST_MEMBER + args.members)
+        count = -(-len(ids) // 1000)
+        for index in range(count):
+            state.parse_guild_members_chunk({
+                'guild_id': str(GUILD), 'nonce': nonce,
+                'chunk_index': index, 'chunk_count': count,
+                'members': [member_payload(member) for member
+                            in ids[index * 1000:(index + 1) * 1000]],
+            })
+    await asyncio.sleep(0)
+    gc.collect()
+    startup = tracemalloc.get_traced_memory()[0] - base
+
+    received, parsing = 0, 0.0
+    parsers: Dict[str, Callable[[Dict[str, Any]], None]] = state.parsers
+    for name, intent, data in event_payloads(args.events, args.members,
+                                             online, args.seed):
+        if not getattr(intents, intent):
+            continue  # Never sent by Discord.
+        received += 1
+        started = time.perf_counter()
+        parsers[name](data)
+        parsing += time.perf_counter() - started
+    gc.collect()
+    after = tracemalloc.get_traced_memory()[0] - base
+    tracemalloc.stop()
+    return {
+        'startup': startup, 'after': after, 'members': len(guild.members),
+        'users': len(state._users),
+        'messages': len(state._messages or ()),
+        'received': received, 'parsing': parsing,
+    }
+
+
+async def run(args: argparse.Namespace) -> None:
+    rng = random.Random(args.seed)
+    online = rng.sample(range(FIRST_MEMBER, FIRST_MEMBER + args.members),
+                        int(args.members * args.online))
+    results = {name: await measure(options, args, online)
+               for name, options in configs().items()}
+    print(f"{args.members} members, {len(online)} online, "
+          f"{args.events} events")
+    print(f"{'':4} {'startup MiB':>11} {'after MiB':>9} {'members':>8} "
+          f"{'users':>7} {'messages':>8} {'received':>8} {'parse s':>7}")
+    for name, result in results.items():
+        print(f"{name:4} {result['startup'] / 2**20:11.1f} "
+              f"{result['after'] / 2**20:9.1f} {result['members']:8} "
+              f"{result['users']:7} {result['messages']:8} "
+              f"{result['received']:8} {result['parsing']:7.2f}")
+    old, new = results['old'], results['new']
+    print(f"new/old: memory {new['after'] / old['after']:.1%}, "
+          f"events received {new['received'] / old['received']:.1%}, "
+          f"parse time {new['parsing'] / old['parsing']:.1%}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawTextHelpFormatter
+    )
+    parser.add_argument('--members', type=int, default=50000)
+    parser.add_argument('--online', type=float, default=0.1,
+                        help="fraction of members online")
+    parser.add_argument('--events', type=int, default=100000)
+    parser.add_argument('--seed', type=int, default=0)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,497 @@
+"""Load-test the bot's event handlers, offline.
+
+Drives the real `wmbot.bot` (with the `cogs` extension loaded) with
+synthetic `discord.Message`s at configurable rates, through the same
+`on_message` the gateway calls:
+  chat      -- ordinary guild messages, noted as activity and dropped;
+  commands  -- a mix of `~xtools`, `~ca`, `~audit`, `~version`, etc.,
+               sent by members with and without the mod role;
+  auth      -- WM Auth Bot verification announcements, each of
+               --auth-batch lines, which go through `reportBlocks`.
+--burst adds that many commands at once every --burst-every seconds.
+
+Nothing leaves the process.  Discord's HTTP calls (`send_message`,
+`send_files`, `send_typing`) are replaced on `bot.http` with fakes that
+sleep for --http-latency, and `mwapi` with a fake client (installed by
+`mwapi.setClient`) that sleeps for --api-latency and answers with
+synthetic accounts, some of them blocked.  The gateway is never
+connected; the guild, channels, roles and members are built from
+payloads with discord.py 1.7's (private) state API.
+
+While running, prints per-interval rows of load, event-loop lag and
+memory.  At the end, prints on_message latency percentiles by kind,
+per-command and report latency (from the bot's own metrics), loop lag,
+and memory growth.  Exits with status 1 if the p99 loop lag is over
+--max-lag ms, so a blocking call in a handler fails the run; --block
+injects one into the fake API to show what that looks like.
+
+Usage: python -m benchmarks.loadtest [--duration S] [--chat-rate N]
+         [--command-rate N] [--auth-rate N] [--max-lag MS] [--tracemalloc]
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+import zlib
+from typing import Any, AsyncIterator, Dict, List, Optional, Set, Tuple
+
+GUILD, BOT, AUTH_BOT, MOD_ROLE = 1000, 1001, 1002, 1003
+GENERAL, ADMIN = 1010, 1011
+FIRST_MEMBER = 5000
+
+# constants reads these at import, so they're set before wmbot loads.
+_TMP = tempfile.mkdtemp(prefix='wmbot-loadtest-')
+os.environ.update({
+    'BOT_ID': str(BOT), 'GUILD': str(GUILD), 'AUTH_BOT': str(AUTH_BOT),
+    'MOD_ROLE': str(MOD_ROLE), 'ADMIN_CHANNEL': str(ADMIN),
+    'SERVER_ADMIN': str(FIRST_MEMBER), 'DISCORD_BOT': 'unused',
+    'DB_PATH': os.path.join(_TMP, 'wmbot.db'),
+    'SITEMATRIX_PATH': os.path.join(_TMP, 'sitematrix.json'),
+    'SITEMATRIX_REFRESH': '0', 'METRICS_PORT': '0', 'LOG_FEEDS': '',
+    # Generated commands are spread over users, but all in one channel.
+    'THROTTLE_CHANNEL_RATE': '0',
+})
+
+import discord  # noqa: E402
+
+import metrics  # noqa: E402
+import mwapi  # noqa: E402
+import wmbot  # noqa: E402
+
+bot = wmbot.bot
+_ids = itertools.count(10 ** 17)
+
+
+def user_payload(user_id: int, *, is_bot: bool = False) -> Dict[str, Any]:
+    return {'id': str(user_id), 'username': f"user{user_id}",
+            'discriminator': "1234", 'avatar': None, 'bot': is_bot}
+
+
+def message_payload(content: str, author: Dict[str, Any],
+                    **extra: Any) -> Dict[str, Any]:
+    return {'id': str(next(_ids)), 'content': content, 'author': author,
+            'attachments': [], 'embeds': [], 'edited_timestamp': None,
+            'type': 0, 'pinned': False, 'mention_everyone': False,
+            'tts': False, **extra}
+
+
+class FakeHTTP:
+    """Stands in for the Discord HTTP calls the handlers make."""
+
+    def __init__(self, latency: float) -> None:
+        self.latency = latency
+        self.calls: Dict[str, int] = {}
+        self.sent: Dict[int, int] = {}
+
+    async def _call(self, name: str) -> None:
+        self.calls[name] = self.calls.get(name, 0) + 1
+        if self.latency:
+            await asyncio.sleep(random.expovariate(1 / self.latency))
+
+    async def send_message(self, channel_id: int, content: Optional[str],
+                           **kwargs: Any) -> Dict[str, Any]:
+        await self._call('send_message')
+        self.sent[channel_id] = self.sent.get(channel_id, 0) + 1
+        return message_payload(content or "", user_payload(BOT, is_bot=True),
+                               channel_id=str(channel_id))
+
+    async def send_files(self, channel_id: int, *, files: Any,
+                         content: Optional[str] = None,
+                         **kwargs: Any) -> Dict[str, Any]:
+        return await self.send_message(channel_id, content)
+
+    async def send_typing(self, channel_id: int) -> None:
+        await self._call('send_typing')
+
+
+class FakeAPI:
+    """Stands in for `mwapi.Client`, with synthetic CentralAuth data.
+
+    About `blocked`% of accounts are blocked on a few of their wikis;
+    which ones is a hash of the username, so it's stable across calls.
+    """
+
+    def __init__(self, latency: float, wikis: int, blocked: float,
+                 block: float) -> None:
+        self.latency = latency
+        self.wikis = wikis
+        self.blocked = blocked
+        self.block = block
+        self.requests = 0
+
+    async def _wait(self) -> None:
+        self.requests += 1
+        if self.block:
+            time.sleep(self.block)  # A deliberate regression.
+        if self.latency:
+            await asyncio.sleep(random.expovariate(1 / self.latency))
+
+    def _account(self, username: str) -> Tuple[int, bool]:
+        crc = zlib.crc32(username.encode())
+        return crc % 50000, crc % 10000 < self.blocked * 100
+
+    async def get(self, site: str, action: str,
+                  params: Dict[str, str]) -> Dict[str, Any]:
+        await self._wait()
+        editcount, blocked = self._account(params['guiuser'])
+        info: Dict[str, Any] = {'name': params['guiuser'],
+                                'editcount': editcount}
+        if blocked:
+            info['locked'] = ""
+        return {'query': {'globaluserinfo': info}}
+
+    async def stream(self, site: str, action: str, params: Dict[str, str],
+                     chunk_size: int = 65536) -> AsyncIterator[bytes]:
+        await self._wait()
+        _, blocked = self._account(params['guiuser'])
+        merged = []
+        for i in range(self.wikis):
+            wiki: Dict[str, Any] = {'wiki': f"wiki{i}", 'editcount': i,
+                                    'method': "login"}
+            if blocked and i % 50 == 0:
+                wiki['blocked'] = {'expiry': "infinity",
+                                   'reason': "Load test"}
+            merged.append(wiki)
+        body = json.dumps({'query': {'globaluserinfo': {
+            'name': params['guiuser'], 'merged': merged
+        }}}).encode()
+        for start in range(0, len(body), chunk_size):
+            yield body[start:start + chunk_size]
+
+    async def getIfChanged(self, *args: Any, **kwargs: Any) -> Any:
+        return None, kwargs.get('etag'), kwargs.get('lastModified')
+
+    async def close(self) -> None:
+        pass
+
+
+class World:
+    """The guild, channels and members messages are sent from."""
+
+    def __init__(self, members: int, mods: int) -> None:
+        state = bot._connection
+        state.user = discord.ClientUser(
+            state=state, data=user_payload(BOT, is_bot=True)
+        )
+        role = {'permissions': "0", 'color': 0, 'hoist': False,
+                'managed': False, 'mentionable': False}
+        channel = {'type': 0, 'position': 0, 'permission_overwrites': []}
+        self.guild = discord.Guild(state=state, data={
+            'id': str(GUILD), 'name': "Load test",
+            'roles': [{**role, 'id': str(GUILD), 'name': "@everyone",
+                       'position': 0},
+                      {**role, 'id': str(MOD_ROLE), 'name': "Mod",
+                       'position': 1}],
+            'channels': [{**channel, 'id': str(GENERAL), 'name': "general"},
+                         {**channel, 'id': str(ADMIN), 'name': "admin"}],
+            'member_count': members,
+        })
+        state._add_guild(self.guild)
+        self.users = []
+        for idx in range(members):
+            user = user_payload(FIRST_MEMBER + idx)
+            self.guild._add_member(discord.Member(
+                state=state, guild=self.guild,
+                data={'user': user,
+                      'roles': [str(MOD_ROLE)] if idx < mods else [],
+                      'joined_at': "2021-01-01T00:00:00+00:00"}
+            ))
+            self.users.append(user)
+        # Help looks up the bot's own member for the prefix.
+        self.guild._add_member(discord.Member(
+            state=state, guild=self.guild,
+            data={'user': user_payload(BOT, is_bot=True), 'roles': [],
+                  'joined_at': "2021-01-01T00:00:00+00:00"}
+        ))
+        self.mods = self.users[:mods]
+        self.general = self.guild.get_channel(GENERAL)
+        self.dm = discord.DMChannel(me=state.user, state=state, data={
+            'id': str(next(_ids)), 'recipients': [self.users[-1]]
+        })
+        self.auth_bot = user_payload(AUTH_BOT, is_bot=True)
+        bot.admin_channel = self.guild.get_channel(ADMIN)
+        bot.guild = self.guild
+        wmbot.messageFilter.self_id = BOT
+
+    def message(self, content: str, author: Dict[str, Any],
+                channel: Any = None) -> discord.Message:
+        channel = channel or self.general
+        return discord.Message(
+            state=bot._connection, channel=channel,
+            data=message_payload(content, author,
+                                 channel_id=str(channel.id))
+        )
+
+
+class Generator:
+    """Builds the synthetic messages for each kind of traffic."""
+
+    COMMANDS = [
+        (10, False, "~xtools full {0}"),
+        (4, False, "~xtools tc {0} | {1} | {2}"),
+        (8, False, "~ca {0}"),
+        (3, False, "~ca {0} | {1}"),
+        (2, False, "~version"),
+        (1, False, "~help"),
+        (2, True, "~audit {0} | {1} | {2} | {3} | {4}"),
+        (1, True, "~metrics"),
+    ]
+
+    def __init__(self, world: World, usernames: int, auth_batch: int,
+                 seed: int) -> None:
+        self.world = world
+        self.rng = random.Random(seed)
+        self.usernames = [f"Load test {i}" for i in range(usernames)]
+        self.auth_batch = auth_batch
+        self._weights = [weight for weight, _, _ in self.COMMANDS]
+
+    def _names(self, count: int) -> List[str]:
+        return self.rng.sample(self.usernames, count)
+
+    def chat(self) -> discord.Message:
+        return self.world.message(
+            "just chatting about wiki things " * self.rng.randint(1, 8),
+            self.rng.choice(self.world.users)
+        )
+
+    def command(self) -> discord.Message:
+        _, mod_only, template = self.rng.choices(self.COMMANDS,
+                                                 self._weights)[0]
+        author = self.rng.choice(self.world.mods if mod_only
+                                 else self.world.users)
+        return self.world.message(template.format(*self._names(5)), author)
+
+    def auth(self) -> discord.Message:
+        lines = [f"<@{self.rng.choice(self.world.users)['id']}> "
+                 f"authenticated as User:{name}"
+                 for name in self._names(self.auth_batch)]
+        return self.world.message("\n".join(lines), self.world.auth_bot)
+
+    def dm(self) -> discord.Message:
+        return self.world.message("hello?", self.world.users[-1],
+                                  channel=self.world.dm)
+
+
+class Stats:
+    """Handler latencies, by kind of message, and event-loop lag.
+
+    Raw samples are kept, so these percentiles are exact, unlike the
+    bucketed ones from the bot's own histograms.
+    """
+
+    def __init__(self) -> None:
+        self.handlers: Dict[str, List[float]] = {}
+        self.errors = 0
+        self.lag: List[float] = []
+        self.interval_lag: List[float] = []
+
+    def observe(self, kind: str, seconds: float) -> None:
+        self.handlers.setdefault(kind, []).append(seconds)
+
+    def observe_lag(self, seconds: float) -> None:
+        self.lag.append(seconds)
+        self.interval_lag.append(seconds)
+
+
+def rss_mib() -> float:
+    """Current resident set size; peak RSS where /proc isn't available."""
+    try:
+        with open('/proc/self/statm') as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+    except (OSError, ValueError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def quantile(samples: List[float], q: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def percentiles(samples: List[float]) -> str:
+    return (" ".join(f"p{int(q * 100)}={quantile(samples, q) * 1000:.1f}ms"
+                     for q in (0.5, 0.95, 0.99))
+            + f" max={max(samples, default=0.0) * 1000:.1f}ms")
+
+
+def bucketed(histogram: metrics.Histogram) -> str:
+    return " ".join(f"p{int(q * 100)}<={histogram.quantile(q) * 1000:.1f}ms"
+                    for q in (0.5, 0.95, 0.99))
+
+
+async def handle(kind: str, message: discord.Message, stats: Stats) -> None:
+    start = time.perf_counter()
+    try:
+        await wmbot.on_message(message)
+    except Exception:
+        stats.errors += 1
+    stats.observe(kind, time.perf_counter() - start)
+
+
+async def monitor_lag(stats: Stats, interval: float) -> None:
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(interval)
+        stats.observe_lag(max(0.0, loop.time() - start - interval))
+
+
+async def drive(kind: str, rate: float, make: Any, until: float,
+                stats: Stats, tasks: Set['asyncio.Task[None]'],
+                rng: random.Random, burst: int = 1) -> int:
+    """Send `burst` messages at a time, at `rate` per second on average."""
+    loop = asyncio.get_running_loop()
+    sent = 0
+    if rate <= 0:
+        return sent
+    due = loop.time()
+    while True:
+        due += rng.expovariate(rate)
+        if due >= until:
+            return sent
+        await asyncio.sleep(due - loop.time())
+        for _ in range(burst):
+            task = loop.create_task(handle(kind, make(), stats))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+            sent += 1
+
+
+async def run(args: argparse.Namespace) -> int:
+    http = FakeHTTP(args.http_latency / 1000)
+    for name in ('send_message', 'send_files', 'send_typing'):
+        setattr(bot.http, name, getattr(http, name))
+    api = FakeAPI(args.api_latency / 1000, args.wikis, args.blocked,
+                  args.block / 1000)
+    mwapi.setClient(api)  # type: ignore
+    world = World(args.members, args.mods)
+    generator = Generator(world, args.usernames, args.auth_batch, args.seed)
+    await bot.startServices()
+
+    stats = Stats()
+    tasks: Set['asyncio.Task[None]'] = set()
+    loop = asyncio.get_running_loop()
+    monitor = loop.create_task(monitor_lag(stats, args.lag_interval / 1000))
+    rss_start = rss_mib()
+    if args.tracemalloc:
+        tracemalloc.start()
+        trace_start = tracemalloc.take_snapshot()
+
+    until = loop.time() + args.duration
+    rng = random.Random(args.seed)
+    drivers = asyncio.gather(
+        drive('chat', args.chat_rate, generator.chat, until, stats, tasks,
+              rng),
+        drive('command', args.command_rate, generator.command, until,
+              stats, tasks, rng),
+        drive('auth', args.auth_rate, generator.auth, until, stats, tasks,
+              rng),
+        drive('dm', args.dm_rate, generator.dm, until, stats, tasks, rng),
+        drive('command', 1 / args.burst_every if args.burst else 0,
+              generator.command, until, stats, tasks, rng, args.burst),
+    )
+    print(f"{'t':>5} {'handled':>8} {'in flight':>9} {'reports q':>9} "
+          f"{'lag p99':>8} {'lag max':>8} {'RSS MiB':>8}")
+    started, handled = loop.time(), 0
+    while not drivers.done():
+        await asyncio.wait([drivers], timeout=args.interval)
+        lag, stats.interval_lag = stats.interval_lag, []
+        total = sum(map(len, stats.handlers.values()))
+        print(f"{loop.time() - started:5.0f} {total - handled:8} "
+              f"{len(tasks):9} {len(bot.reports):9} "
+              f"{quantile(lag, 0.99) * 1000:6.1f}ms "
+              f"{max(lag, default=0.0) * 1000:6.1f}ms {rss_mib():8.1f}")
+        handled = total
+    sent = sum(await drivers)
+    await asyncio.gather(*tasks)
+    drain_start = loop.time()
+    await bot.reports.close()
+    await bot.sender.close()
+    drained = loop.time() - drain_start
+    monitor.cancel()
+    rss_end = rss_mib()
+
+    print(f"\n{sent} messages in {args.duration:.0f}s, "
+          f"{stats.errors} handler errors; "
+          f"report queue drained in {drained:.2f}s")
+    print("on_message latency:")
+    for kind, samples in sorted(stats.handlers.items()):
+        print(f"  {kind:>8}: n={len(samples):<7} {percentiles(samples)}")
+    print("Command latency:")
+    for name, histogram in sorted(bot.commandLatency.items()):
+        print(f"  {name:>11}: n={histogram.count:<6} "
+              f"{bucketed(histogram)}")
+    print(f"Reports: n={metrics.REPORT_LATENCY.count} "
+          f"{bucketed(metrics.REPORT_LATENCY)}, "
+          f"{http.sent.get(ADMIN, 0)} admin messages, "
+          f"{bot.reports.dropped} duplicates dropped")
+    print(f"Fake HTTP calls: {http.calls}; fake API requests: "
+          f"{api.requests}")
+    print(f"Loop lag: {percentiles(stats.lag)}")
+    print(f"RSS: {rss_start:.1f} -> {rss_end:.1f} MiB "
+          f"({rss_end - rss_start:+.1f})")
+    if args.tracemalloc:
+        growth = tracemalloc.take_snapshot().compare_to(trace_start,
+                                                        'lineno')
+        print("Top allocation growth:")
+        for stat in growth[:args.tracemalloc]:
+            print(f"  {stat}")
+
+    await bot.close()
+    p99 = quantile(stats.lag, 0.99) * 1000
+    if args.max_lag and p99 > args.max_lag:
+        print(f"FAIL: p99 loop lag {p99:.1f}ms > {args.max_lag}ms")
+        return 1
+    return 0
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawTextHelpFormatter
+    )
+    add = parser.add_argument
+    add('--duration', type=float, default=30, help="seconds of load")
+    add('--chat-rate', type=float, default=200, help="messages/s")
+    add('--command-rate', type=float, default=10, help="messages/s")
+    add('--auth-rate', type=float, default=5, help="messages/s")
+    add('--dm-rate', type=float, default=0.5, help="messages/s")
+    add('--auth-batch', type=int, default=1,
+        help="verifications per auth-bot message")
+    add('--burst', type=int, default=0, help="commands per burst")
+    add('--burst-every', type=float, default=5, help="seconds")
+    add('--http-latency', type=float, default=50, help="mean ms")
+    add('--api-latency', type=float, default=150, help="mean ms")
+    add('--block', type=float, default=0,
+        help="ms of blocking sleep per API request (a fake regression)")
+    add('--wikis', type=int, default=200, help="wikis per account")
+    add('--blocked', type=float, default=5, help="%% of accounts blocked")
+    add('--members', type=int, default=2000)
+    add('--mods', type=int, default=20)
+    add('--usernames', type=int, default=20000,
+        help="distinct wiki usernames to draw from")
+    add('--interval', type=float, default=5, help="seconds between rows")
+    add('--lag-interval', type=float, default=10,
+        help="ms between loop-lag probes")
+    add('--max-lag', type=float, default=0,
+        help="fail if p99 loop lag exceeds this many ms")
+    add('--tracemalloc', type=int, default=0, metavar='N',
+        help="trace allocations and show the top N growth sites")
+    add('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    bot.load_extension('cogs')
+    # Everything discord.py schedules is bound to the bot's loop.
+    sys.exit(bot.loop.run_until_complete(run(args)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,209 @@
+"""Replay log pages through `logevents.LogTail`, offline.
+
+Serves `list=logevents` pages from a local aiohttp stub, points the
+shared `mwapi` client at it, and tails one feed until it's caught up,
+against an index of --verified usernames.  Reports events read,
+matches, requests, and throughput, and checks the cursor was saved.
+
+Each match also makes LogTail re-fetch the user's state, which the
+stub answers with one block.
+
+Pages are synthetic by default.  To replay real ones, record them
+first (this is the only mode that touches the network):
+  python -m benchmarks.logevents --record FILE --site en.wikipedia.org
+      --letype block --start 20240101000000 --pages 5
+then replay them with --replay FILE.  A recording is JSON lines of
+  {"site": ..., "letype": ..., "lecontinue": ..., "response": {...}}
+
+Usage: python -m benchmarks.logevents [--replay FILE] [--events N]
+         [--verified N] [--limit N]
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import tempfile
+import time
+from typing import Any, Dict, List, Tuple
+
+from aiohttp import web
+
+import logevents
+import mwapi
+import store
+
+Page = Dict[str, Any]
+Pages = Dict[Tuple[str, str, str], Page]
+EMPTY = {'batchcomplete': "", 'query': {'logevents': []}}
+# Answers LogTail.refresh's globaluserinfo requests after each match.
+BLOCKED = {'batchcomplete': "", 'query': {'globaluserinfo': {
+    'editcount': 1,
+    'merged': [{'wiki': "enwiki",
+                'blocked': {'reason': "Vandalism", 'expiry': "infinity"}}],
+}}}
+
+
+def synthesize(events: int, limit: int, seed: int = 0
+               ) -> Tuple[List[Dict[str, Any]], str]:
+    """Build a recording of `events` block log events, `limit` a page."""
+    rng = random.Random(seed)
+    start = 1609459200  # 2021-01-01
+    records, cursor = [], time.strftime("%Y%m%d%H%M%S|1",
+                                        time.gmtime(start))
+    first = cursor
+    for offset in range(0, events, limit):
+        page = []
+        for logid in range(offset + 1, min(offset + limit, events) + 1):
+            action = rng.choice(('block', 'block', 'reblock', 'unblock'))
+            page.append({
+                'logid': logid, 'ns': 2, 'type': 'block', 'action': action,
+                'title': f"User:Log test {rng.randrange(events)}",
+                'user': "Admin", 'comment': "Vandalism",
+                'timestamp': time.strftime("%Y-%m-%dT%H:%M:%SZ",
+                                           time.gmtime(start + logid)),
+                'params': {'duration': "1 week"} if action != 'unblock'
+                else {},
+            })
+        response: Page = {'batchcomplete': "", 'query': {'logevents': page}}
+        next_id = offset + limit + 1
+        if next_id <= events:
+            response['continue'] = {
+                'lecontinue': time.strftime(
+                    "%Y%m%d%H%M%S", time.gmtime(start + next_id)
+                ) + f"|{next_id}",
+                'continue': "-||"
+            }
+        records.append({'site': "en.wikipedia.org", 'letype': "block",
+                        'lecontinue': cursor, 'response': response})
+        cursor = response.get('continue', {}).get('lecontinue', "")
+    return records, first
+
+
+async def record(args: argparse.Namespace) -> None:
+    client = mwapi.getClient()
+    cursor = f"{args.start}|0"
+    with open(args.record, 'w') as f:
+        for _ in range(args.pages):
+            response = await client.get(args.site, 'query', {
+                'list': 'logevents', 'letype': args.letype,
+                'leprop': logevents.LEPROP, 'ledir': 'newer',
+                'lelimit': str(args.limit), 'lecontinue': cursor,
+                'continue': '-||',
+            })
+            f.write(json.dumps({'site': args.site, 'letype': args.letype,
+                                'lecontinue': cursor,
+                                'response': response}) + "\n")
+            if 'continue' not in response:
+                break
+            cursor = response['continue']['lecontinue']
+    await mwapi.close()
+    print(f"Recorded to {args.record}")
+
+
+async def serve(pages: Pages) -> Tuple[web.AppRunner, int, List[int]]:
+    """Serve recorded pages; anything not recorded gets an empty page."""
+    requests = [0]
+
+    async def handle(request: web.Request) -> web.Response:
+        requests[0] += 1
+        query = request.query
+        if query.get('meta') == 'globaluserinfo':
+            return web.json_response(BLOCKED)
+        page = pages.get((request.match_info['site'],
+                          query.get('letype', ""),
+                          query.get('lecontinue', "")), EMPTY)
+        return web.json_response(page)
+
+    app = web.Application()
+    app.router.add_get('/{site}/api.php', handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]  # type: ignore
+    return runner, port, requests
+
+
+async def replay(args: argparse.Namespace) -> None:
+    if args.replay:
+        with open(args.replay) as f:
+            records = [json.loads(line) for line in f if line.strip()]
+        first = records[0]['lecontinue']
+    else:
+        records, first = synthesize(args.events, args.limit)
+    pages = {(r['site'], r['letype'], r['lecontinue']): r['response']
+             for r in records}
+    feed = logevents.Feed(records[0]['site'], records[0]['letype'])
+    targets = sorted({name for r in records
+                      for event in r['response']['query']['logevents']
+                      for name in [logevents.target_name(event)] if name})
+
+    runner, port, requests = await serve(pages)
+    mwapi.setClient(mwapi.Client(
+        template=f"http://127.0.0.1:{port}/{{site}}/api.php", retries=0
+    ))
+    db = store.Store(os.path.join(tempfile.mkdtemp(), 'logevents.db'))
+    await db.open()
+    db.record_cursor(str(feed), first)
+    await db.flush()
+
+    alerts: List[str] = []
+
+    async def alert(text: str) -> None:
+        alerts.append(text)
+
+    tail = logevents.LogTail(db, alert, [feed], max_pages=10 ** 6)
+    rng = random.Random(args.seed)
+    verified = rng.sample(targets, min(args.verified, len(targets)))
+    for idx, name in enumerate(verified):
+        tail.watch(name, f"<@{idx}>")
+    # Pad the index to a realistic size with users who aren't in the log.
+    for idx in range(args.index_size):
+        tail.watch(f"Not in log {idx}", f"<@x{idx}>")
+
+    start = time.perf_counter()
+    caught_up = await tail.poll(feed)
+    elapsed = time.perf_counter() - start
+    await db.flush()
+    saved = await db.get_cursor(str(feed))
+    events = sum(len(r['response']['query']['logevents']) for r in records)
+    print(f"{feed}: {events} events in {len(records)} pages, "
+          f"{len(tail)} users indexed")
+    print(f"  caught up: {caught_up}, requests: {requests[0]}, "
+          f"alerts: {len(alerts)}")
+    print(f"  {elapsed:.3f}s, {events / elapsed:,.0f} events/s")
+    print(f"  cursor saved: {saved}")
+    if verified:
+        refreshed = await db.get_block_check(verified[0], 3600)
+        print(f"  state recorded after a match: {refreshed is not None}")
+    for text in alerts[:3]:
+        print(f"  e.g. {text}")
+
+    await db.close()
+    await mwapi.close()
+    await runner.cleanup()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawTextHelpFormatter
+    )
+    parser.add_argument('--replay', metavar='FILE')
+    parser.add_argument('--record', metavar='FILE')
+    parser.add_argument('--site', default="en.wikipedia.org")
+    parser.add_argument('--letype', default="block")
+    parser.add_argument('--start', help="YYYYMMDDHHMMSS, for --record")
+    parser.add_argument('--pages', type=int, default=5)
+    parser.add_argument('--events', type=int, default=20000)
+    parser.add_argument('--limit', type=int, default=500)
+    parser.add_argument('--verified', type=int, default=50,
+                        help="log targets to add to the index")
+    parser.add_argument('--index-size', type=int, default=50000)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    asyncio.run(record(args) if args.record else replay(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,188 @@
+"""Exercise `mwapi.Client`'s retries against a local stub API.
+
+Starts an aiohttp server on 127.0.0.1 whose responses are scripted per
+scenario (the `site` in the URL), points a Client at it through its
+`template`, and checks, for each scenario, the result, the number of
+requests made, the retries counted in `metrics.API_RETRIES`, and that
+the time taken covers the backoff (or Retry-After) it should have
+waited:
+  retry-after  -- a 429 with Retry-After, then success;
+  retry-cap    -- a 429 asking for an hour: waits only the client's
+                  max_delay, then success;
+  retry-bad    -- 503s with a negative and an unparseable Retry-After:
+                  the usual backoff, then success;
+  5xx          -- a 502 and a 503, then success;
+  maxlag       -- a maxlag API error (flagged in its header), then
+                  success;
+  maxlag-out   -- maxlag on every attempt: APIError once retries run out;
+  5xx-out      -- a 500 on every attempt: ClientResponseError;
+  api-error    -- a non-maxlag API error: APIError, not retried;
+  not-found    -- a 404: ClientResponseError, not retried;
+  unreachable  -- nothing listening: ClientConnectionError after retries.
+Prints a row per scenario, and exits with status 1 if any check fails.
+
+Usage: python -m benchmarks.mwapi_retries [--retries N] [--backoff S]
+                                          [--max-delay S]
+"""
+import argparse
+import asyncio
+import json
+import socket
+import sys
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import aiohttp
+from aiohttp import web
+
+import metrics
+import mwapi
+
+# status, headers, body
+Reply = Tuple[int, Dict[str, str], Dict[str, Any]]
+
+OK: Reply = (200, {}, {'query': {'ok': True}})
+MAXLAG: Reply = (200, {'MediaWiki-API-Error': 'maxlag', 'Retry-After': '0'},
+                 {'error': {'code': 'maxlag', 'info': "Waiting for a db"}})
+BADVALUE: Reply = (200, {'MediaWiki-API-Error': 'badvalue'},
+                   {'error': {'code': 'badvalue', 'info': "Bad value"}})
+
+
+class Stub:
+    """Answers each scenario's requests from its script, in order.
+
+    Once a script runs out, its last reply is repeated.
+    """
+
+    def __init__(self, scripts: Dict[str, List[Reply]]) -> None:
+        self.scripts = scripts
+        self.requests: Dict[str, int] = {site: 0 for site in scripts}
+        self.maxlag: Dict[str, Optional[str]] = {}
+
+    async def handle(self, request: web.Request) -> web.Response:
+        site = request.match_info['site']
+        script = self.scripts[site]
+        status, headers, body = script[min(self.requests[site],
+                                           len(script) - 1)]
+        self.requests[site] += 1
+        self.maxlag[site] = request.query.get('maxlag')
+        return web.Response(status=status, headers=headers,
+                            text=json.dumps(body),
+                            content_type='application/json')
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+async def run(args: argparse.Namespace) -> int:
+    retries, backoff, max_delay = args.retries, args.backoff, args.max_delay
+    # The least the client should have slept before giving up, with
+    # the backoff's jitter at its lowest.
+    all_backoff = sum(backoff * 2 ** attempt for attempt in range(retries))
+    # scenario: (script, expected outcome, requests, least seconds)
+    scenarios: Dict[str, Tuple[List[Reply], str, int, float]] = {
+        'retry-after': ([(429, {'Retry-After': '0.3'}, {}), OK],
+                        'ok', 2, 0.3),
+        'retry-cap': ([(429, {'Retry-After': '3600'}, {}), OK],
+                      'ok', 2, max_delay),
+        'retry-bad': ([(503, {'Retry-After': '-5'}, {}),
+                       (503, {'Retry-After': 'soon'}, {}), OK],
+                      'ok', 3, backoff * 3),
+        '5xx': ([(502, {}, {}), (503, {}, {}), OK], 'ok', 3,
+                backoff * 3),
+        'maxlag': ([MAXLAG, OK], 'ok', 2, 0.0),
+        'maxlag-out': ([MAXLAG], 'APIError(maxlag)', retries + 1, 0.0),
+        '5xx-out': ([(500, {}, {})], 'ClientResponseError(500)',
+                    retries + 1, all_backoff),
+        'api-error': ([BADVALUE], 'APIError(badvalue)', 1, 0.0),
+        'not-found': ([(404, {}, {})], 'ClientResponseError(404)', 1, 0.0),
+    }
+    stub = Stub({site: script
+                 for site, (script, *_) in scenarios.items()})
+    app = web.Application()
+    app.router.add_get('/{site}/api.php', stub.handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    port = free_port()
+    await web.TCPSite(runner, '127.0.0.1', port).start()
+
+    client = mwapi.Client(
+        template=f"http://127.0.0.1:{port}/{{site}}/api.php",
+        retries=retries, backoff=backoff, max_delay=max_delay, timeout=5
+    )
+    # Give up on these well before an uncapped delay would end.
+    most = {'retry-cap': max_delay + 1.0,
+            'retry-bad': backoff * 3 * 1.5 + 1.0}
+    # Nothing listens on a second free port.
+    unreachable = mwapi.Client(
+        template=f"http://127.0.0.1:{free_port()}/{{site}}/api.php",
+        retries=retries, backoff=backoff, timeout=5
+    )
+
+    failures = 0
+    print(f"{'scenario':>12} {'outcome':>26} {'requests':>8} "
+          f"{'retries':>7} {'seconds':>7}")
+    for site, (_, expected, requests, least) in [
+            *scenarios.items(),
+            ('unreachable', ([], 'ClientConnectorError', 0, all_backoff))]:
+        api = unreachable if site == 'unreachable' else client
+        retried = metrics.API_RETRIES.value
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(
+                api.get(site, 'query', {'meta': 'siteinfo'}),
+                most.get(site)
+            )
+            outcome = 'ok'
+        except asyncio.TimeoutError:
+            outcome = 'timed out'
+        except mwapi.APIError as error:
+            outcome = f"APIError({error.code})"
+        except aiohttp.ClientResponseError as error:
+            outcome = f"ClientResponseError({error.status})"
+        except aiohttp.ClientConnectionError as error:
+            outcome = type(error).__name__
+        seconds = time.perf_counter() - started
+        retried = metrics.API_RETRIES.value - retried
+        made = stub.requests.get(site, 0)
+        problems = []
+        if outcome != expected:
+            problems.append(f"expected {expected}")
+        if site != 'unreachable':
+            if made != requests:
+                problems.append(f"expected {requests} requests")
+            if retried != made - 1:
+                problems.append("retries miscounted")
+            if stub.maxlag.get(site) != str(api.maxlag):
+                problems.append("maxlag not sent")
+        elif retried != retries:
+            problems.append("retries miscounted")
+        if seconds < least:
+            problems.append(f"waited under {least:.2f}s")
+        failures += bool(problems)
+        print(f"{site:>12} {outcome:>26} {made:8} {retried:7} "
+              f"{seconds:7.2f}" + ("  FAIL: " + "; ".join(problems)
+                                   if problems else ""))
+
+    await client.close()
+    await unreachable.close()
+    await runner.cleanup()
+    return 1 if failures else 0
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawTextHelpFormatter
+    )
+    parser.add_argument('--retries', type=int, default=2)
+    parser.add_argument('--backoff', type=float, default=0.05)
+    parser.add_argument('--max-delay', type=float, default=0.5)
+    args = parser.parse_args()
+    sys.exit(asyncio.run(run(args)))
+
+
+if __name__ == '__main__':
+    main()
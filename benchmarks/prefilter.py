@@ -0,0 +1,139 @@
+"""Replay a message stream through the `on_message` pre-filter.
+
+Reports the per-message cost of `prefilter.MessageFilter.classify`,
+and of the old `on_message` path, which awaited `isDM` and
+`checkMessage` and then created a `process_commands` coroutine for
+every message.  Command handling itself is stubbed out in both.
+
+A stream is a JSON-lines file with one message per line:
+  {"content": "...", "author_id": 1, "bot": false, "guild": true,
+   "webhook": false}
+Without --replay, a synthetic stream (mostly chat, with some commands,
+bots, webhooks and DMs) is used; --record writes it out for reuse.
+
+Usage: python -m benchmarks.prefilter [--replay FILE] [--record FILE]
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+from types import SimpleNamespace
+from typing import Any, Dict, List
+
+import prefilter
+
+AUTH_BOT, SELF, PREFIX = 100, 200, "~"
+
+
+def synthesize(count: int, seed: int = 0) -> List[Dict[str, Any]]:
+    rng = random.Random(seed)
+    stream = []
+    for _ in range(count):
+        roll = rng.random()
+        record = {'content': "just chatting about wiki things",
+                  'author_id': rng.randrange(1000, 5000),
+                  'bot': False, 'guild': True, 'webhook': False}
+        if roll < 0.05:
+            record['content'] = "~xtools full Example"
+        elif roll < 0.06:
+            record['content'] = "~~struck out~~"
+        elif roll < 0.07:
+            record.update(author_id=AUTH_BOT, bot=True,
+                          content="<@1> authenticated as User:Example")
+        elif roll < 0.09:
+            record.update(author_id=300, bot=True)
+        elif roll < 0.10:
+            record['webhook'] = True
+        elif roll < 0.11:
+            record['guild'] = False
+        stream.append(record)
+    return stream
+
+
+def to_messages(stream: List[Dict[str, Any]]) -> List[SimpleNamespace]:
+    return [SimpleNamespace(
+        content=r['content'],
+        author=SimpleNamespace(id=r['author_id'], bot=r['bot'],
+                               discriminator="0000" if r['webhook']
+                               else "1234"),
+        guild=object() if r['guild'] else None,
+        webhook_id=1 if r['webhook'] else None,
+    ) for r in stream]
+
+
+async def legacy_on_message(message: Any) -> None:
+    async def isDM(message: Any) -> bool:
+        return not message.guild
+
+    async def checkMessage(message: Any) -> bool:
+        if await isDM(message):
+            return True
+        elif message.author.id == AUTH_BOT:
+            return True
+        return False
+
+    async def process_commands(message: Any) -> None:
+        pass
+
+    if message.author.discriminator != "0000":
+        if message.author.id != SELF:
+            if await checkMessage(message) is False:
+                await process_commands(message)
+
+
+async def filtered_on_message(message: Any,
+                              mfilter: prefilter.MessageFilter) -> None:
+    kind = mfilter.classify(message)
+    if kind is not prefilter.Kind.IGNORE and kind is not prefilter.Kind.CHAT:
+        pass  # Dispatch, as in wmbot.on_message.
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--replay', metavar='FILE')
+    parser.add_argument('--record', metavar='FILE')
+    parser.add_argument('--messages', type=int, default=100000)
+    args = parser.parse_args()
+
+    if args.replay:
+        with open(args.replay) as f:
+            stream = [json.loads(line) for line in f if line.strip()]
+    else:
+        stream = synthesize(args.messages)
+    if args.record:
+        with open(args.record, 'w') as f:
+            f.writelines(json.dumps(r) + "\n" for r in stream)
+    messages = to_messages(stream)
+    mfilter = prefilter.MessageFilter(prefix=PREFIX, auth_bot=AUTH_BOT,
+                                      self_id=SELF)
+
+    kinds: Dict[str, int] = {}
+    for message in messages:
+        kind = mfilter.classify(message).name
+        kinds[kind] = kinds.get(kind, 0) + 1
+    print(f"{len(messages)} messages: {kinds}")
+
+    start = time.perf_counter()
+    for message in messages:
+        mfilter.classify(message)
+    elapsed = time.perf_counter() - start
+    print(f"  classify only: {elapsed / len(messages) * 1e9:7.0f} ns/message")
+
+    async def replay() -> None:
+        for name, handler in (
+                ('legacy on_message', legacy_on_message),
+                ('filtered on_message',
+                 lambda m: filtered_on_message(m, mfilter))):
+            start = time.perf_counter()
+            for message in messages:
+                await handler(message)
+            elapsed = time.perf_counter() - start
+            print(f"{name:>19}: {elapsed / len(messages) * 1e9:7.0f} "
+                  "ns/message")
+
+    asyncio.run(replay())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+"""Benchmark compiled projections against the recursive `trim_dict`.
+
+Payloads, already decoded:
+  centralauth  -- globaluserinfo with `merged` on --wikis wikis, some
+                  blocked, trimmed to what `getUserBlocks` needs;
+  xtools       -- an XTools-sized edit-counter result: per-namespace
+                  totals and --pages top-edited pages per namespace,
+                  each with several fields the template drops.
+Each is projected with `trim_dict` (as in `utils`, copied so this
+doesn't need discord.py), with `Projection.one` per record, and with
+`Projection.many` over the whole list; the results are checked equal.
+
+Usage: python -m benchmarks.projection [--wikis N] [--pages N]
+         [--repeat N]
+"""
+import argparse
+import timeit
+from typing import Any, Callable, Dict, List, Tuple
+
+import projection
+
+JSONDict = Dict[str, Any]
+
+
+def trim_dict(base_dict: JSONDict, dict_template: JSONDict) -> JSONDict:
+    trimmed = {k: base_dict[k]
+               for k in dict_template.keys() if k in base_dict.keys()}
+    for k, v in trimmed.items():
+        if isinstance(v, dict):
+            trimmed[k] = trim_dict(v, dict_template[k])
+        elif isinstance(v, list):
+            trimmed[k] = [trim_dict(i, dict_template[k]) for i in v]
+    return trimmed
+
+
+def centralauth(wikis: int) -> Tuple[List[JSONDict], JSONDict]:
+    merged = []
+    for i in range(wikis):
+        entry: JSONDict = {
+            'wiki': f"wiki{i}wiki",
+            'url': f"https://wiki{i}.wikipedia.org",
+            'timestamp': "2015-03-01T12:00:00Z",
+            'method': "login",
+            'editcount': i * 37,
+            'registration': "2015-03-01T12:00:00Z",
+            'groups': ["autoconfirmed", "extendedconfirmed"][:i % 3],
+        }
+        if i % 97 == 0:
+            entry['blocked'] = {'expiry': "infinity",
+                                'reason': "Long-term abuse " * 4}
+        merged.append(entry)
+    return merged, {'wiki': None,
+                    'blocked': {'reason': None, 'expiry': None}}
+
+
+def xtools(pages: int) -> Tuple[List[JSONDict], JSONDict]:
+    namespaces = []
+    for ns in range(30):
+        namespaces.append({
+            'namespace': ns, 'name': f"Namespace {ns}",
+            'total': pages * 40, 'deleted': 12, 'live': pages * 40 - 12,
+            'percentage': 3.3, 'automated': 7, 'reverted': 2,
+            'top_edits': [{
+                'page_title': f"Page {ns}-{idx}", 'namespace': ns,
+                'full_page_title': f"Namespace {ns}:Page {ns}-{idx}",
+                'count': pages - idx, 'assessment': {
+                    'class': "B", 'color': "#b2b2ff",
+                    'category': "Category:B-Class articles",
+                    'badge': "https://example.org/b.png",
+                },
+                'redirect': False, 'displaytitle': None,
+            } for idx in range(pages)],
+        })
+    return namespaces, {
+        'namespace': None, 'total': None,
+        'top_edits': {'page_title': None, 'count': None,
+                      'assessment': {'class': None}},
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawTextHelpFormatter
+    )
+    parser.add_argument('--wikis', type=int, default=900)
+    parser.add_argument('--pages', type=int, default=500)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    for name, (records, template) in (
+            ('centralauth', centralauth(args.wikis)),
+            ('xtools', xtools(args.pages))):
+        compiled = projection.compile_template(template)
+        paths: Dict[str, Callable[[], List[JSONDict]]] = {
+            'trim_dict': lambda: [trim_dict(r, template) for r in records],
+            'one': lambda: [compiled.one(r) for r in records],
+            'many': lambda: compiled.many(records),
+        }
+        expected = paths['trim_dict']()
+        assert all(path() == expected for path in paths.values())
+        print(f"{name}: {len(records)} records")
+        baseline = 0.0
+        for label, path in paths.items():
+            per_call = min(timeit.repeat(path, number=args.repeat,
+                                         repeat=3)) / args.repeat
+            baseline = baseline or per_call
+            print(f"  {label:>9}: {per_call * 1e3:7.2f} ms "
+                  f"({baseline / per_call:4.1f}x)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+"""Check `utils.reportBlocks`' de-duplication against a real Store.
+
+Runs auth-bot verifications of a blocked wiki user through
+`reportBlocks`, with a temporary database and the user's blocks
+already in `utils.userBlocksCache`, so nothing leaves the process:
+  first        -- <@1> verifies as the user: reported;
+  repeat       -- <@1> verifies again: not reported again;
+  new-account  -- <@2> verifies as the same user: reported, as a
+                  second account on a blocked user is what mods need
+                  to see;
+  migrated-*   -- repeat and new-account, on a database created with
+                  the old `reports` table, keyed on the wiki user
+                  alone, and already holding <@1>'s report.
+Prints a row per scenario, and exits with status 1 if any check fails.
+
+Usage: python -m benchmarks.reports
+"""
+import asyncio
+import os
+import sqlite3
+import sys
+import tempfile
+from types import SimpleNamespace
+from typing import List
+
+import authparse
+import store
+import utils
+
+WIKI_USER = "Blocked example"
+BLOCKS = [["enwiki", "Sockpuppetry until infinity"]]
+OLD_REPORTS = """
+CREATE TABLE reports (
+    wiki_user TEXT NOT NULL,
+    blocks TEXT NOT NULL,
+    discord_user TEXT NOT NULL,
+    reported_at REAL NOT NULL,
+    PRIMARY KEY (wiki_user, blocks)
+);
+INSERT INTO reports VALUES
+    ('Blocked example', '[["enwiki", "Sockpuppetry until infinity"]]',
+     '<@1>', 0);
+"""
+
+
+async def verify(bot: SimpleNamespace, discord_user: str) -> bool:
+    """Whether verifying `discord_user` as WIKI_USER is reported."""
+    report = await utils.reportBlocks(
+        authparse.AuthRecord((discord_user, WIKI_USER)), bot
+    )
+    await bot.store.flush()
+    return report is not None
+
+
+async def run() -> int:
+    utils.userBlocksCache.put(WIKI_USER, BLOCKS)
+    directory = tempfile.mkdtemp()
+
+    fresh = store.Store(os.path.join(directory, 'fresh.db'))
+    await fresh.open()
+    bot = SimpleNamespace(store=fresh, logTail=None)
+    results: List[List[object]] = [
+        ['first', await verify(bot, "<@1>"), True],
+        ['repeat', await verify(bot, "<@1>"), False],
+        ['new-account', await verify(bot, "<@2>"), True],
+    ]
+    await fresh.close()
+
+    path = os.path.join(directory, 'old.db')
+    with sqlite3.connect(path) as conn:
+        conn.executescript(OLD_REPORTS)
+    conn.close()
+    old = store.Store(path)
+    await old.open()
+    bot = SimpleNamespace(store=old, logTail=None)
+    results += [
+        ['migrated-repeat', await verify(bot, "<@1>"), False],
+        ['migrated-new', await verify(bot, "<@2>"), True],
+    ]
+    await old.close()
+
+    failures = 0
+    print(f"{'scenario':>15} {'reported':>8}")
+    for name, reported, expected in results:
+        failed = reported != expected
+        failures += failed
+        print(f"{name:>15} {str(reported):>8}"
+              + (f"  FAIL: expected {expected}" if failed else ""))
+    return 1 if failures else 0
+
+
+def main() -> None:
+    sys.exit(asyncio.run(run()))
+
+
+if __name__ == '__main__':
+    main()
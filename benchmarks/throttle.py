@@ -0,0 +1,94 @@
+"""Benchmark `throttle.Throttle.allow` as the number of keys grows.
+
+For each size, fills the windows with that many users and channels,
+then times `allow` on a fake clock that advances with each call, so
+windows roll over and idle keys are swept as they would be live:
+  allowed    -- random tracked users, each kept under its limit;
+  throttled  -- one user over its limit, i.e. the cost of refusing.
+Also reports memory per tracked key, and checks that once every key
+has gone idle, ordinary traffic sweeps them all away.
+
+Usage: python -m benchmarks.throttle [--sizes N,N,...] [--calls N]
+"""
+import argparse
+import random
+import time
+import tracemalloc
+from typing import List, Tuple
+
+import throttle
+
+
+class Clock:
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def build(size: int, clock: Clock) -> throttle.Throttle:
+    limits = throttle.Throttle(user_rate=5, user_per=60,
+                               channel_rate=20, channel_per=60)
+    for windows in (limits.users, limits.channels, limits._told):
+        windows._clock = clock  # type: ignore
+    # Spread over the window, as real traffic would be.
+    for key in range(size):
+        clock.now = key * 30 / size
+        limits.allow(key, key)
+    return limits
+
+
+def time_calls(limits: throttle.Throttle, clock: Clock,
+               calls: List[Tuple[int, int]], step: float) -> float:
+    start = clock.now
+    began = time.perf_counter()
+    for i, (user, channel) in enumerate(calls):
+        clock.now = start + i * step
+        try:
+            limits.allow(user, channel)
+        except throttle.Throttled:
+            pass
+    return (time.perf_counter() - began) / len(calls)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawTextHelpFormatter
+    )
+    parser.add_argument('--sizes', default="1000,10000,100000")
+    parser.add_argument('--calls', type=int, default=200000)
+    args = parser.parse_args()
+
+    print(f"{'keys':>8} {'B/key':>6} {'allowed':>9} {'throttled':>9}")
+    for size in map(int, args.sizes.split(",")):
+        clock = Clock()
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        limits = build(size, clock)
+        # Users and channels, so two keys per index.
+        per_key = (tracemalloc.get_traced_memory()[0] - before) / size / 2
+        tracemalloc.stop()
+        rng = random.Random(size)
+        keys = [rng.randrange(size) for _ in range(args.calls)]
+        # Slow enough that each key stays under 5 a minute.
+        allowed = time_calls(limits, clock, list(zip(keys, keys)),
+                             step=15 / size)
+        throttled = time_calls(limits, clock, [(0, 0)] * args.calls,
+                               step=1e-6)
+        print(f"{size:8} {per_key:6.0f} {allowed * 1e9:7.0f}ns "
+              f"{throttled * 1e9:7.0f}ns")
+
+        # Everyone goes idle for two windows; then a few users return.
+        clock.now += 120
+        assert limits.users is not None
+        for call in range(size):
+            limits.users.hit(-1 - call % 50)
+            if len(limits.users) <= 50:
+                break
+        print(f"{'':8} idle keys swept after {call + 1} calls; "
+              f"{len(limits.users)} left")
+
+
+if __name__ == '__main__':
+    main()
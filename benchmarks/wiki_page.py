@@ -0,0 +1,100 @@
+"""Benchmark interwiki prefix resolution in `utils.get_wiki_page`.
+
+Compares the current table-driven resolver with the previous
+implementation (kept below as `legacy_get_wiki_page`), over targets
+built from every language code: bare, lang-prefixed, and combined with
+each family prefix in both orders.  Also checks that both agree.
+
+Usage: python -m benchmarks.wiki_page [--repeat N]
+"""
+import argparse
+import timeit
+from typing import Callable, List, Tuple
+
+from discord.ext.commands import UserInputError
+
+import utils
+from utils import (_VALID_PREFIXES, _WIKI_FAMILIES, _WIKI_LANGS,
+                   _WIKI_PSEUDOLANGS, get_page)
+
+
+def legacy_get_wiki_page(*,
+                         target: str,
+                         basepage: str = "",
+                         suffix: str = "",
+                         defaults: Tuple[str, str] = ('wikipedia', 'en')
+                         ) -> str:
+    parts = target.lstrip(':').split(':')
+    for idx, part in enumerate(parts):
+        if part.lower() not in _VALID_PREFIXES:
+            subpage = ':'.join(parts[idx:])
+            prefixes = [i.lower() for i in parts[:idx]]
+            break
+    else:
+        subpage = parts[-1]
+        prefixes = []
+    family, lang = defaults
+
+    if len(prefixes) > 2:
+        raise UserInputError
+    if len(prefixes) == 2:
+        if not all(len(set(prefixes) & s) == 1
+                   for s in (_WIKI_FAMILIES.keys(), _WIKI_LANGS)):
+            raise UserInputError
+        prefixes.sort(key=lambda x: x in _WIKI_FAMILIES)
+        if prefixes[1] in _WIKI_PSEUDOLANGS:
+            raise UserInputError
+        family = _WIKI_FAMILIES[prefixes[1]]
+        lang = prefixes[0]
+    elif prefixes:
+        family = _WIKI_FAMILIES.get(prefixes[0], family)
+        lang = _WIKI_PSEUDOLANGS.get(
+            prefixes[0],
+            prefixes[0] if prefixes[0] in _WIKI_LANGS else lang
+        )
+
+    return get_page(base_url=f"https://{lang}.{family}.org/wiki/",
+                    basepage=basepage, subpage=subpage, suffix=suffix)
+
+
+def make_targets() -> List[str]:
+    targets = ["Example", ":Example", "Talk:Example", "en:fr:Example",
+               "x:y:z"]
+    for lang in sorted(_WIKI_LANGS):
+        targets.append(f"{lang}:User:Example")
+        for family in ('w', 's', 'D', 'species', 'voy'):
+            targets.append(f"{family}:{lang}:Example")
+            targets.append(f"{lang.upper()}:{family}:Example")
+    for prefix in sorted(_WIKI_FAMILIES.keys() | _WIKI_PSEUDOLANGS.keys()):
+        targets.append(f"{prefix}:Example")
+    return targets
+
+
+def resolve_all(func: Callable[..., str], targets: List[str]) -> List[str]:
+    results = []
+    for target in targets:
+        try:
+            results.append(func(target=target))
+        except UserInputError:
+            results.append("UserInputError")
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    targets = make_targets()
+    assert (resolve_all(legacy_get_wiki_page, targets)
+            == resolve_all(utils.get_wiki_page, targets))
+    print(f"{len(targets)} targets over {len(_WIKI_LANGS)} language codes")
+    for name, func in (('legacy', legacy_get_wiki_page),
+                       ('table', utils.get_wiki_page)):
+        best = min(timeit.repeat(lambda: resolve_all(func, targets),
+                                 number=1, repeat=args.repeat))
+        print(f"{name:>6}: {len(targets) / best:10.0f} targets/s")
+
+
+if __name__ == '__main__':
+    main()
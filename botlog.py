@@ -0,0 +1,217 @@
+"""Non-blocking logging to rotating files and admin-channel digests.
+
+`Pipeline.install` puts a `QueueHandler` on the root logger, so
+logging from the event loop only appends to a queue.  A
+`QueueListener` thread takes records off it and writes them to a
+rotating file and stderr, and hands those at `digest_level` or above
+to a `DigestHandler`.  That only counts them, by line; a task on the
+loop sends the counts to the admin channel as one digest every
+`digest_interval` seconds, of at most `digest_lines` lines, so an
+error storm costs one message per interval however many records it
+logs.
+"""
+import asyncio
+import logging
+import logging.handlers
+import queue
+import sys
+import threading
+from typing import Callable, Dict, List, Optional, Tuple
+
+log = logging.getLogger(__name__)
+
+FILE_FORMAT = "%(asctime)s %(levelname)s %(name)s: %(message)s"
+CONSOLE_FORMAT = "%(levelname)s %(name)s: %(message)s"
+
+
+def _summary(record: logging.LogRecord) -> str:
+    """Shorten a record to one line for a digest.
+
+    For errors, that's the message and the last line of the traceback,
+    which `QueueHandler` has already appended to the message.
+    """
+    lines = record.getMessage().splitlines() or [""]
+    text = lines[0]
+    if len(lines) > 1 and lines[-1].strip():
+        text += f" ({lines[-1].strip()})"
+    return f"{record.levelname} {record.name}: {text}"[:300]
+
+
+class DigestHandler(logging.Handler):
+    """Counts records' lines, from any thread, for `Pipeline` to send.
+
+    Repeats of a line only bump its count, so a storm of the same
+    error takes one entry.
+
+    Attributes:
+      capacity:  An int of the most distinct lines held between
+        digests; records with new lines beyond that are only counted.
+      dropped:  An int of records not held since the last digest.
+    """
+
+    def __init__(self, level: str, capacity: int = 1000) -> None:
+        super().__init__(level)
+        self.capacity = capacity
+        self.dropped = 0
+        self._counts: Dict[str, int] = {}
+        self._counts_lock = threading.Lock()
+
+    def emit(self, record: logging.LogRecord) -> None:
+        try:
+            line = _summary(record)
+        except Exception:
+            self.handleError(record)
+            return
+        with self._counts_lock:
+            if line in self._counts:
+                self._counts[line] += 1
+            elif len(self._counts) < self.capacity:
+                self._counts[line] = 1
+            else:
+                self.dropped += 1
+
+    def take(self) -> Tuple[Dict[str, int], int]:
+        """Empty the buffer.
+
+        Returns:
+          A tuple of a dict of lines to counts, in order of first
+          appearance, and an int of records that weren't held.
+        """
+        with self._counts_lock:
+            counts, self._counts = self._counts, {}
+            dropped, self.dropped = self.dropped, 0
+        return counts, dropped
+
+    def put_back(self, counts: Dict[str, int], dropped: int) -> None:
+        """Return what `take` returned, if it couldn't be sent."""
+        with self._counts_lock:
+            for line, count in self._counts.items():
+                if line in counts or len(counts) < self.capacity:
+                    counts[line] = counts.get(line, 0) + count
+                else:
+                    dropped += count
+            self._counts = counts
+            self.dropped += dropped
+
+
+def digest(counts: Dict[str, int], dropped: int, max_lines: int,
+           limit: int = 1900) -> str:
+    """Format counted lines as one message.
+
+    Returns:
+      A str of at most `max_lines` lines (fewer if they'd go over
+      `limit` characters), in order of first appearance, each with a
+      count if it repeated, and a note of any records left out.
+    """
+    shown: List[str] = []
+    length, omitted = 0, dropped
+    for line, count in counts.items():
+        text = line if count == 1 else f"{line} (×{count})"
+        if len(shown) == max_lines or length + len(text) + 1 > limit:
+            omitted += count
+            continue
+        shown.append(text)
+        length += len(text) + 1
+    text = "\n".join(shown)
+    if omitted:
+        text += f"\n…and {omitted} more; see the log file."
+    return f"```\n{text}\n```"
+
+
+class Pipeline:
+    """The bot's logging: a queue, a listener thread, and digests.
+
+    Attributes:
+      path:  A str of the log file's path, or '' for no file.
+      level:  A str of the lowest level logged at all, e.g. 'INFO'.
+      max_bytes, backups:  When the file reaches `max_bytes`, it's
+        rotated, keeping `backups` old files.
+      digest_level:  A str of the lowest level sent to the admin
+        channel, or '' to send nothing.
+      digest_interval:  A float of seconds between digests.
+      digest_lines:  An int of the most lines in one digest.
+    """
+
+    def __init__(self, *, path: str, level: str,
+                 max_bytes: int, backups: int,
+                 digest_level: str, digest_interval: float,
+                 digest_lines: int) -> None:
+        self.path = path
+        self.level = level
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.digest_level = digest_level
+        self.digest_interval = digest_interval
+        self.digest_lines = digest_lines
+        self.digests = (DigestHandler(digest_level) if digest_level
+                        else None)
+        self._listener: Optional[logging.handlers.QueueListener] = None
+        self._task: Optional['asyncio.Task[None]'] = None
+
+    def install(self) -> None:
+        """Route the root logger through the queue, and start writing."""
+        records: 'queue.SimpleQueue[logging.LogRecord]' = queue.SimpleQueue()
+        console = logging.StreamHandler(sys.stderr)
+        console.setFormatter(logging.Formatter(CONSOLE_FORMAT))
+        handlers: List[logging.Handler] = [console]
+        if self.path:
+            logfile = logging.handlers.RotatingFileHandler(
+                self.path, maxBytes=self.max_bytes,
+                backupCount=self.backups, encoding='utf-8'
+            )
+            logfile.setFormatter(logging.Formatter(FILE_FORMAT))
+            handlers.append(logfile)
+        if self.digests is not None:
+            handlers.append(self.digests)
+        root = logging.getLogger()
+        root.handlers = [logging.handlers.QueueHandler(records)]
+        root.setLevel(self.level)
+        self._listener = logging.handlers.QueueListener(
+            records, *handlers, respect_handler_level=True
+        )
+        self._listener.start()
+
+    def start_digests(self, send: Callable[[str], bool]) -> None:
+        """Start sending digests.
+
+        Args:
+          send:  A function that queues a digest's text for the admin
+            channel, returning False if it can't yet (e.g. before the
+            bot is ready), in which case the lines are kept.
+        """
+        if self.digests is not None and self._task is None:
+            self._task = asyncio.create_task(self._run(send))
+
+    async def _run(self, send: Callable[[str], bool]) -> None:
+        try:
+            while True:
+                await asyncio.sleep(self.digest_interval)
+                self._send(send)
+        except asyncio.CancelledError:
+            self._send(send)
+            raise
+
+    def _send(self, send: Callable[[str], bool]) -> None:
+        assert self.digests is not None
+        counts, dropped = self.digests.take()
+        if not counts and not dropped:
+            return
+        try:
+            if send(digest(counts, dropped, self.digest_lines)):
+                return
+        except Exception:
+            log.exception("Failed to send a log digest")
+        self.digests.put_back(counts, dropped)
+
+    async def close_digests(self) -> None:
+        """Send what's buffered and stop the digest task."""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def stop(self) -> None:
+        """Write out everything still queued and stop the listener."""
+        if self._listener is not None:
+            self._listener.stop()
+            self._listener = None
@@ -0,0 +1,205 @@
+"""Bulk role changes, paced under Discord's limits, and resumable.
+
+`~role` with several members, or a selector, records a job in the
+store (the role, the action, and every member it applies to) before
+changing anything.  `BulkRoles` then works through it, one member at
+a time: each change waits for a token from one bucket shared by every
+job, since Discord limits the member-role routes per guild, and each
+member's outcome is written back as it's applied.  Progress is shown
+by editing one message, at most every `progress_interval` seconds.
+
+If the bot stops part-way, `resume` picks up every unfinished job
+after it restarts, skipping members already done.
+"""
+import asyncio
+import collections
+import logging
+import time
+from typing import Dict, List, Mapping, Optional, Union
+
+from discord import (Guild, HTTPException, Message, NotFound,
+                     PartialMessage, Role)
+from discord.abc import Messageable
+
+import ratelimit
+import store
+
+log = logging.getLogger(__name__)
+
+AnyMessage = Union[Message, PartialMessage]
+
+# Outcomes, in the order they're reported.
+OUTCOMES = ('done', 'skipped', 'missing', 'failed')
+
+
+def describe(job: store.RoleJob, role: Role,
+             counts: Mapping[str, int], total: int, finished: bool) -> str:
+    """Describe a job's progress in one line, e.g.
+
+    Giving **Editor** to 120 members (job 3, by Mod#0001): 45/120 —
+    40 done, 5 skipped
+    """
+    verb = "Giving" if job.action == 'give' else "Taking"
+    prep = "to" if job.action == 'give' else "from"
+    handled = sum(counts.values())
+    state = "finished" if finished else f"{handled}/{total}"
+    details = ", ".join(f"{counts[outcome]} {outcome}"
+                        for outcome in OUTCOMES if counts[outcome])
+    return (f"{verb} **{role.name}** {prep} {total} members "
+            f"(job {job.id}, by {job.requested_by}): {state}"
+            + (f" — {details}" if details else ""))
+
+
+class BulkRoles:
+    """Runs bulk role jobs from the store.
+
+    Attributes:
+      store:  The `store.Store` the jobs are kept in.
+      progress_interval:  A float of the fewest seconds between edits
+        of a job's progress message.
+    """
+
+    def __init__(self, store: store.Store, *, rate: int, per: float,
+                 progress_interval: float = 5.0) -> None:
+        self.store = store
+        self.progress_interval = progress_interval
+        self._bucket = ratelimit.TokenBucket(rate, per)
+        self._tasks: Dict[int, 'asyncio.Task[None]'] = {}
+
+    def __len__(self) -> int:
+        return len(self._tasks)
+
+    async def submit(self, guild: Guild, channel: Messageable,
+                     action: str, role: Role, discord_ids: List[int],
+                     requested_by: str) -> store.RoleJob:
+        """Record a job and start it.
+
+        Args:
+          guild:  The Guild the members are in.
+          channel:  Where to post progress.
+          action:  A str, 'give' or 'take'.
+          role:  The Role to give or take.
+          discord_ids:  A list of int member IDs.
+          requested_by:  A str naming who asked, for the audit log.
+        """
+        job = await self.store.create_role_job(
+            action, role.id, channel.id, requested_by,  # type: ignore
+            discord_ids
+        )
+        self._start(job, guild, role, channel, None)
+        return job
+
+    async def resume(self, guild: Guild) -> int:
+        """Restart every unfinished job in the store.
+
+        Returns:
+          An int of the jobs restarted.
+        """
+        resumed = 0
+        for job in await self.store.unfinished_role_jobs():
+            if job.id in self._tasks:
+                continue
+            role = guild.get_role(job.role_id)
+            channel = guild.get_channel(job.channel_id)
+            if role is None or channel is None:
+                log.warning("Abandoning role job %d: its role or channel "
+                            "is gone", job.id)
+                self.store.finish_role_job(job.id)
+                continue
+            # Edited without fetching it; if it's gone, another is sent.
+            message = (channel.get_partial_message(job.message_id)
+                       if job.message_id is not None else None)
+            self._start(job, guild, role, channel, message)
+            resumed += 1
+        return resumed
+
+    def _start(self, job: store.RoleJob, guild: Guild, role: Role,
+               channel: Messageable,
+               message: Optional[AnyMessage]) -> None:
+        task = asyncio.create_task(
+            self._run(job, guild, role, channel, message)
+        )
+        self._tasks[job.id] = task
+        task.add_done_callback(lambda _: self._done(job.id, task))
+
+    def _done(self, job_id: int, task: 'asyncio.Task[None]') -> None:
+        del self._tasks[job_id]
+        if not task.cancelled() and task.exception() is not None:
+            # Left unfinished in the store, so it's retried on resume.
+            log.error("Role job %d failed", job_id,
+                      exc_info=task.exception())
+
+    async def close(self) -> None:
+        """Stop every job; they're resumed on the next start."""
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _run(self, job: store.RoleJob, guild: Guild, role: Role,
+                   channel: Messageable,
+                   message: Optional[AnyMessage]) -> None:
+        members = await self.store.role_job_members(job.id)
+        counts: 'collections.Counter[str]' = collections.Counter(
+            outcome for _, outcome in members if outcome is not None
+        )
+        total = len(members)
+        reason = f"Bulk ~role by {job.requested_by} (job {job.id})"
+        last_edit = 0.0
+
+        async def show(finished: bool = False) -> None:
+            nonlocal message, last_edit
+            text = describe(job, role, counts, total, finished)
+            last_edit = time.monotonic()
+            try:
+                if message is not None:
+                    try:
+                        await message.edit(content=text)
+                        return
+                    except NotFound:
+                        message = None  # Deleted; post another.
+                message = await channel.send(text)
+                self.store.record_role_message(job.id, message.id)
+            except HTTPException:
+                log.exception("Failed to show progress of role job %d",
+                              job.id)
+
+        await show()
+        for discord_id, outcome in members:
+            if outcome is not None:
+                continue
+            outcome = await self._apply(guild, role, job.action,
+                                        discord_id, reason)
+            counts[outcome] += 1
+            self.store.record_role_outcome(job.id, discord_id, outcome)
+            if time.monotonic() - last_edit >= self.progress_interval:
+                await show()
+        self.store.finish_role_job(job.id)
+        await show(finished=True)
+
+    async def _apply(self, guild: Guild, role: Role, action: str,
+                     discord_id: int, reason: str) -> str:
+        member = guild.get_member(discord_id)
+        if member is None:
+            await self._bucket.acquire()
+            try:
+                member = await guild.fetch_member(discord_id)
+            except NotFound:
+                return 'missing'
+            except HTTPException as error:
+                log.warning("Failed to fetch member %d: %s", discord_id,
+                            error)
+                return 'failed'
+        if (role in member.roles) == (action == 'give'):
+            return 'skipped'
+        await self._bucket.acquire()
+        try:
+            if action == 'give':
+                await member.add_roles(role, reason=reason)
+            else:
+                await member.remove_roles(role, reason=reason)
+        except HTTPException as error:
+            log.warning("Failed to %s %s for %d: %s", action, role.name,
+                        discord_id, error)
+            return 'failed'
+        return 'done'
@@ -0,0 +1,122 @@
+"""In-process caches for outbound API lookups."""
+import asyncio
+import collections
+import functools
+import time
+from typing import (Any, Awaitable, Callable, Dict, Generic, Hashable,
+                    Tuple, TypeVar)
+
+V = TypeVar('V')
+
+
+class TTLCache(Generic[V]):
+    """A bounded LRU cache whose entries also expire after a TTL.
+
+    Lookups go through `fetch`, which awaits a factory on a miss.
+    Concurrent misses for the same key share one in-flight fetch rather
+    than each starting their own.  Failed fetches are not cached.
+
+    Values are shared between callers, so must not be mutated.
+
+    Attributes:
+      maxsize:  An int of the most entries to hold before evicting the
+        least recently used.
+      ttl:  A float of seconds an entry stays fresh.
+      hits, misses, coalesced, evictions, expirations:  Int counters.
+        `coalesced` counts misses that joined an in-flight fetch.
+    """
+
+    def __init__(self, maxsize: int, ttl: float,
+                 clock: Callable[[], float] = time.monotonic) -> None:
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._clock = clock
+        self._data: 'collections.OrderedDict[Hashable, Tuple[float, V]]' = (
+            collections.OrderedDict()
+        )
+        self._pending: Dict[Hashable, 'asyncio.Future[V]'] = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, key: Hashable) -> bool:
+        entry = self._data.get(key)
+        return entry is not None and entry[0] > self._clock()
+
+    def get(self, key: Hashable) -> V:
+        """Return a fresh cached value, or raise KeyError."""
+        expires, value = self._data[key]
+        if expires <= self._clock():
+            del self._data[key]
+            self.expirations += 1
+            raise KeyError(key)
+        self._data.move_to_end(key)
+        return value
+
+    def put(self, key: Hashable, value: V) -> None:
+        self._data[key] = (self._clock() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, key: Hashable) -> None:
+        self._data.pop(key, None)
+
+    def clear(self) -> None:
+        self._data.clear()
+
+    async def fetch(self, key: Hashable,
+                    factory: Callable[[], Awaitable[V]]) -> V:
+        """Return the cached value for `key`, fetching it on a miss.
+
+        Args:
+          key:  A hashable cache key.
+          factory:  A zero-arg callable returning an awaitable of the
+            value.  Only called if there is neither a fresh entry nor
+            an in-flight fetch for `key`.
+
+        Returns:
+          The value.  Exceptions raised by the factory propagate to
+          every caller waiting on that fetch.
+        """
+        try:
+            value = self.get(key)
+        except KeyError:
+            pass
+        else:
+            self.hits += 1
+            return value
+        future = self._pending.get(key)
+        if future is None:
+            self.misses += 1
+            future = asyncio.ensure_future(factory())
+            self._pending[key] = future
+            future.add_done_callback(functools.partial(self._settle, key))
+        else:
+            self.coalesced += 1
+        # Shielded so one caller being cancelled doesn't cancel the
+        # fetch for everyone else.
+        return await asyncio.shield(future)
+
+    def _settle(self, key: Hashable, future: 'asyncio.Future[V]') -> None:
+        del self._pending[key]
+        if not future.cancelled() and future.exception() is None:
+            self.put(key, future.result())
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses + self.coalesced
+        return {'size': len(self._data),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'coalesced': self.coalesced,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'hit_rate': ((self.hits + self.coalesced) / lookups
+                             if lookups else 0.0)}
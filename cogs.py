@@ -1,5 +1,11 @@
 """Cogs (categories of bot command)"""
+import asyncio
 import datetime
+import re
+import time
+from typing import Callable
+import metrics
+import urls
 import utils
 from discord import Member, Embed, Role
 from discord.ext import commands
@@ -8,6 +14,10 @@ from discord.ext.commands import Bot, Cog, Context
 import constants
 
 
+_VERIFIED_SINCE = re.compile(r"verified since (\d{4}-\d{2}-\d{2})",
+                             re.IGNORECASE)
+
+
 class Mod(Cog, name="Moderation"):  # type: ignore
     """Mod-only commands"""
     def __init__(self, bot: Bot) -> None:
@@ -19,22 +29,92 @@ class Mod(Cog, name="Moderation"):  # type: ignore
                    ctx: Context,
                    action: str,
                    role: Role,
-                   member: Member) -> None:
-        "Changes roles for a user. Usage ~role [give|take] [role] [member]"
-        if action == "give":
-            await member.add_roles(role)
-            await ctx.send(f"Giving {role.name} role to {member.mention}")
-        elif action == "take":
-            await member.remove_roles(role)
-            await ctx.send(f"Removing {role.name} role from {member.mention}")
-        else:
+                   members: commands.Greedy[Member],
+                   *, selector: str = "") -> None:
+        """Changes roles for one or more members.
+
+        Usage: ~role [give|take] [role] [member] [member] ...
+               ~role [give|take] [role] verified since YYYY-MM-DD
+
+        For more than one member, the changes run in the background,
+        paced under Discord's rate limits, with progress shown in one
+        message.  If the bot restarts part-way, they carry on.
+        """
+        if action not in ("give", "take"):
             await ctx.send(f"Invalid role action {action}")
+            return
+        discord_ids = [member.id for member in members]
+        if selector:
+            match = _VERIFIED_SINCE.fullmatch(selector.strip())
+            try:
+                if match is None:
+                    raise ValueError(selector)
+                since = datetime.datetime.strptime(
+                    match[1], "%Y-%m-%d"
+                ).replace(tzinfo=datetime.timezone.utc)
+            except ValueError:
+                raise commands.BadArgument(f"Unknown selector {selector}")
+            discord_ids += await self.bot.store.verified_since(
+                since.timestamp()
+            )
+        discord_ids = list(dict.fromkeys(discord_ids))
+        if not discord_ids:
+            await ctx.send("No members to change.")
+        elif len(discord_ids) == 1 and not selector:
+            member = members[0]
+            if action == "give":
+                await member.add_roles(role)
+                await ctx.send(f"Giving {role.name} role to {member.mention}")
+            else:
+                await member.remove_roles(role)
+                await ctx.send(
+                    f"Removing {role.name} role from {member.mention}"
+                )
+        else:
+            await self.bot.bulkRoles.submit(ctx.guild, ctx.channel, action,
+                                            role, discord_ids, str(ctx.author))
+
+    @commands.command()
+    @commands.has_any_role(constants.MOD)
+    async def audit(self, ctx: Context, *, usernames: str) -> None:
+        """Check many accounts for blocks at once.
+
+        Usage: ~audit <username> | <username> | ...
+        At most `AUDIT_MAX_USERS` usernames at a time.
+        """
+        names = utils.split_usernames(usernames)
+        if len(names) > constants.AUDIT_MAX_USERS:
+            raise commands.BadArgument(
+                f"Too many usernames; at most {constants.AUDIT_MAX_USERS}"
+            )
+        blocked, failed = [], []
+        async with ctx.typing():
+            async for username, result in utils.iterUserBlocks(names):
+                if isinstance(result, Exception):
+                    failed.append(username)
+                elif result:
+                    blocked.append(
+                        f"{username}: "
+                        + "; ".join(f"{wiki} ({reason})"
+                                    for wiki, reason in result)
+                    )
+        report = sorted(blocked)
+        if failed:
+            report.append("Could not check: " + ", ".join(sorted(failed)))
+        await utils.safesend(
+            ctx,
+            safe=(f"Checked {len(names)} accounts: "
+                  f"{len(blocked)} blocked, {len(failed)} failed."),
+            dangerous="\n".join(report),
+            filename="audit",
+            is_json=False
+        )
 
 
 class EditorInfo(Cog, name='Editor Information'):  # type: ignore
     """Information about one or more editors from an outside tool."""
 
-    _xtools_facets = utils.AliasDict(
+    _xtools_facets = utils.FrozenAliasDict(
         {'full': 'ec',
          ('general', 'generalstats'): 'ec-generalstats',
          ('totals', 'namespacetotals'): 'ec-namespacetotals',
@@ -44,12 +124,53 @@ class EditorInfo(Cog, name='Editor Information'):  # type: ignore
          ('edits', 'topedits'): 'topedits',
          ('rights', 'rightschanges'): 'ec-rightschanges'}
     )
+    _xtools_links = urls.FacetLinks(constants.XTOOLS_URL, _xtools_facets,
+                                    "/en.wikipedia.org/")
+
+    async def _send_links(self,
+                          ctx: Context,
+                          username: str,
+                          link: Callable[[str], str]) -> None:
+        """Send one link per `|`-separated user, as one message.
+
+        With more than one user, each link is followed by the account's
+        global edit count and lock status, fetched in parallel, at most
+        `BATCH_CONCURRENCY` at once.
+        """
+        usernames = utils.split_usernames(username)
+        if len(usernames) > constants.LINK_MAX_USERS:
+            await ctx.send(f"Too many usernames; at most "
+                           f"{constants.LINK_MAX_USERS} at a time.")
+            return
+        links = [link(name) for name in usernames]
+        if len(links) == 1:
+            await ctx.send(links[0])
+            return
+        semaphore = asyncio.Semaphore(constants.BATCH_CONCURRENCY)
+
+        async def summarise(name: str) -> str:
+            async with semaphore:
+                return await utils.getAccountSummary(name)
+
+        summaries = await asyncio.gather(
+            *(summarise(name) for name in usernames),
+            return_exceptions=True
+        )
+        lines = [f"{link} ({summary})"
+                 if not isinstance(summary, Exception)
+                 else f"{link} (lookup failed)"
+                 for link, summary in zip(links, summaries)]
+        await utils.safesend(ctx,
+                             safe="",
+                             dangerous="\n".join(lines),
+                             filename="links",
+                             is_json=False)
 
     @commands.command()
     async def xtools(self, ctx: Context, facet: str, *, username: str) -> None:
         """Get XTools info.  Usage info: ~help xtools
 
-        Usage: ~xtools <facet> <username>
+        Usage: ~xtools <facet> <username>[ | <username> | ...]
 
         Options for facet are:
           full                     -- the main XTools page
@@ -63,21 +184,18 @@ class EditorInfo(Cog, name='Editor Information'):  # type: ignore
 
         ~tc and ~timecard can be used as aliases for ~xtools tc/timecard.
         """
-        await ctx.send(utils.get_page(
-            base_url=constants.XTOOLS_URL,
-            basepage=self._xtools_facets[facet] + "/en.wikipedia.org/",
-            subpage=username)
+        await self._send_links(
+            ctx, username, lambda name: self._xtools_links(facet, name)
         )
 
     @commands.command(aliases=['ca'])
-    async def centralauth(self, ctx: Context, username: str) -> None:
+    async def centralauth(self, ctx: Context, *, username: str) -> None:
         """Get CentralAuth link.
 
-        Usage: ~ca <username>
+        Usage: ~ca <username>[ | <username> | ...]
         """
-        await ctx.send(utils.get_page(
-            base_url=constants.CA_URL,
-            subpage=username)
+        await self._send_links(
+            ctx, username, lambda name: urls.link(constants.CA_URL, name)
         )
 
 
@@ -98,3 +216,32 @@ class BotInternal(Cog, name="Bot Internal", command_attrs={'hidden': True}):
         )
         embed.set_footer(text=f"Codename: {constants.VERSION_NAME}")
         await ctx.reply(embed=embed)
+
+    @commands.command()
+    @commands.has_any_role(constants.MOD)
+    async def metrics(self, ctx: Context) -> None:
+        "Shows command latencies, API timings, queue depths and cache stats"
+        await utils.safesend(ctx,
+                             safe="**Metrics**",
+                             dangerous=metrics.REGISTRY.render_summary(),
+                             filename="metrics",
+                             is_json=False)
+
+    @commands.command()
+    @commands.has_any_role(constants.MOD)
+    async def reload(self, ctx: Context, extension: str = "cogs") -> None:
+        "Reloads a command module without reconnecting. Usage ~reload [module]"
+        start = time.perf_counter()
+        try:
+            self.bot.reload_extension(extension)
+        except commands.ExtensionError as error:
+            await ctx.send(f"Couldn't reload `{extension}`: {error}")
+            return
+        await ctx.send(f"Reloaded `{extension}` in "
+                       f"{(time.perf_counter() - start) * 1000:.0f} ms")
+
+
+def setup(bot: Bot) -> None:
+    """Add every cog.  Called by `Bot.load_extension('cogs')`."""
+    for cog in (BotInternal, Mod, EditorInfo):
+        bot.add_cog(cog(bot))
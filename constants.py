@@ -1,36 +1,132 @@
 """Keys, URLs, and other constants."""
 import os
-import typing
 
 import dotenv
 
 dotenv.load_dotenv()
 
-# Set to True to prevent log messages sending to Discord
-DEV = False
+
+def _getbool(name: str, default: bool) -> bool:
+    value = os.getenv(name)
+    return default if value is None else value.lower() in ('1', 'true', 'yes')
+
+
+def _getid(name: str) -> int:
+    """A Discord ID from the environment, or 0 if it's unset or blank.
+
+    Missing IDs only matter once the bot connects, so importing this
+    module (e.g. from a benchmark or the REPL) never fails.
+    """
+    return int(os.getenv(name) or 0)
+
 
 # Version
 VERSION = "1.0.0"
 VERSION_NAME = "ArbCom"
 
 # Bot config
-DISCORD_KEY = typing.cast(str, os.getenv('DISCORD_BOT'))  # type: ignore
-BOT_ID = int(os.getenv('BOT_ID'))  # type: ignore
-GUILD = int(os.getenv('GUILD'))  # type: ignore
+COMMAND_PREFIX = "~"
+DISCORD_KEY = os.getenv('DISCORD_BOT', '')
+BOT_ID = _getid('BOT_ID')
+GUILD = _getid('GUILD')
+
+# Gateway: the members intent is needed for `~role` and the member
+# cache; chunking downloads every member at startup.
+MEMBERS_INTENT = _getbool('MEMBERS_INTENT', True)
+MEMBER_CACHE = _getbool('MEMBER_CACHE', True)
+CHUNK_GUILDS = _getbool('CHUNK_GUILDS', False)
+MAX_MESSAGES = int(os.getenv('MAX_MESSAGES', '1000'))
 
 # Roles
-MOD = int(os.getenv('MOD_ROLE'))  # type: ignore
+MOD = _getid('MOD_ROLE')
 
 # Channels
-ADMIN_CHANNEL = int(os.getenv('ADMIN_CHANNEL'))  # type: ignore
+ADMIN_CHANNEL = _getid('ADMIN_CHANNEL')
 
 # Server admin (Ferret)
-SERVER_OWNER = int(os.getenv('SERVER_ADMIN'))  # type: ignore
+SERVER_OWNER = _getid('SERVER_ADMIN')
 
 # Misc
-BOT_ACTIVITY = typing.cast(str, os.getenv('BOT_ACTIVITY'))  # type: ignore
-AUTH_BOT = int(os.getenv('AUTH_BOT'))  # type: ignore
+BOT_ACTIVITY = os.getenv('BOT_ACTIVITY', '')
+AUTH_BOT = _getid('AUTH_BOT')
 
 # Tools
 CA_URL = "https://meta.wikimedia.org/wiki/Special:CentralAuth/"
 XTOOLS_URL = "https://xtools.wmflabs.org/"
+# Most usernames in one ~xtools or ~ca
+LINK_MAX_USERS = int(os.getenv('LINK_MAX_USERS', '25'))
+# Most usernames in one ~audit
+AUDIT_MAX_USERS = int(os.getenv('AUDIT_MAX_USERS', '100'))
+
+# MediaWiki API
+MW_CONNECTIONS = int(os.getenv('MW_CONNECTIONS', '8'))  # per host
+BATCH_CONCURRENCY = int(os.getenv('BATCH_CONCURRENCY', '8'))
+
+# CentralAuth lookup cache
+CA_CACHE_TTL = float(os.getenv('CA_CACHE_TTL', '300'))  # seconds
+CA_CACHE_SIZE = int(os.getenv('CA_CACHE_SIZE', '4096'))
+
+# Persistence
+DB_PATH = os.getenv('DB_PATH', 'wmbot.db')
+# Seconds a stored block check is trusted before re-querying CentralAuth
+BLOCK_CHECK_TTL = float(os.getenv('BLOCK_CHECK_TTL', '3600'))
+
+# Language codes: fetched snapshots are saved here, and the sitematrix
+# re-checked every SITEMATRIX_REFRESH seconds (0 to never check).
+SITEMATRIX_PATH = os.getenv('SITEMATRIX_PATH', 'sitematrix.cache.json')
+SITEMATRIX_REFRESH = float(os.getenv('SITEMATRIX_REFRESH', '86400'))
+
+# Auth-bot report queue
+REPORT_WORKERS = int(os.getenv('REPORT_WORKERS', '4'))
+REPORT_QUEUE_SIZE = int(os.getenv('REPORT_QUEUE_SIZE', '1000'))
+# Seconds during which repeat verifications of one Discord account as
+# one wiki user are ignored
+REPORT_DEDUPE_WINDOW = float(os.getenv('REPORT_DEDUPE_WINDOW', '300'))
+# Seconds to wait for more reports to merge into one message
+REPORT_WINDOW = float(os.getenv('REPORT_WINDOW', '2'))
+
+# Watcher: re-checks verified users for locks and blocks, spending at
+# most WATCH_REQUESTS API requests, one per check, an hour (0 to
+# disable).  Users are re-checked every WATCH_INTERVAL seconds, or every
+# WATCH_ACTIVE_INTERVAL if they've posted since their last check.
+WATCH_REQUESTS = int(os.getenv('WATCH_REQUESTS', '600'))
+WATCH_INTERVAL = float(os.getenv('WATCH_INTERVAL', '604800'))
+WATCH_ACTIVE_INTERVAL = float(os.getenv('WATCH_ACTIVE_INTERVAL', '86400'))
+
+# Block and lock logs tailed for verified users, as comma-separated
+# site:letype pairs (empty to disable), polled every LOG_POLL seconds.
+LOG_FEEDS = os.getenv('LOG_FEEDS', 'meta.wikimedia.org:globalauth,'
+                      'meta.wikimedia.org:gblblock,en.wikipedia.org:block')
+LOG_POLL = float(os.getenv('LOG_POLL', '10'))
+
+# Commands allowed per user, and per channel, in a sliding window of
+# *_PER seconds; a rate of 0 is no limit.
+THROTTLE_USER_RATE = int(os.getenv('THROTTLE_USER_RATE', '5'))
+THROTTLE_USER_PER = float(os.getenv('THROTTLE_USER_PER', '60'))
+THROTTLE_CHANNEL_RATE = int(os.getenv('THROTTLE_CHANNEL_RATE', '20'))
+THROTTLE_CHANNEL_PER = float(os.getenv('THROTTLE_CHANNEL_PER', '60'))
+
+# Bulk `~role`: role changes allowed per ROLE_PER seconds, across all
+# jobs, and the fewest seconds between edits of a job's progress.
+ROLE_RATE = int(os.getenv('ROLE_RATE', '10'))
+ROLE_PER = float(os.getenv('ROLE_PER', '10'))
+ROLE_PROGRESS_INTERVAL = float(os.getenv('ROLE_PROGRESS_INTERVAL', '5'))
+
+# Logging: to a rotating file (LOG_PATH, empty for none) and stderr,
+# and records at ADMIN_LOG_LEVEL or above (empty to disable, e.g. in
+# development) to the admin channel, as at most one digest of up to
+# ADMIN_LOG_LINES lines every ADMIN_LOG_INTERVAL seconds.
+LOG_PATH = os.getenv('LOG_PATH', 'wmbot.log')
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+LOG_MAX_BYTES = int(os.getenv('LOG_MAX_BYTES', str(10 * 2 ** 20)))
+LOG_BACKUPS = int(os.getenv('LOG_BACKUPS', '5'))
+ADMIN_LOG_LEVEL = os.getenv('ADMIN_LOG_LEVEL', 'WARNING').upper()
+ADMIN_LOG_INTERVAL = float(os.getenv('ADMIN_LOG_INTERVAL', '60'))
+ADMIN_LOG_LINES = int(os.getenv('ADMIN_LOG_LINES', '20'))
+
+# Serve Prometheus metrics on 127.0.0.1 at this port; 0 to disable
+METRICS_PORT = int(os.getenv('METRICS_PORT', '0'))
+
+# Sent with every MediaWiki API request, per the Wikimedia UA policy.
+USER_AGENT = (f"WM-Mod-Bot/{VERSION} "
+              "(https://github.com/theresnotime/WM-Mod-Bot)")
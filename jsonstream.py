@@ -0,0 +1,111 @@
+"""Incremental extraction of array items from a streamed JSON document."""
+import codecs
+import json
+import re
+from typing import Any, Callable, Iterator, List, Optional
+
+_WHITESPACE = re.compile(r"[ \t\n\r]*")
+
+
+class ArrayItems:
+    """Extract the items of one array in a JSON document as it arrives.
+
+    Feed the document in chunks; each item of the array held under
+    `key` is decoded, passed through `project` and returned from `feed`
+    as soon as it is complete.  Only the unconsumed tail of the document is
+    buffered, so memory use depends on the size of one item rather
+    than of the whole document.
+
+    The first `"key": [` in the document is used, wherever it is
+    nested, so `key` should be unique to the array wanted.  Text
+    before and after the array is skipped rather than validated.
+
+    Attributes:
+      key:  A str of the array's key.
+      project:  A callable applied to each item before it is returned,
+        e.g. a `trim_dict` projection.
+      head:  A str of the document before the array (all of it, if
+        there is no array), kept only if `keep_head` was given, for
+        fields that precede the array.
+    """
+
+    def __init__(self, key: str,
+                 project: Optional[Callable[[Any], Any]] = None, *,
+                 keep_head: bool = False) -> None:
+        self.key = key
+        self.project = project
+        self.head = ""
+        self._keep_head = keep_head
+        self._start = re.compile(
+            r'(?<!\\)"' + re.escape(key) + r'"[ \t\n\r]*:[ \t\n\r]*\['
+        )
+        self._decoder = json.JSONDecoder()
+        self._text = codecs.getincrementaldecoder('utf-8')()
+        self._buffer = ""
+        self._in_array = False
+        self._done = False
+
+    def feed(self, chunk: bytes) -> List[Any]:
+        """Add a chunk of the document and return any completed items."""
+        if self._done:
+            return []
+        self._buffer += self._text.decode(chunk)
+        if not self._in_array:
+            match = self._start.search(self._buffer)
+            if match is None:
+                # Keep enough of the tail to match a key split across
+                # chunks.
+                tail = len(self._buffer) - (len(self.key) + 16)
+                if tail > 0:
+                    if self._keep_head:
+                        self.head += self._buffer[:tail]
+                    self._buffer = self._buffer[tail:]
+                return []
+            if self._keep_head:
+                self.head += self._buffer[:match.start()]
+            self._buffer = self._buffer[match.end():]
+            self._in_array = True
+        return list(self._items())
+
+    def _items(self) -> Iterator[Any]:
+        buffer, decode = self._buffer, self._decoder.raw_decode
+        pos, length = 0, len(buffer)
+        while pos < length:
+            char = buffer[pos]
+            if char == ',':
+                pos += 1
+                continue
+            if char in ' \t\n\r':
+                pos = _WHITESPACE.match(buffer, pos).end()  # type: ignore
+                continue
+            if char == ']':
+                self._done = True
+                pos = length
+                break
+            try:
+                item, end = decode(buffer, pos)
+            except json.JSONDecodeError:
+                break  # Incomplete; wait for more.
+            if (not isinstance(item, (dict, list))
+                    and (end == length or buffer[end] not in ',] \t\n\r')):
+                # A number or literal is only complete once a delimiter
+                # follows it: `1` may be the start of `1.5` or `1e5`.
+                break
+            pos = end
+            yield item if self.project is None else self.project(item)
+        self._buffer = buffer[pos:]
+
+    def close(self) -> None:
+        """Check that the whole array was seen.
+
+        Raises:
+          KeyError:  If the document had no such array.
+          ValueError:  If the array was cut off or malformed.
+        """
+        if not self._in_array:
+            if self._keep_head:
+                self.head += self._buffer
+                self._buffer = ""
+            raise KeyError(self.key)
+        if not self._done:
+            raise ValueError(f"Unterminated or malformed array {self.key!r}")
@@ -0,0 +1,20 @@
+"""Run the bot, as `python wmbot.py` does, timing its imports too.
+
+wmbot can't start a clock before its own imports without code above
+them, so this starts it, then imports wmbot and runs it, for the
+'import' phase of the startup report.
+
+Usage: python launch.py
+"""
+import time
+
+
+def main() -> None:
+    began = time.perf_counter()
+    import wmbot
+    wmbot.recordImport(began)
+    wmbot.main()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,227 @@
+"""Tailing of block and lock logs for verified users.
+
+Rather than polling each verified user, `LogTail` reads each wiki's
+block (or global lock) log as it grows, with `list=logevents` and
+continuation, and looks up each event's target in an in-memory index
+of verified wiki usernames.  Requests scale with the rate of blocks,
+not the number of members.  After each alert the user's state is
+re-fetched and recorded, so the `watcher.Watcher` and `reportBlocks`
+don't report the same change again.  Each feed's position is saved in the
+store, so a restart carries on where it left off.
+
+Point `mwapi.Client.template` at a local stub to run this offline; see
+`benchmarks.logevents`.
+"""
+import asyncio
+import logging
+import time
+from typing import (Any, Awaitable, Callable, Dict, Iterable, List,
+                    NamedTuple, Optional, Set)
+
+import metrics
+import mwapi
+import store
+import utils
+
+JSONDict = Dict[str, Any]
+
+log = logging.getLogger(__name__)
+
+USER_NAMESPACE = 2
+LEPROP = 'ids|title|type|user|timestamp|comment|details'
+
+
+class Feed(NamedTuple):
+    """One log on one wiki, e.g. ('en.wikipedia.org', 'block')."""
+    site: str
+    letype: str
+
+    def __str__(self) -> str:
+        return f"{self.site}:{self.letype}"
+
+
+def parse_feeds(spec: str) -> List[Feed]:
+    """Parse comma-separated `site:letype` pairs, e.g. LOG_FEEDS."""
+    feeds = []
+    for item in spec.split(","):
+        if item.strip():
+            site, _, letype = item.strip().rpartition(":")
+            feeds.append(Feed(site, letype))
+    return feeds
+
+
+def mw_timestamp(iso: str) -> str:
+    """Turn `2021-01-02T03:04:05Z` into MediaWiki's `20210102030405`."""
+    return iso.replace("-", "").replace(":", "").replace("T", "")[:14]
+
+
+def target_name(event: JSONDict) -> Optional[str]:
+    """Return the normalised username an event is about, if any."""
+    if event.get('ns') != USER_NAMESPACE or 'title' not in event:
+        return None
+    name = event['title'].split(":", 1)[1]
+    # Global (un)locks are logged against `User:Name@global`.
+    if name.endswith("@global"):
+        name = name[:-len("@global")]
+    return mwapi.normaliseUsername(name)
+
+
+def describe(feed: Feed, event: JSONDict) -> str:
+    """Describe an event, to follow a username in an alert."""
+    action, params = event.get('action'), event.get('params', {})
+    by = f"by {event.get('user', '(hidden)')}"
+    reason = f": {event['comment']}" if event.get('comment') else ""
+    if feed.letype == 'globalauth' and action == 'setstatus':
+        if 'locked' in params.get('added', ()):
+            return f"was **globally locked** {by}{reason}"
+        if 'locked' in params.get('removed', ()):
+            return f"was globally unlocked {by}{reason}"
+    if action in ('block', 'reblock'):
+        expiry = params.get('duration') or params.get('expiry', "?")
+        return (f"was {'re' * (action == 'reblock')}blocked on {feed.site} "
+                f"{by} until {expiry}{reason}")
+    if action == 'unblock':
+        return f"was unblocked on {feed.site} {by}{reason}"
+    return f"{feed.letype}/{action} on {feed.site} {by}{reason}"
+
+
+class LogTail:
+    """Polls log feeds and alerts on events about verified users.
+
+    Attributes:
+      store:  The `store.Store` of verified users and feed cursors.
+      alert:  A coroutine function called with each alert's text.
+      feeds:  A list of Feeds to tail.
+      interval:  A float of seconds between polls of a caught-up feed.
+      max_pages:  An int of the most pages read from a feed per poll,
+        so one feed's backlog can't starve the others.
+      limit:  An int of events requested per page.
+    """
+
+    def __init__(self, store: store.Store,
+                 alert: Callable[[str], Awaitable[None]],
+                 feeds: Iterable[Feed], *,
+                 interval: float = 10.0,
+                 max_pages: int = 10,
+                 limit: int = 500) -> None:
+        self.store = store
+        self.alert = alert
+        self.feeds = list(feeds)
+        self.interval = interval
+        self.max_pages = max_pages
+        self.limit = limit
+        # Normalised wiki username -> Discord users verified as them.
+        self._index: Dict[str, Set[str]] = {}
+        self._cursors: Dict[Feed, str] = {}
+        self._tasks: List['asyncio.Task[None]'] = []
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def watch(self, wiki_user: str, discord_user: str) -> None:
+        """Add a verification to the index."""
+        self._index.setdefault(mwapi.normaliseUsername(wiki_user),
+                               set()).add(discord_user)
+
+    async def start(self) -> None:
+        """Load the index from the store and start polling."""
+        for wiki_user, discord_user in await self.store.verified_users():
+            self.watch(wiki_user, discord_user)
+        self._tasks = [asyncio.create_task(self._run(feed))
+                       for feed in self.feeds]
+
+    async def close(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _run(self, feed: Feed) -> None:
+        while True:
+            try:
+                caught_up = await self.poll(feed)
+            except Exception:
+                log.exception("Failed to poll %s", feed)
+                caught_up = True
+            if caught_up:
+                await asyncio.sleep(self.interval)
+
+    async def poll(self, feed: Feed) -> bool:
+        """Read a feed's new events, up to `max_pages` pages.
+
+        Returns:
+          Whether the feed is caught up.
+        """
+        cursor = self._cursors.get(feed)
+        if cursor is None:
+            cursor = await self.store.get_cursor(str(feed))
+        if cursor is None:
+            # A new feed starts now, rather than replaying history.
+            cursor = time.strftime("%Y%m%d%H%M%S|0", time.gmtime())
+            self.store.record_cursor(str(feed), cursor)
+        self._cursors[feed] = cursor
+        for _ in range(self.max_pages):
+            data = await mwapi.getClient().get(feed.site, 'query', {
+                'list': 'logevents',
+                'letype': feed.letype,
+                'leprop': LEPROP,
+                'ledir': 'newer',
+                'lelimit': str(self.limit),
+                'lecontinue': cursor,
+                'continue': '-||',
+            })
+            events = data['query']['logevents']
+            metrics.LOG_EVENTS.inc(len(events))
+            for event in events:
+                await self._match(feed, event)
+            if 'continue' in data:
+                cursor = data['continue']['lecontinue']
+            elif events:
+                # Resume just after the last event seen.
+                last = events[-1]
+                cursor = (f"{mw_timestamp(last['timestamp'])}|"
+                          f"{last['logid'] + 1}")
+            else:
+                return True
+            self._cursors[feed] = cursor
+            self.store.record_cursor(str(feed), cursor)
+            if 'continue' not in data:
+                return True
+        return False
+
+    async def _match(self, feed: Feed, event: JSONDict) -> None:
+        name = target_name(event)
+        if not name:
+            return
+        discord_users = self._index.get(name)
+        if not discord_users:
+            return
+        metrics.LOG_MATCHES.inc()
+        await self.alert(f"{', '.join(sorted(discord_users))} "
+                         f"(User:{name}) {describe(feed, event)}")
+        await self.refresh(name, sorted(discord_users))
+
+    async def refresh(self, wiki_user: str, discord_users: List[str]) -> None:
+        """Record a matched user's new lock and block state.
+
+        Otherwise the `Watcher` would alert on the same change again, and
+        `reportBlocks` could use cached blocks from before the event.
+        If the state can't be fetched, the stored block check is dropped
+        instead, so the next check is fresh.
+        """
+        utils.userBlocksCache.invalidate(wiki_user)
+        mwapi.centralAuthCache.invalidate((wiki_user, 'editcount'))
+        try:
+            info = (await mwapi.getCentralAuthInfo(wiki_user, 'editcount')
+                    )['query']['globaluserinfo']
+            blocks = ([] if 'missing' in info
+                      else await utils.getUserBlocks(wiki_user))
+        except Exception:
+            log.exception("Failed to refresh %s", wiki_user)
+            self.store.forget_block_check(wiki_user)
+            return
+        self.store.record_watch(wiki_user, 'locked' in info, blocks)
+        self.store.record_block_check(wiki_user, blocks)
+        if blocks:
+            for discord_user in discord_users:
+                self.store.record_report(discord_user, wiki_user, blocks)
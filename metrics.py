@@ -0,0 +1,270 @@
+"""Lightweight counters, latency histograms and gauges.
+
+Metrics are created once, up front, and callers keep a reference to
+them, so recording is an attribute increment (`Counter`) or a bisect
+into a preallocated bucket list (`Histogram`).  Gauges are callbacks
+that are only evaluated when metrics are read.
+
+Everything registered in `REGISTRY` can be rendered as a plain-text
+summary (for `~metrics`) or in the Prometheus text format.
+"""
+import bisect
+import functools
+import time
+from typing import (Any, Awaitable, Callable, Dict, List, Optional, Tuple,
+                    TypeVar, Union)
+
+F = TypeVar('F', bound=Callable[..., Awaitable[Any]])
+Labels = Tuple[Tuple[str, str], ...]
+
+# Bucket upper bounds in seconds: 0.5 ms to ~100 s, each 1.5x the last.
+DEFAULT_BOUNDS = tuple(0.0005 * 1.5 ** i for i in range(31))
+
+
+class Counter:
+    """A monotonically increasing count."""
+
+    __slots__ = ('value',)
+    kind = 'counter'
+
+    def __init__(self) -> None:
+        self.value = 0
+
+    def inc(self, amount: int = 1) -> None:
+        self.value += amount
+
+
+class Histogram:
+    """A latency distribution over fixed, preallocated buckets.
+
+    Quantiles are estimated as the upper bound of the bucket they fall
+    in, so are accurate to within one bucket (a factor of 1.5 by
+    default).
+    """
+
+    __slots__ = ('bounds', 'counts', 'count', 'sum')
+    kind = 'histogram'
+
+    def __init__(self, bounds: Tuple[float, ...] = DEFAULT_BOUNDS) -> None:
+        self.bounds = bounds
+        # The last bucket catches everything above the highest bound.
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, seconds: float) -> None:
+        self.counts[bisect.bisect_left(self.bounds, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+
+    def quantile(self, q: float) -> float:
+        """Estimate the `q`th quantile (0 <= q <= 1), in seconds."""
+        if not self.count:
+            return 0.0
+        rank, seen = q * self.count, 0
+        for idx, bucket in enumerate(self.counts):
+            seen += bucket
+            if seen >= rank and bucket:
+                break
+        return self.bounds[idx] if idx < len(self.bounds) else float('inf')
+
+    def time(self) -> '_Timer':
+        """Context manager that observes the time spent in its block."""
+        return _Timer(self)
+
+
+class _Timer:
+    __slots__ = ('histogram', 'start')
+
+    def __init__(self, histogram: Histogram) -> None:
+        self.histogram = histogram
+
+    def __enter__(self) -> None:
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc: Any) -> None:
+        self.histogram.observe(time.perf_counter() - self.start)
+
+
+class Gauge:
+    """A value read from a callback whenever metrics are collected."""
+
+    __slots__ = ('func',)
+    kind = 'gauge'
+
+    def __init__(self, func: Callable[[], float]) -> None:
+        self.func = func
+
+    @property
+    def value(self) -> float:
+        return self.func()
+
+
+Metric = Union[Counter, Histogram, Gauge]
+
+
+class Registry:
+    """A collection of named, optionally labelled, metrics."""
+
+    def __init__(self) -> None:
+        self._metrics: Dict[Tuple[str, Labels], Metric] = {}
+        self._help: Dict[str, str] = {}
+
+    def _register(self, name: str, help: str, labels: Dict[str, str],
+                  factory: Callable[[], Metric]) -> Any:
+        key = (name, tuple(sorted(labels.items())))
+        metric = self._metrics.get(key)
+        if metric is None:
+            metric = self._metrics[key] = factory()
+            self._help.setdefault(name, help)
+        return metric
+
+    def counter(self, name: str, help: str, **labels: str) -> Counter:
+        """Get or create a Counter.  Do this once, not per event."""
+        return self._register(name, help, labels, Counter)
+
+    def histogram(self, name: str, help: str, **labels: str) -> Histogram:
+        """Get or create a Histogram.  Do this once, not per event."""
+        return self._register(name, help, labels, Histogram)
+
+    def gauge(self, name: str, help: str, func: Callable[[], float],
+              **labels: str) -> Gauge:
+        """Register a Gauge, replacing any existing callback."""
+        gauge = self._register(name, help, labels, lambda: Gauge(func))
+        gauge.func = func
+        return gauge
+
+    def timed(self, histogram: Histogram) -> Callable[[F], F]:
+        """Decorate a coroutine function to observe its run time."""
+        def decorator(func: F) -> F:
+            @functools.wraps(func)
+            async def wrapper(*args: Any, **kwargs: Any) -> Any:
+                start = time.perf_counter()
+                try:
+                    return await func(*args, **kwargs)
+                finally:
+                    histogram.observe(time.perf_counter() - start)
+            return wrapper  # type: ignore
+        return decorator
+
+    def _collect(self) -> List[Tuple[str, Labels, Metric]]:
+        return sorted(((name, labels, metric)
+                       for (name, labels), metric in self._metrics.items()),
+                      key=lambda item: item[:2])
+
+    def render_prometheus(self) -> str:
+        """Render every metric in the Prometheus text format."""
+        lines: List[str] = []
+        previous: Optional[str] = None
+        for name, labels, metric in self._collect():
+            if name != previous:
+                lines += [f"# HELP {name} {self._help[name]}",
+                          f"# TYPE {name} {metric.kind}"]
+                previous = name
+            if isinstance(metric, Histogram):
+                cumulative = 0
+                for bound, count in zip(metric.bounds + (float('inf'),),
+                                        metric.counts):
+                    cumulative += count
+                    le = "+Inf" if bound == float('inf') else f"{bound:.6g}"
+                    lines.append(f"{name}_bucket"
+                                 f"{_labels(labels + (('le', le),))} "
+                                 f"{cumulative}")
+                lines += [f"{name}_sum{_labels(labels)} {metric.sum}",
+                          f"{name}_count{_labels(labels)} {metric.count}"]
+            else:
+                lines.append(f"{name}{_labels(labels)} {metric.value}")
+        return "\n".join(lines) + "\n"
+
+    def render_summary(self) -> str:
+        """Render every metric as short human-readable lines."""
+        lines = []
+        for name, labels, metric in self._collect():
+            label = name + _labels(labels)
+            if isinstance(metric, Histogram):
+                if not metric.count:
+                    continue
+                lines.append(
+                    f"{label}: n={metric.count} "
+                    + " ".join(f"p{int(q * 100)}="
+                               f"{metric.quantile(q) * 1000:.1f}ms"
+                               for q in (0.5, 0.95, 0.99))
+                )
+            else:
+                value = metric.value
+                lines.append(f"{label}: {value:.3g}"
+                             if isinstance(value, float)
+                             else f"{label}: {value}")
+        return "\n".join(lines)
+
+
+def _labels(labels: Labels) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in labels) + "}"
+
+
+REGISTRY = Registry()
+
+API_LATENCY = REGISTRY.histogram(
+    'wmbot_mwapi_request_seconds',
+    "Time to the response headers of MediaWiki API requests."
+)
+API_RETRIES = REGISTRY.counter(
+    'wmbot_mwapi_retries_total', "MediaWiki API requests retried."
+)
+MESSAGE_LATENCY = REGISTRY.histogram(
+    'wmbot_check_message_seconds',
+    "Time to handle a non-command message (auth bot or DM)."
+)
+REPORT_LATENCY = REGISTRY.histogram(
+    'wmbot_report_seconds', "Time to check one verified user for blocks."
+)
+WATCH_CHECKS = REGISTRY.counter(
+    'wmbot_watch_checks_total', "Verified users re-checked by the watcher."
+)
+WATCH_FAILURES = REGISTRY.counter(
+    'wmbot_watch_failures_total', "Watcher re-checks that failed."
+)
+WATCH_ALERTS = REGISTRY.counter(
+    'wmbot_watch_alerts_total', "Lock or block changes found by the watcher."
+)
+LOG_EVENTS = REGISTRY.counter(
+    'wmbot_log_events_total', "Block and lock log events read."
+)
+LOG_MATCHES = REGISTRY.counter(
+    'wmbot_log_matches_total', "Log events about verified users."
+)
+THROTTLED = {scope: REGISTRY.counter(
+    'wmbot_throttled_total', "Command invocations refused, by limit.",
+    scope=scope
+) for scope in ('user', 'channel')}
+COMMAND_ERRORS = REGISTRY.counter(
+    'wmbot_command_errors_total', "Command invocations that errored."
+)
+
+
+def command_latency(command: str) -> Histogram:
+    return REGISTRY.histogram('wmbot_command_seconds',
+                              "Command run time, by command.",
+                              command=command)
+
+
+async def serve(host: str, port: int) -> Any:
+    """Serve `REGISTRY` in the Prometheus text format at /metrics.
+
+    Returns:
+      The `aiohttp.web.AppRunner`; call its `cleanup()` to stop.
+    """
+    from aiohttp import web
+
+    async def handle(request: web.Request) -> web.Response:
+        return web.Response(text=REGISTRY.render_prometheus(),
+                            content_type='text/plain')
+
+    app = web.Application()
+    app.router.add_get('/metrics', handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
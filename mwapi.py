@@ -1,22 +1,311 @@
-import requests
+"""Async client for the MediaWiki Action API."""
+import asyncio
+import math
+import random
+from typing import Any, AsyncIterator, Dict, Mapping, Optional, Tuple
+
+import aiohttp
+
+import cache
 import constants
+import metrics
+import urls
+
+JSONDict = Dict[str, Any]
+
+API_URL = "https://{site}/w/api.php"
+# Statuses worth retrying; anything else 4xx/5xx is raised immediately.
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+
+class APIError(Exception):
+    """An error object returned in the body of an API response."""
+    def __init__(self, code: str, info: str) -> None:
+        super().__init__(f"{code}: {info}")
+        self.code = code
+        self.info = info
 
 
 def buildUrl(
     site: str,
     action: str,
-    query: str
+    params: Mapping[str, object],
+    template: str = API_URL
 ) -> str:
-    return (f"https://{site}"
-            f"/w/api.php?action={action}&format=json"
-            f"&{query}")
+    return (template.format(site=site)
+            + f"?action={action}&format=json"
+            + f"&{urls.encode_query(params)}")
+
+
+class Client:
+    """A pooled, keep-alive client for MediaWiki sites.
+
+    One `aiohttp.ClientSession` is shared by every request, so
+    connections are reused across calls.  The number of simultaneous
+    connections to each host is bounded; requests over the limit wait
+    for a free connection rather than opening a new one.
+
+    Requests that fail with a 429, a 5xx, a connection error, a timeout
+    or a `maxlag` API error are retried with exponential backoff,
+    honouring any Retry-After header up to `max_delay`.
+
+    Attributes:
+      template:  A str.format template for the API endpoint, taking
+        `site`.  Point this at a local stub server for testing, e.g.
+        "http://127.0.0.1:8080/{site}/api.php".
+      limit_per_host:  Max simultaneous connections to one host.
+      timeout:  Total seconds allowed for one attempt.
+      retries:  How many times to retry a failed request.
+      backoff:  Base delay, in seconds, between retries.
+      max_delay:  Most seconds to wait when a server asks, with
+        Retry-After, for a longer wait.
+      maxlag:  Value of the `maxlag` parameter sent with each request.
+    """
+
+    def __init__(self, *,
+                 template: str = API_URL,
+                 limit_per_host: int = 4,
+                 timeout: float = 10.0,
+                 retries: int = 3,
+                 backoff: float = 1.0,
+                 max_delay: float = 60.0,
+                 maxlag: int = 5) -> None:
+        self.template = template
+        self.limit_per_host = limit_per_host
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_delay = max_delay
+        self.maxlag = maxlag
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    def _getSession(self) -> aiohttp.ClientSession:
+        # Created lazily so that it is bound to the running event loop.
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(
+                    limit_per_host=self.limit_per_host,
+                    keepalive_timeout=60
+                ),
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+                headers={'User-Agent': constants.USER_AGENT},
+                raise_for_status=False
+            )
+        return self._session
+
+    def _delay(self, attempt: int, retry_after: Optional[str]) -> float:
+        # Retry-After may also be an HTTP date; that, a negative or
+        # non-finite number, or no header at all gets the usual backoff.
+        try:
+            seconds = float(retry_after)  # type: ignore
+        except (TypeError, ValueError):
+            seconds = -1.0
+        if not 0 <= seconds < math.inf:
+            return self.backoff * 2 ** attempt * (1 + random.random() / 2)
+        return min(seconds, self.max_delay)
+
+    def _url(self, site: str, action: str, params: Dict[str, str]) -> str:
+        return buildUrl(site, action, {**params, 'maxlag': self.maxlag},
+                        template=self.template)
+
+    async def _open(
+        self,
+        url: str,
+        headers: Optional[Dict[str, str]] = None
+    ) -> aiohttp.ClientResponse:
+        # Returns an unread response; the caller must release it.
+        session = self._getSession()
+        for attempt in range(self.retries + 1):
+            last = attempt == self.retries
+            if attempt:
+                metrics.API_RETRIES.inc()
+            try:
+                with metrics.API_LATENCY.time():
+                    response = await session.get(url, headers=headers)
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+                if last:
+                    raise
+                await asyncio.sleep(self._delay(attempt, None))
+                continue
+            # MediaWiki flags API errors, including maxlag, in a header,
+            # so we can retry before reading the body.
+            if not last and (
+                    response.status in RETRY_STATUSES
+                    or response.headers.get('MediaWiki-API-Error')
+                    == 'maxlag'):
+                response.release()
+                await asyncio.sleep(
+                    self._delay(attempt, response.headers.get('Retry-After'))
+                )
+                continue
+            if response.status >= 400:
+                response.release()
+                response.raise_for_status()
+            return response
+        raise AssertionError("unreachable")
+
+    @staticmethod
+    def _raiseError(data: JSONDict) -> None:
+        error = data.get('error')
+        if error is not None:
+            raise APIError(error.get('code', ''), error.get('info', ''))
+
+    async def get(self,
+                  site: str,
+                  action: str,
+                  params: Dict[str, str]) -> JSONDict:
+        """GET an API action and return the decoded JSON.
+
+        Args:
+          site:  A str of the wiki's host, e.g. 'meta.wikimedia.org'.
+          action:  A str of the API action, e.g. 'query'.
+          params:  A dict of further query parameters.  These are
+            URL-encoded for you, by `urls.encode_query`.
+
+        Returns:
+          A JSONDict of the response body.
+
+        Raises:
+          APIError:  If the API returns an error (after retries, in the
+            case of maxlag).
+          aiohttp.ClientError, asyncio.TimeoutError:  If the request
+            still fails after retries.
+        """
+        async with await self._open(self._url(site, action, params)) as resp:
+            data = await resp.json(content_type=None)
+        self._raiseError(data)
+        return data
+
+    async def getIfChanged(
+        self,
+        site: str,
+        action: str,
+        params: Dict[str, str],
+        *,
+        etag: Optional[str] = None,
+        lastModified: Optional[str] = None
+    ) -> Tuple[Optional[JSONDict], Optional[str], Optional[str]]:
+        """Like `get`, but a conditional request.
+
+        Args:
+          etag, lastModified:  The ETag and Last-Modified headers of
+            the previous response, if any.
+
+        Returns:
+          A tuple of the decoded JSON, or None if the server says it's
+          unchanged (304), then the response's ETag and Last-Modified
+          (or the ones passed in, if it didn't send any).
+        """
+        headers = {}
+        if etag:
+            headers['If-None-Match'] = etag
+        if lastModified:
+            headers['If-Modified-Since'] = lastModified
+        async with await self._open(self._url(site, action, params),
+                                    headers) as resp:
+            etag = resp.headers.get('ETag', etag)
+            lastModified = resp.headers.get('Last-Modified', lastModified)
+            if resp.status == 304:
+                return None, etag, lastModified
+            data = await resp.json(content_type=None)
+        self._raiseError(data)
+        return data, etag, lastModified
+
+    async def stream(self,
+                     site: str,
+                     action: str,
+                     params: Dict[str, str],
+                     chunk_size: int = 65536) -> AsyncIterator[bytes]:
+        """GET an API action and yield the raw body in chunks.
+
+        Retries happen only before the first chunk is yielded.  Takes
+        the same args, and raises the same errors, as `get`.
+        """
+        async with await self._open(self._url(site, action, params)) as resp:
+            if 'MediaWiki-API-Error' in resp.headers:
+                self._raiseError(await resp.json(content_type=None))
+            async for chunk in resp.content.iter_chunked(chunk_size):
+                yield chunk
+
+    async def close(self) -> None:
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+
+_client: Optional[Client] = None
+
+
+def getClient() -> Client:
+    """Return the shared Client, creating it on first use."""
+    global _client
+    if _client is None:
+        _client = Client(limit_per_host=constants.MW_CONNECTIONS)
+    return _client
+
+
+def setClient(client: Client) -> None:
+    """Replace the shared Client, e.g. with one pointed at a stub."""
+    global _client
+    _client = client
+
+
+async def close() -> None:
+    if _client is not None:
+        await _client.close()
+
+
+def normaliseUsername(username: str) -> str:
+    """Normalise a username the way MediaWiki does for titles.
+
+    Underscores become spaces, runs of whitespace collapse, and the
+    first letter is uppercased, so `foo_bar` and `Foo bar` share a
+    cache entry.
+    """
+    username = " ".join(username.replace("_", " ").split())
+    return username[:1].upper() + username[1:]
+
+
+centralAuthCache: 'cache.TTLCache[JSONDict]' = cache.TTLCache(
+    maxsize=constants.CA_CACHE_SIZE,
+    ttl=constants.CA_CACHE_TTL
+)
+
+
+async def _fetchCentralAuthInfo(username: str, props: str) -> JSONDict:
+    return await getClient().get(
+        'meta.wikimedia.org',
+        'query',
+        {'meta': 'globaluserinfo',
+         'guiuser': username,
+         'guiprop': props}
+    )
+
+
+async def getCentralAuthInfo(
+    username: str,
+    props: str = 'groups|unattached|merged'
+) -> JSONDict:
+    """Get a user's globaluserinfo, via `centralAuthCache`.
+
+    The returned dict is shared with other callers; don't mutate it.
+    """
+    username = normaliseUsername(username)
+    return await centralAuthCache.fetch(
+        (username, props), lambda: _fetchCentralAuthInfo(username, props)
+    )
+
 
+def streamCentralAuthInfo(username: str,
+                          props: str = 'merged') -> AsyncIterator[bytes]:
+    """Stream a user's globaluserinfo, uncached, requesting only `props`.
 
-def getCentralAuthInfo(username: str) -> str:
-    api_url = buildUrl(
+    For use with `jsonstream` on accounts with very large responses.
+    """
+    return getClient().stream(
         'meta.wikimedia.org',
         'query',
-        f"meta=globaluserinfo&guiuser={username}&guiprop=groups%7Cunattached%7Cmerged"
+        {'meta': 'globaluserinfo',
+         'guiuser': normaliseUsername(username),
+         'guiprop': props}
     )
-    response = requests.get(api_url)
-    return response.text
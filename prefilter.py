@@ -0,0 +1,54 @@
+"""Cheap, synchronous classification of incoming messages.
+
+`on_message` sees every message in the guild, and almost all of them
+need nothing from the bot.  `MessageFilter.classify` sorts them using
+only attribute comparisons, so the rest can be dropped before any
+coroutine is created or command parsing begins.
+"""
+import enum
+from typing import Any
+
+
+class Kind(enum.IntEnum):
+    """What the bot should do with a message."""
+    IGNORE = 0  # Other bots, webhooks, and the bot itself.
+    COMMAND = 1
+    AUTH_BOT = 2
+    DM = 3
+    CHAT = 4  # Anything else from a member; only counts as activity.
+
+
+class MessageFilter:
+    """Classifies messages for `on_message`.
+
+    Attributes:
+      prefix:  A str of the command prefix.
+      auth_bot:  An int of the WM Auth Bot's user ID.
+      self_id:  An int of this bot's user ID.
+    """
+
+    __slots__ = ('prefix', 'auth_bot', 'self_id', '_strikethrough')
+
+    def __init__(self, *, prefix: str, auth_bot: int, self_id: int) -> None:
+        self.prefix = prefix
+        self.auth_bot = auth_bot
+        self.self_id = self_id
+        # `~~text~~` is Markdown, not a command.
+        self._strikethrough = prefix * 2
+
+    def classify(self, message: Any) -> Kind:
+        """Classify a `discord.Message` (or anything shaped like one)."""
+        author = message.author
+        if message.webhook_id is not None or author.id == self.self_id:
+            return Kind.IGNORE
+        if author.bot and author.id != self.auth_bot:
+            return Kind.IGNORE
+        if message.guild is None:
+            return Kind.DM
+        if author.id == self.auth_bot:
+            return Kind.AUTH_BOT
+        content = message.content
+        if (content.startswith(self.prefix)
+                and not content.startswith(self._strikethrough)):
+            return Kind.COMMAND
+        return Kind.CHAT
@@ -0,0 +1,81 @@
+"""Compiled `trim_dict` templates, for projecting many records.
+
+`utils.trim_dict` walks its template on every call.
+`compile_template` walks it once, into a `Projection`: each level's
+keys are precomputed, split into plain keys (copied as they are) and
+nested ones (handed to that level's own compiled functions), so
+applying it is a comprehension per level with no look-ups in the
+template or per-key type checks.
+
+Each Projection has two functions: `one`, for a record, and `many`,
+for a list of records; where a level has no nested keys, `many`
+builds the whole list in one comprehension rather than calling `one`
+per record.  `one` can be passed to `jsonstream.ArrayItems` to trim
+each item as it's decoded.  See `benchmarks.projection`.
+"""
+from typing import Any, Callable, Dict, Iterable, List, NamedTuple, Tuple
+
+JSONDict = Dict[str, Any]
+
+
+class Projection(NamedTuple):
+    """A `trim_dict` template, compiled.
+
+    The result is the same as `trim_dict(record, template)`, except
+    that nested keys come after plain ones, and a nested key whose
+    value isn't a dict or a list is copied rather than failing (as are
+    the non-dict items of a list).
+
+    Attributes:
+      one:  A function projecting one JSONDict.
+      many:  A function projecting an iterable of JSONDicts, returning
+        a list.
+    """
+    one: Callable[[JSONDict], JSONDict]
+    many: Callable[[Iterable[JSONDict]], List[JSONDict]]
+
+
+def _plain(keys: Tuple[str, ...]) -> Projection:
+    def one(record: JSONDict) -> JSONDict:
+        return {key: record[key] for key in keys if key in record}
+
+    def many(records: Iterable[JSONDict]) -> List[JSONDict]:
+        return [{key: record[key] for key in keys if key in record}
+                for record in records]
+    return Projection(one, many)
+
+
+def _nested(keys: Tuple[str, ...],
+            nested: Tuple[Tuple[str, Projection], ...]) -> Projection:
+    subs = tuple((key, sub.one) for key, sub in nested)
+
+    def one(record: JSONDict) -> JSONDict:
+        trimmed = {key: record[key] for key in keys if key in record}
+        for key, sub in subs:
+            if key in record:
+                value = record[key]
+                if type(value) is dict:
+                    value = sub(value)
+                elif type(value) is list:
+                    value = [sub(item) if type(item) is dict else item
+                             for item in value]
+                trimmed[key] = value
+        return trimmed
+
+    def many(records: Iterable[JSONDict]) -> List[JSONDict]:
+        return list(map(one, records))
+    return Projection(one, many)
+
+
+def compile_template(template: JSONDict) -> Projection:
+    """Compile a `trim_dict` template.
+
+    Args:
+      template:  A JSONDict, as for `utils.trim_dict`.  It isn't read
+        again, so changing it later has no effect on the Projection.
+    """
+    keys = tuple(key for key, sub in template.items()
+                 if not isinstance(sub, dict))
+    nested = tuple((key, compile_template(sub))
+                   for key, sub in template.items() if isinstance(sub, dict))
+    return _nested(keys, nested) if nested else _plain(keys)
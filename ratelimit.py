@@ -0,0 +1,129 @@
+"""Rate limiting primitives."""
+import asyncio
+import collections
+import math
+import time
+from typing import Callable, Hashable, List
+
+
+class TokenBucket:
+    """Allows `rate` events per `per` seconds, with bursts up to `rate`.
+
+    Attributes:
+      rate:  An int of events allowed per period; also the burst size.
+      per:  A float of the period, in seconds.
+    """
+
+    __slots__ = ('rate', 'per', '_tokens', '_updated', '_clock')
+
+    def __init__(self, rate: int, per: float,
+                 clock: Callable[[], float] = time.monotonic) -> None:
+        self.rate = rate
+        self.per = per
+        self._clock = clock
+        self._tokens = float(rate)
+        self._updated = clock()
+
+    def _refill(self) -> None:
+        now = self._clock()
+        self._tokens = min(self.rate, self._tokens
+                           + (now - self._updated) * self.rate / self.per)
+        self._updated = now
+
+    def try_acquire(self) -> bool:
+        """Take a token if one is available."""
+        self._refill()
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return True
+        return False
+
+    def delay(self) -> float:
+        """Seconds until a token will be available."""
+        self._refill()
+        return max(0.0, (1 - self._tokens) * self.per / self.rate)
+
+    async def acquire(self) -> None:
+        """Wait for, then take, a token."""
+        while not self.try_acquire():
+            await asyncio.sleep(self.delay())
+
+
+class SlidingWindow:
+    """Allows `rate` events per `per` seconds for each of many keys.
+
+    Exact: each key keeps the times of its last `rate` events, so an
+    event is allowed exactly when the oldest of those is at least `per`
+    seconds old.  They're kept in a fixed list of `rate` slots, each
+    new time overwriting the oldest, so there's nothing to trim.
+
+    Keys idle for a window count nothing, and are swept a few at a
+    time, least recently used first, on each `hit`; `maxkeys` bounds
+    memory if many keys are active at once.
+
+    Attributes:
+      rate:  An int of events allowed per `per` seconds, per key.
+      per:  A float of the window, in seconds.
+      maxkeys:  An int of the most keys tracked; the least recently
+        used are forgotten beyond that.
+    """
+
+    __slots__ = ('rate', 'per', 'maxkeys', '_logs', '_clock')
+
+    # Idle keys swept per `hit`; more than one, so sweeping keeps up.
+    SWEEP = 2
+
+    def __init__(self, rate: int, per: float, maxkeys: int = 1000000,
+                 clock: Callable[[], float] = time.monotonic) -> None:
+        self.rate = rate
+        self.per = per
+        self.maxkeys = maxkeys
+        self._clock = clock
+        # key -> [slot of the oldest time, then the times of its last
+        # `rate` events in slots 1 to `rate`, -inf where there's none]
+        self._logs: 'collections.OrderedDict[Hashable, List[float]]' = (
+            collections.OrderedDict()
+        )
+
+    def __len__(self) -> int:
+        return len(self._logs)
+
+    def retry_after(self, key: Hashable) -> float:
+        """Seconds until `key` may have another event; 0 if it may now."""
+        log = self._logs.get(key)
+        if log is None:
+            return 0.0
+        return max(0.0, log[int(log[0])] + self.per - self._clock())
+
+    def hit(self, key: Hashable) -> None:
+        """Count an event for `key`, whether or not it was allowed."""
+        now = self._clock()
+        logs = self._logs
+        log = logs.get(key)
+        if log is None:
+            log = logs[key] = [1, *[-math.inf] * self.rate]
+        else:
+            logs.move_to_end(key)
+        slot = int(log[0])
+        log[slot] = now
+        log[0] = slot % self.rate + 1
+        idle = now - self.per
+        for _ in range(self.SWEEP):
+            oldest = next(iter(logs.values()))
+            # Its latest time is in the slot before its oldest.
+            latest = oldest[int(oldest[0]) - 1 or self.rate]
+            if latest > idle and len(logs) <= self.maxkeys:
+                break
+            logs.popitem(last=False)
+
+    def try_hit(self, key: Hashable) -> float:
+        """Count an event for `key` if it's allowed.
+
+        Returns:
+          0.0 if it was allowed and counted, else a float of seconds
+          until it would be.
+        """
+        delay = self.retry_after(key)
+        if not delay:
+            self.hit(key)
+        return delay
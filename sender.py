@@ -0,0 +1,113 @@
+"""Scheduled, coalescing sends to Discord channels."""
+import asyncio
+import io
+import logging
+from typing import Dict, List, Set, Tuple
+
+from discord import File, HTTPException
+from discord.abc import Messageable
+
+import ratelimit
+
+MAX_MESSAGE_LENGTH = 2000
+
+log = logging.getLogger(__name__)
+
+
+def pack(texts: List[str], limit: int = MAX_MESSAGE_LENGTH,
+         separator: str = "\n") -> List[str]:
+    """Merge texts, in order, into as few messages as fit in `limit`.
+
+    A text that is over `limit` on its own is returned by itself, for
+    the caller to send as a file.
+    """
+    messages: List[str] = []
+    for text in texts:
+        if (messages and len(messages[-1]) <= limit
+                and len(messages[-1]) + len(separator) + len(text) <= limit):
+            messages[-1] += separator + text
+        else:
+            messages.append(text)
+    return messages
+
+
+def as_file(text: str, filename: str) -> File:
+    return File(io.BytesIO(text.encode('utf-8')), filename=filename)
+
+
+class ChannelSender:
+    """Sends to channels in merged batches, within each channel's limit.
+
+    Texts queued for a channel within `window` seconds of each other are
+    merged into as few messages as possible.  Each channel has its own
+    token bucket, so sends are spaced out here rather than relying on
+    Discord's 429 responses.  Order is preserved per channel.
+
+    Attributes:
+      window:  A float of seconds to wait for more texts to merge.
+      rate, per:  Messages allowed per `per` seconds in one channel.
+    """
+
+    def __init__(self, *, window: float = 1.0,
+                 rate: int = 5, per: float = 5.0) -> None:
+        self.window = window
+        self.rate = rate
+        self.per = per
+        self._pending: Dict[int, Tuple[Messageable, List[str]]] = {}
+        self._flushers: Dict[int, 'asyncio.Task[None]'] = {}
+        self._buckets: Dict[int, ratelimit.TokenBucket] = {}
+        self._sleeping: Set[int] = set()
+
+    def enqueue(self, channel: Messageable, text: str) -> None:
+        """Queue a text to be sent to `channel` shortly."""
+        entry = self._pending.get(channel.id)  # type: ignore
+        if entry is None:
+            self._pending[channel.id] = (channel, [text])  # type: ignore
+        else:
+            entry[1].append(text)
+        if channel.id not in self._flushers:  # type: ignore
+            self._flushers[channel.id] = asyncio.create_task(  # type: ignore
+                self._flush_later(channel.id)  # type: ignore
+            )
+
+    async def _flush_later(self, channel_id: int) -> None:
+        try:
+            # Texts queued while a batch is sending start the next one.
+            while channel_id in self._pending:
+                self._sleeping.add(channel_id)
+                try:
+                    await asyncio.sleep(self.window)
+                finally:
+                    self._sleeping.discard(channel_id)
+                await self._flush(channel_id)
+        finally:
+            del self._flushers[channel_id]
+
+    async def _flush(self, channel_id: int) -> None:
+        channel, texts = self._pending.pop(channel_id)
+        bucket = self._buckets.get(channel_id)
+        if bucket is None:
+            bucket = self._buckets[channel_id] = ratelimit.TokenBucket(
+                self.rate, self.per
+            )
+        for message in pack(texts):
+            await bucket.acquire()
+            try:
+                if len(message) > MAX_MESSAGE_LENGTH:
+                    await channel.send("[Output too long to send as "
+                                       "message. Sorry.]",
+                                       file=as_file(message, "report.txt"))
+                else:
+                    await channel.send(message)
+            except HTTPException:
+                log.exception("Failed to send to channel %d", channel_id)
+
+    async def close(self) -> None:
+        """Send everything still queued, without waiting for windows."""
+        self.window = 0
+        # Only interrupt waits; batches already sending are finished.
+        for channel_id in list(self._sleeping):
+            self._flushers[channel_id].cancel()
+        await asyncio.gather(*self._flushers.values(), return_exceptions=True)
+        for channel_id in list(self._pending):
+            await self._flush(channel_id)
@@ -0,0 +1,206 @@
+"""Wikimedia language codes, from a snapshot of the sitematrix.
+
+The codes are read from a small JSON snapshot on disk: the last one
+fetched (`constants.SITEMATRIX_PATH`) if there is one, or else the one
+bundled with the bot (`sitematrix.json`), so lookups never wait on the
+network and work offline.  `SiteMatrix.run` refreshes the snapshot in
+the background with conditional requests, rebuilds whatever tables
+depend on it off the event loop, and swaps them in with one assignment.
+
+Run `python -m sitematrix` to regenerate the bundled snapshot.
+"""
+import asyncio
+import json
+import logging
+import os
+import tempfile
+import urllib.parse
+from typing import (Any, Callable, Dict, FrozenSet, Generic, NamedTuple,
+                    Optional, TypeVar)
+
+import mwapi
+
+T = TypeVar('T')
+JSONDict = Dict[str, Any]
+
+log = logging.getLogger(__name__)
+
+BUNDLED_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            'sitematrix.json')
+SITE = 'meta.wikimedia.org'
+PARAMS = {'smtype': 'language',
+          'smlangprop': 'code|site',
+          'smsiteprop': 'url',
+          'smlimit': 'max'}
+
+
+class Snapshot(NamedTuple):
+    """Language codes, and the validators of the response they're from."""
+    langs: FrozenSet[str]
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+
+
+def parse(data: JSONDict) -> FrozenSet[str]:
+    """Return every language code in a `action=sitematrix` response.
+
+    Both each language's code and the subdomain of each of its sites
+    are included, since they differ for a few renamed wikis.
+    """
+    langs = set()
+    for key, entry in data['sitematrix'].items():
+        if not key.isdigit():  # 'count' and 'specials'
+            continue
+        langs.add(entry['code'])
+        for site in entry.get('site', ()):
+            host = urllib.parse.urlsplit(site['url']).hostname
+            if host:
+                langs.add(host.split('.', 1)[0])
+    return frozenset(langs)
+
+
+def load(path: str) -> Snapshot:
+    """Read a snapshot written by `save`.
+
+    Raises:
+      OSError, ValueError, KeyError:  If it's missing or malformed.
+    """
+    with open(path, encoding='utf-8') as f:
+        data = json.load(f)
+    langs = frozenset(data['langs'])
+    if not langs:
+        raise ValueError(f"{path} has no languages")
+    return Snapshot(langs, data.get('etag'), data.get('last_modified'))
+
+
+def save(path: str, snapshot: Snapshot) -> None:
+    """Write a snapshot atomically, so readers never see half of one."""
+    data = {'etag': snapshot.etag,
+            'last_modified': snapshot.last_modified,
+            # Sorted, one per line, so changes diff cleanly.
+            'langs': sorted(snapshot.langs)}
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)),
+                               suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(data, f, indent=0)
+            f.write("\n")
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+async def fetch(previous: Optional[Snapshot] = None) -> Optional[Snapshot]:
+    """Fetch the live sitematrix.
+
+    Returns:
+      A new Snapshot, or None if it's unchanged since `previous`.
+    """
+    data, etag, last_modified = await mwapi.getClient().getIfChanged(
+        SITE, 'sitematrix', PARAMS,
+        etag=previous.etag if previous else None,
+        lastModified=previous.last_modified if previous else None
+    )
+    if data is None:
+        return None
+    langs = parse(data)
+    if not langs:
+        raise ValueError("sitematrix response has no languages")
+    return Snapshot(langs, etag, last_modified)
+
+
+class SiteMatrix(Generic[T]):
+    """Tables built from the current snapshot's language codes.
+
+    Attributes:
+      build:  A function turning a frozenset of language codes into
+        the tables.  It's run once per snapshot, on a worker thread
+        when refreshing.
+      path:  A str of where fetched snapshots are saved and, if one
+        exists, loaded from in preference to the bundled snapshot.
+    """
+
+    def __init__(self,
+                 build: Callable[[FrozenSet[str]], T],
+                 path: str) -> None:
+        self.build = build
+        self.path = path
+        self._snapshot: Optional[Snapshot] = None
+        self._tables: Optional[T] = None
+
+    def _load(self) -> Snapshot:
+        for path in (self.path, BUNDLED_PATH):
+            try:
+                return load(path)
+            except FileNotFoundError:
+                continue
+            except (OSError, ValueError, KeyError, TypeError):
+                log.exception("Ignoring bad sitematrix snapshot %s", path)
+        raise RuntimeError(f"No usable sitematrix snapshot in "
+                           f"{self.path} or {BUNDLED_PATH}")
+
+    @property
+    def snapshot(self) -> Snapshot:
+        if self._snapshot is None:
+            self._snapshot = self._load()
+        return self._snapshot
+
+    @property
+    def tables(self) -> T:
+        """The tables for the current snapshot, built on first use."""
+        if self._tables is None:
+            self._tables = self.build(self.snapshot.langs)
+        return self._tables
+
+    async def refresh(self) -> bool:
+        """Fetch the sitematrix and, if it changed, swap in new tables.
+
+        Returns:
+          Whether the language codes changed.
+        """
+        previous = self.snapshot
+        snapshot = await fetch(previous)
+        if snapshot is None:
+            return False
+        loop = asyncio.get_running_loop()
+        changed = snapshot.langs != previous.langs
+        if changed:
+            # Unbuilt tables stay unbuilt until first use.
+            tables = (await loop.run_in_executor(None, self.build,
+                                                 snapshot.langs)
+                      if self._tables is not None else None)
+            # Lookups see either the old tables or the new, never a mix.
+            self._tables, self._snapshot = tables, snapshot
+            log.info("Sitematrix updated: %d languages (+%d, -%d)",
+                     len(snapshot.langs),
+                     len(snapshot.langs - previous.langs),
+                     len(previous.langs - snapshot.langs))
+        else:
+            # Keep the new validators, so the next request can be a 304.
+            self._snapshot = snapshot
+        await loop.run_in_executor(None, save, self.path, snapshot)
+        return changed
+
+    async def run(self, interval: float) -> None:
+        """Refresh every `interval` seconds, until cancelled."""
+        while True:
+            try:
+                await self.refresh()
+            except Exception:
+                log.exception("Sitematrix refresh failed")
+            await asyncio.sleep(interval)
+
+
+async def _main() -> None:
+    try:
+        snapshot = await fetch()
+    finally:
+        await mwapi.close()
+    assert snapshot is not None
+    save(BUNDLED_PATH, Snapshot(snapshot.langs))
+    print(f"Wrote {len(snapshot.langs)} languages to {BUNDLED_PATH}")
+
+
+if __name__ == '__main__':
+    asyncio.run(_main())
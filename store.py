@@ -0,0 +1,451 @@
+"""Persistent storage for verifications, block checks and reports."""
+import asyncio
+import concurrent.futures
+import json
+import logging
+import time
+from typing import (Any, Callable, Iterable, List, NamedTuple, Optional,
+                    Sequence, Tuple, TypeVar)
+
+try:
+    from pysqlite3 import dbapi2 as sqlite3
+except ImportError:  # pragma: no cover
+    import sqlite3  # type: ignore
+
+T = TypeVar('T')
+Blocks = List[List[str]]
+
+log = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS verified_users (
+    discord_user TEXT NOT NULL,
+    discord_id INTEGER,
+    wiki_user TEXT NOT NULL,
+    verified_at REAL NOT NULL,
+    PRIMARY KEY (discord_user, wiki_user)
+);
+CREATE INDEX IF NOT EXISTS verified_users_discord_id
+    ON verified_users (discord_id);
+CREATE INDEX IF NOT EXISTS verified_users_wiki_user
+    ON verified_users (wiki_user);
+
+CREATE TABLE IF NOT EXISTS block_checks (
+    wiki_user TEXT PRIMARY KEY,
+    blocks TEXT NOT NULL,
+    checked_at REAL NOT NULL
+);
+
+-- Per Discord account, so a second account verifying as an already
+-- reported wiki user is reported too.
+CREATE TABLE IF NOT EXISTS reports (
+    wiki_user TEXT NOT NULL,
+    blocks TEXT NOT NULL,
+    discord_user TEXT NOT NULL,
+    reported_at REAL NOT NULL,
+    PRIMARY KEY (discord_user, wiki_user, blocks)
+);
+
+CREATE TABLE IF NOT EXISTS member_activity (
+    discord_id INTEGER PRIMARY KEY,
+    last_seen REAL NOT NULL
+);
+
+-- NULL locked/blocks: the last check failed, so the state is unknown.
+CREATE TABLE IF NOT EXISTS watch_state (
+    wiki_user TEXT PRIMARY KEY,
+    locked INTEGER,
+    blocks TEXT,
+    checked_at REAL NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS log_cursors (
+    feed TEXT PRIMARY KEY,
+    position TEXT NOT NULL,
+    updated_at REAL NOT NULL
+);
+
+-- Bulk ~role changes; finished_at is NULL until every member is done.
+CREATE TABLE IF NOT EXISTS role_jobs (
+    id INTEGER PRIMARY KEY,
+    action TEXT NOT NULL,
+    role_id INTEGER NOT NULL,
+    channel_id INTEGER NOT NULL,
+    message_id INTEGER,
+    requested_by TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    finished_at REAL
+);
+
+-- NULL outcome: not yet applied.
+CREATE TABLE IF NOT EXISTS role_job_members (
+    job_id INTEGER NOT NULL,
+    discord_id INTEGER NOT NULL,
+    outcome TEXT,
+    PRIMARY KEY (job_id, discord_id)
+);
+"""
+
+# Scripts bringing a database made by an older version up to date,
+# applied in order before SCHEMA; `PRAGMA user_version` counts those
+# already applied.
+MIGRATIONS = [
+    # 1: reports are kept per Discord account, not only per wiki user.
+    """
+    ALTER TABLE reports RENAME TO reports_old;
+    CREATE TABLE reports (
+        wiki_user TEXT NOT NULL,
+        blocks TEXT NOT NULL,
+        discord_user TEXT NOT NULL,
+        reported_at REAL NOT NULL,
+        PRIMARY KEY (discord_user, wiki_user, blocks)
+    );
+    INSERT INTO reports SELECT * FROM reports_old;
+    DROP TABLE reports_old;
+    """,
+]
+
+
+class WatchTarget(NamedTuple):
+    """A verified wiki user due a re-check, and their last known state."""
+    wiki_user: str
+    discord_users: List[str]
+    # Both None if never successfully checked.
+    locked: Optional[bool]
+    blocks: Optional[Blocks]
+
+
+class RoleJob(NamedTuple):
+    """A bulk role change, as `create_role_job` recorded it."""
+    id: int
+    action: str
+    role_id: int
+    channel_id: int
+    message_id: Optional[int]
+    requested_by: str
+
+
+class Store:
+    """A SQLite database accessed without blocking the event loop.
+
+    Every query runs on one dedicated thread, which owns the
+    connection.  Writes are queued and flushed by a single writer task
+    in batches, one transaction per batch; callers never wait on them.
+    Reads are awaited and see everything flushed so far.
+
+    Attributes:
+      path:  A str of the database file's path.
+      batch_size:  Max writes committed in one transaction.
+      linger:  Seconds the writer waits for more writes before
+        committing a batch that isn't full.
+    """
+
+    def __init__(self, path: str, *,
+                 batch_size: int = 100,
+                 linger: float = 0.05) -> None:
+        self.path = path
+        self.batch_size = batch_size
+        self.linger = linger
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix='store'
+        )
+        self._conn: Optional[sqlite3.Connection] = None
+        self._writes: 'asyncio.Queue[Tuple[str, Sequence[Any]]]'
+        self._writer: Optional['asyncio.Task[None]'] = None
+
+    async def _run(self, func: Callable[..., T], *args: Any) -> T:
+        return await asyncio.get_running_loop().run_in_executor(
+            self._executor, func, *args
+        )
+
+    def _connect(self) -> None:
+        conn = sqlite3.connect(self.path)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        if conn.execute("SELECT 1 FROM sqlite_master").fetchone() is None:
+            version = len(MIGRATIONS)  # New; SCHEMA is already current.
+        for script in MIGRATIONS[version:]:
+            conn.executescript(script)
+        conn.executescript(SCHEMA)
+        conn.execute(f"PRAGMA user_version = {len(MIGRATIONS)}")
+        self._conn = conn
+
+    async def open(self) -> None:
+        """Open the database and start the writer.  Idempotent."""
+        if self._writer is not None:
+            return
+        await self._run(self._connect)
+        self._writes = asyncio.Queue()
+        self._writer = asyncio.create_task(self._write_loop())
+
+    async def flush(self) -> None:
+        """Wait until every write queued so far is committed."""
+        if self._writer is not None:
+            await self._writes.join()
+
+    async def close(self) -> None:
+        """Flush outstanding writes and close the database."""
+        if self._writer is None:
+            return
+        await self.flush()
+        self._writer.cancel()
+        self._writer = None
+        await self._run(self._conn.close)  # type: ignore
+        self._conn = None
+
+    def _commit(self, batch: List[Tuple[str, Sequence[Any]]]) -> None:
+        with self._conn:  # type: ignore
+            for sql, params in batch:
+                self._conn.execute(sql, params)  # type: ignore
+
+    async def _write_loop(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._writes.get()]
+            deadline = loop.time() + self.linger
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(await asyncio.wait_for(
+                        self._writes.get(), deadline - loop.time()
+                    ))
+                except asyncio.TimeoutError:
+                    break
+            try:
+                await self._run(self._commit, batch)
+            except sqlite3.Error:
+                log.exception("Dropped %d writes", len(batch))
+            finally:
+                for _ in batch:
+                    self._writes.task_done()
+
+    @property
+    def pending(self) -> int:
+        """The number of queued writes not yet picked up by the writer."""
+        return self._writes.qsize() if self._writer else 0
+
+    def _write(self, sql: str, params: Sequence[Any]) -> None:
+        self._writes.put_nowait((sql, params))
+
+    async def _fetchone(self, sql: str,
+                        params: Sequence[Any]) -> Optional[Tuple[Any, ...]]:
+        return await self._run(
+            lambda: self._conn.execute(sql, params).fetchone()  # type: ignore
+        )
+
+    async def _fetchall(self, sql: str,
+                        params: Sequence[Any]) -> List[Tuple[Any, ...]]:
+        return await self._run(
+            lambda: self._conn.execute(sql, params).fetchall()  # type: ignore
+        )
+
+    def record_verification(self, discord_user: str,
+                            discord_id: Optional[int],
+                            wiki_user: str) -> None:
+        self._write(
+            "INSERT INTO verified_users VALUES (?, ?, ?, ?) "
+            "ON CONFLICT (discord_user, wiki_user) DO UPDATE SET "
+            "discord_id = excluded.discord_id, "
+            "verified_at = excluded.verified_at",
+            (discord_user, discord_id, wiki_user, time.time())
+        )
+
+    def record_block_check(self, wiki_user: str, blocks: Blocks) -> None:
+        self._write(
+            "INSERT OR REPLACE INTO block_checks VALUES (?, ?, ?)",
+            (wiki_user, json.dumps(blocks), time.time())
+        )
+
+    def forget_block_check(self, wiki_user: str) -> None:
+        """Drop a user's last block check, so the next one is fresh."""
+        self._write("DELETE FROM block_checks WHERE wiki_user = ?",
+                    (wiki_user,))
+
+    def record_report(self, discord_user: str, wiki_user: str,
+                      blocks: Blocks) -> None:
+        self._write(
+            "INSERT OR REPLACE INTO reports VALUES (?, ?, ?, ?)",
+            (wiki_user, json.dumps(blocks), discord_user, time.time())
+        )
+
+    async def get_block_check(self, wiki_user: str,
+                              max_age: float) -> Optional[Blocks]:
+        """Return a user's last block check if newer than `max_age`.
+
+        Args:
+          wiki_user:  A str of a normalised wiki username.
+          max_age:  A float of seconds.
+
+        Returns:
+          The stored blocks, or None if there is no fresh check.
+        """
+        row = await self._fetchone(
+            "SELECT blocks FROM block_checks "
+            "WHERE wiki_user = ? AND checked_at > ?",
+            (wiki_user, time.time() - max_age)
+        )
+        return json.loads(row[0]) if row else None
+
+    async def was_reported(self, wiki_user: str, blocks: Blocks,
+                           discord_user: Optional[str] = None) -> bool:
+        """Whether these exact blocks were already reported for a user.
+
+        Args:
+          wiki_user:  A str of a normalised wiki username.
+          blocks:  The blocks, as passed to `record_report`.
+          discord_user:  A str of the Discord account they were
+            reported with, or None for any account.
+        """
+        if discord_user is None:
+            row = await self._fetchone(
+                "SELECT 1 FROM reports WHERE wiki_user = ? AND blocks = ?",
+                (wiki_user, json.dumps(blocks))
+            )
+        else:
+            row = await self._fetchone(
+                "SELECT 1 FROM reports WHERE discord_user = ? "
+                "AND wiki_user = ? AND blocks = ?",
+                (discord_user, wiki_user, json.dumps(blocks))
+            )
+        return row is not None
+
+    def record_activity(self, discord_id: int, seen_at: float) -> None:
+        self._write(
+            "INSERT OR REPLACE INTO member_activity VALUES (?, ?)",
+            (discord_id, seen_at)
+        )
+
+    def record_watch(self, wiki_user: str, locked: Optional[bool],
+                     blocks: Optional[Blocks]) -> None:
+        """Record a watcher check; pass None for both if it failed.
+
+        A failed check keeps the last known state, but still counts as
+        a check, so the user isn't retried until they're next due.
+        """
+        self._write(
+            "INSERT INTO watch_state VALUES (?, ?, ?, ?) "
+            "ON CONFLICT (wiki_user) DO UPDATE SET "
+            "locked = COALESCE(excluded.locked, locked), "
+            "blocks = COALESCE(excluded.blocks, blocks), "
+            "checked_at = excluded.checked_at",
+            (wiki_user, locked,
+             None if blocks is None else json.dumps(blocks), time.time())
+        )
+
+    async def due_for_watch(self, interval: float, active_interval: float,
+                            limit: int) -> List[WatchTarget]:
+        """Return verified wiki users due a re-check, most urgent first.
+
+        Users never checked come first, then those whose Discord
+        account has posted since their last check, then the rest by
+        how long ago they were checked.
+
+        Args:
+          interval:  A float of seconds between checks of a user.
+          active_interval:  A float of seconds between checks of a user
+            who has posted since their last check.
+          limit:  An int of the most users to return.
+        """
+        rows = await self._fetchall(
+            "SELECT v.wiki_user, GROUP_CONCAT(DISTINCT v.discord_user), "
+            "w.locked, w.blocks, "
+            "COALESCE(MAX(a.last_seen) > w.checked_at, 0) AS active "
+            "FROM verified_users AS v "
+            "LEFT JOIN member_activity AS a USING (discord_id) "
+            "LEFT JOIN watch_state AS w USING (wiki_user) "
+            "GROUP BY v.wiki_user "
+            "HAVING w.checked_at IS NULL OR w.checked_at < ? - "
+            "CASE WHEN active THEN ? ELSE ? END "
+            "ORDER BY w.checked_at IS NOT NULL, active DESC, w.checked_at "
+            "LIMIT ?",
+            (time.time(), active_interval, interval, limit)
+        )
+        return [WatchTarget(wiki_user, discord_users.split(","),
+                            None if locked is None else bool(locked),
+                            None if blocks is None else json.loads(blocks))
+                for wiki_user, discord_users, locked, blocks, _ in rows]
+
+    async def verified_users(self) -> List[Tuple[str, str]]:
+        """Return every (wiki_user, discord_user) verification."""
+        return await self._fetchall(
+            "SELECT wiki_user, discord_user FROM verified_users", ()
+        )
+
+    def record_cursor(self, feed: str, position: str) -> None:
+        self._write(
+            "INSERT OR REPLACE INTO log_cursors VALUES (?, ?, ?)",
+            (feed, position, time.time())
+        )
+
+    async def get_cursor(self, feed: str) -> Optional[str]:
+        """Return where a log feed was last read up to, if anywhere."""
+        row = await self._fetchone(
+            "SELECT position FROM log_cursors WHERE feed = ?", (feed,)
+        )
+        return row[0] if row else None
+
+    async def verified_since(self, since: float) -> List[int]:
+        """Return the Discord IDs of users verified at or after `since`."""
+        rows = await self._fetchall(
+            "SELECT DISTINCT discord_id FROM verified_users "
+            "WHERE verified_at >= ? AND discord_id IS NOT NULL",
+            (since,)
+        )
+        return [discord_id for discord_id, in rows]
+
+    def _create_role_job(self, action: str, role_id: int, channel_id: int,
+                         requested_by: str, discord_ids: List[int]) -> int:
+        with self._conn:  # type: ignore
+            job_id = self._conn.execute(  # type: ignore
+                "INSERT INTO role_jobs (action, role_id, channel_id, "
+                "requested_by, created_at) VALUES (?, ?, ?, ?, ?)",
+                (action, role_id, channel_id, requested_by, time.time())
+            ).lastrowid
+            self._conn.executemany(  # type: ignore
+                "INSERT OR IGNORE INTO role_job_members (job_id, discord_id) "
+                "VALUES (?, ?)",
+                [(job_id, discord_id) for discord_id in discord_ids]
+            )
+        return job_id
+
+    async def create_role_job(self, action: str, role_id: int,
+                              channel_id: int, requested_by: str,
+                              discord_ids: Iterable[int]) -> RoleJob:
+        """Record a bulk role change, and who it applies to, at once."""
+        job_id = await self._run(self._create_role_job, action, role_id,
+                                 channel_id, requested_by, list(discord_ids))
+        return RoleJob(job_id, action, role_id, channel_id, None,
+                       requested_by)
+
+    def record_role_message(self, job_id: int, message_id: int) -> None:
+        self._write("UPDATE role_jobs SET message_id = ? WHERE id = ?",
+                    (message_id, job_id))
+
+    def record_role_outcome(self, job_id: int, discord_id: int,
+                            outcome: str) -> None:
+        self._write(
+            "UPDATE role_job_members SET outcome = ? "
+            "WHERE job_id = ? AND discord_id = ?",
+            (outcome, job_id, discord_id)
+        )
+
+    def finish_role_job(self, job_id: int) -> None:
+        self._write("UPDATE role_jobs SET finished_at = ? WHERE id = ?",
+                    (time.time(), job_id))
+
+    async def unfinished_role_jobs(self) -> List[RoleJob]:
+        """Return bulk role changes that were interrupted, oldest first."""
+        rows = await self._fetchall(
+            "SELECT id, action, role_id, channel_id, message_id, "
+            "requested_by FROM role_jobs WHERE finished_at IS NULL "
+            "ORDER BY id", ()
+        )
+        return [RoleJob(*row) for row in rows]
+
+    async def role_job_members(self, job_id: int
+                               ) -> List[Tuple[int, Optional[str]]]:
+        """Return (discord_id, outcome) for each member of a job."""
+        return await self._fetchall(
+            "SELECT discord_id, outcome FROM role_job_members "
+            "WHERE job_id = ? ORDER BY rowid", (job_id,)
+        )
@@ -0,0 +1,71 @@
+"""Per-user and per-channel limits on command invocations."""
+from typing import Hashable, Optional
+
+from discord.ext.commands import CheckFailure, Context
+
+import ratelimit
+
+
+class Throttled(CheckFailure):
+    """Raised by `Throttle.check` when an invocation is over a limit.
+
+    Attributes:
+      scope:  A str of the limit hit, 'user' or 'channel'.
+      retry_after:  A float of seconds until it would be allowed.
+      first:  A bool of whether this is the first rejection of this
+        user or channel in the last window, i.e. one worth replying to.
+    """
+
+    def __init__(self, scope: str, retry_after: float, first: bool) -> None:
+        super().__init__(f"Throttled ({scope}); retry in {retry_after:.0f}s")
+        self.scope = scope
+        self.retry_after = retry_after
+        self.first = first
+
+
+class Throttle:
+    """Limits how often each user, and each channel, can run commands.
+
+    Add `check` as a global check with `Bot.add_check(...,
+    call_once=True)`, so it runs once per invocation (and not when
+    `~help` checks which commands to list).  An invocation is counted
+    only if it's under both limits, so rejected ones don't extend the
+    wait.
+
+    Attributes:
+      users, channels:  `ratelimit.SlidingWindow`s keyed by Discord ID,
+        or None where the rate is 0, for no limit.
+    """
+
+    users: Optional[ratelimit.SlidingWindow]
+    channels: Optional[ratelimit.SlidingWindow]
+
+    def __init__(self, *, user_rate: int, user_per: float,
+                 channel_rate: int, channel_per: float) -> None:
+        self.users = (ratelimit.SlidingWindow(user_rate, user_per)
+                      if user_rate else None)
+        self.channels = (ratelimit.SlidingWindow(channel_rate, channel_per)
+                         if channel_rate else None)
+        # Rejections already replied to, so each user or channel is
+        # told at most about once a window.
+        self._told = ratelimit.SlidingWindow(1, max(user_per, channel_per))
+
+    def allow(self, user: Hashable, channel: Hashable) -> None:
+        """Count an invocation, or raise Throttled if it's over a limit."""
+        for scope, windows, key in (('user', self.users, user),
+                                    ('channel', self.channels, channel)):
+            delay = (windows.retry_after(key) if windows is not None
+                     else 0.0)
+            if delay:
+                first = not self._told.retry_after((scope, key))
+                if first:
+                    self._told.hit((scope, key))
+                raise Throttled(scope, delay, first)
+        if self.users is not None:
+            self.users.hit(user)
+        if self.channels is not None:
+            self.channels.hit(channel)
+
+    async def check(self, ctx: Context) -> bool:
+        self.allow(ctx.author.id, ctx.channel.id)
+        return True
@@ -0,0 +1,84 @@
+"""Building of tool links and API URLs.
+
+Link commands are often repeated for the same few usernames (e.g.
+during an RfA or ArbCom case), so encoded usernames are memoized, and
+the static part of each link is built once.
+"""
+import functools
+import sys
+import urllib.parse
+from typing import Mapping
+
+# Encoding is pure, so the same username never needs encoding twice.
+ENCODE_CACHE_SIZE = 4096
+
+
+@functools.lru_cache(maxsize=ENCODE_CACHE_SIZE)
+def quote_title(title: str) -> str:
+    """Percent-encode a page title or username for a URL path.
+
+    `&`, `#`, `|`, `?` etc. are all encoded; `/` is kept, so subpages
+    still work.
+    """
+    return urllib.parse.quote(title)
+
+
+@functools.lru_cache(maxsize=ENCODE_CACHE_SIZE)
+def _quote_param(value: str) -> str:
+    return urllib.parse.quote(value, safe='')
+
+
+def encode_query(params: Mapping[str, object]) -> str:
+    """Encode params as a query string, encoding every reserved char.
+
+    Unlike a plain f-string, a value containing `&`, `#` or `=` can't
+    break out of its parameter.
+    """
+    return "&".join(f"{_quote_param(str(key))}={_quote_param(str(value))}"
+                    for key, value in params.items())
+
+
+class FacetLinks:
+    """Links of the form `<base><facet><infix><username>`.
+
+    The static prefix for each facet (and each alias of it) is built
+    and interned once, so a link costs one dict lookup, one cached
+    encode and one concatenation.
+
+    Attributes:
+      base:  A str of the URL up to the facet.
+    """
+
+    __slots__ = ('base', '_prefixes')
+
+    def __init__(self, base: str, facets: Mapping[str, str],
+                 infix: str = "") -> None:
+        """Constructs a FacetLinks.
+
+        Args:
+          base:  See class docstring.
+          facets:  A mapping of user-facing facet names (keys, e.g.
+            from a FrozenAliasDict) to URL path segments.
+          infix:  A str placed between the path segment and username,
+            including any separators.
+        """
+        self.base = base
+        self._prefixes = {key.lower(): sys.intern(f"<{base}{path}{infix}")
+                          for key, path in facets.items()}
+
+    def __call__(self, facet: str, username: str) -> str:
+        """Return a link, in angle brackets to suppress the embed.
+
+        Raises:
+          KeyError:  If `facet` isn't a known facet, in any case.
+        """
+        try:
+            prefix = self._prefixes[facet]
+        except KeyError:
+            prefix = self._prefixes[facet.lower()]
+        return f"{prefix}{quote_title(username)}>"
+
+
+def link(base: str, username: str) -> str:
+    """Return `<base><username>`, e.g. for CentralAuth."""
+    return f"<{base}{quote_title(username)}>"
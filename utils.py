@@ -3,21 +3,30 @@
 Functions/classes here should return text to be sent, rather than
 sending directly, unless they handle Discord exceptions.
 """
-import inspect
-import io
+import asyncio
+import authparse
+import cache
+import constants
+import jsonstream
+import metrics
 import mwapi
-import json
+import projection
 import re
-from typing import Any, Dict, List, Optional, Set, Tuple, Union
+import sender
+import sitematrix
+import urls
+import sys
+from typing import (Any, AsyncIterator, Dict, FrozenSet, Iterable, Iterator,
+                    KeysView, List, Mapping, NamedTuple, Optional, Set,
+                    Tuple, Union)
 import time
 import urllib.parse
 import discord
 from discord.ext.commands import Context, UserInputError, Bot
-from discord import File, HTTPException, Message, Embed
+from discord import Message, Embed
 
 JSONDict = Dict[str, Any]
 AliasDictData = Dict[Union[str, Tuple[str, ...]], str]
-authRegex = r"(@.*?) authenticated as User:(.*)"
 
 
 async def isDM(message: Message) -> bool:
@@ -34,30 +43,183 @@ async def getUTC() -> str:
     return time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime())
 
 
-def getUserBlocks(username: str) -> str:
-    centralauthinfo = mwapi.getCentralAuthInfo(username)
-    data = json.loads(centralauthinfo)
+def split_usernames(args: str) -> List[str]:
+    """Split `|`-separated usernames, dropping blanks and repeats.
+
+    Raises:
+      UserInputError:  If no usernames are given.
+    """
+    usernames = list(dict.fromkeys(name.strip() for name in args.split("|")
+                                   if name.strip()))
+    if not usernames:
+        raise UserInputError
+    return usernames
+
+
+async def getAccountSummary(username: str) -> str:
+    """Describe a user's global account, e.g. "1,234 global edits".
+
+    Returns:
+      A str noting the global edit count and whether the account is
+      locked, or that there is no global account.
+    """
+    info = (await mwapi.getCentralAuthInfo(username, 'editcount')
+            )['query']['globaluserinfo']
+    if 'missing' in info:
+        return "no global account"
+    summary = f"{info.get('editcount', 0):,} global edits"
+    return summary + ", **locked**" if 'locked' in info else summary
+
+
+# Everything getUserBlocks needs from each entry of `merged`.
+_BLOCK_TEMPLATE = {'wiki': None, 'blocked': {'reason': None, 'expiry': None}}
+_BLOCK_PROJECTION = projection.compile_template(_BLOCK_TEMPLATE)
+
+userBlocksCache: 'cache.TTLCache[List[List[str]]]' = cache.TTLCache(
+    maxsize=constants.CA_CACHE_SIZE,
+    ttl=constants.CA_CACHE_TTL
+)
+
+
+async def iterBlockedWikis(username: str) -> AsyncIterator[JSONDict]:
+    """Yield a user's blocked wikis as CentralAuth's response arrives.
+
+    Only the `merged` prop is requested, and each entry is trimmed to
+    `_BLOCK_TEMPLATE` as soon as it is decoded, so memory use doesn't
+    grow with the number of attached wikis.
+
+    Raises:
+      KeyError:  If the response has no `merged` list (e.g. the user
+        doesn't exist).
+    """
+    merged = jsonstream.ArrayItems('merged', project=_BLOCK_PROJECTION.one)
+    async for chunk in mwapi.streamCentralAuthInfo(username, 'merged'):
+        for wiki in merged.feed(chunk):
+            if 'blocked' in wiki:
+                yield wiki
+    merged.close()
+
+
+def _describeBlock(wiki: JSONDict) -> List[str]:
+    return [wiki['wiki'],
+            f"{wiki['blocked']['reason']} until {wiki['blocked']['expiry']}"]
+
+
+async def _fetchUserBlocks(username: str) -> List[List[str]]:
+    return [_describeBlock(wiki)
+            async for wiki in iterBlockedWikis(username)]
+
+
+async def getUserBlocks(username: str) -> List[List[str]]:
+    username = mwapi.normaliseUsername(username)
+    return await userBlocksCache.fetch(
+        username, lambda: _fetchUserBlocks(username)
+    )
+
+
+# globaluserinfo's own `locked` or `missing` flag, which come before
+# `merged` in the response; a name containing `"locked"` is escaped.
+_LOCKED = re.compile(r'(?<!\\)"locked"[ \t\n\r]*:')
+_MISSING = re.compile(r'(?<!\\)"missing"[ \t\n\r]*:')
+
+
+async def getUserState(
+    username: str
+) -> Optional[Tuple[bool, List[List[str]]]]:
+    """Get whether a user is locked, and their blocks, in one request.
+
+    Both come from the same streamed `merged` response as
+    `iterBlockedWikis`, uncached; the blocks found refresh
+    `userBlocksCache`.
+
+    Returns:
+      A tuple of a bool of whether the account is locked and a list of
+      [wiki, description] blocks, or None if there is no such global
+      account.
+    """
+    username = mwapi.normaliseUsername(username)
+    merged = jsonstream.ArrayItems('merged', project=_BLOCK_PROJECTION.one,
+                                   keep_head=True)
     blocks = []
+    async for chunk in mwapi.streamCentralAuthInfo(username, 'merged'):
+        blocks += [_describeBlock(wiki) for wiki in merged.feed(chunk)
+                   if 'blocked' in wiki]
+    try:
+        merged.close()
+    except KeyError:
+        if _MISSING.search(merged.head):
+            return None
+        raise
+    userBlocksCache.put(username, blocks)
+    return _LOCKED.search(merged.head) is not None, blocks
 
-    for wiki in data['query']['globaluserinfo']['merged']:
-        if 'blocked' in wiki:
-            blocks.append(
-                [
-                    wiki['wiki'],
-                    f"{wiki['blocked']['reason']} until {wiki['blocked']['expiry']}"
-                ]
-            )
-    return blocks
 
+async def iterUserBlocks(
+    usernames: Iterable[str],
+    concurrency: int = constants.BATCH_CONCURRENCY
+) -> AsyncIterator[Tuple[str, Union[List[List[str]], Exception]]]:
+    """Check many users for blocks, yielding results as they complete.
+
+    Duplicate usernames are checked once.  A failure for one user does
+    not stop the others; its exception is yielded in place of blocks.
+
+    Args:
+      usernames:  An iterable of wiki usernames.
+      concurrency:  An int of the most checks to run at once.
+
+    Yields:
+      2-tuples of (username, blocks or exception), in completion order.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def check(username: str) -> Tuple[str, Any]:
+        async with semaphore:
+            try:
+                return username, await getUserBlocks(username)
+            except Exception as exc:
+                return username, exc
+
+    tasks = [asyncio.ensure_future(check(username))
+             for username in dict.fromkeys(usernames)]
+    try:
+        for done in asyncio.as_completed(tasks):
+            yield await done
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+@metrics.REGISTRY.timed(metrics.REPORT_LATENCY)
+async def reportBlocks(record: authparse.AuthRecord,
+                       bot: Bot) -> Optional[str]:
+    """Check a user verified by the auth bot for blocks.
+
+    Returns:
+      A str of a report for the admin channel, or None if the user
+      isn't blocked or their blocks have already been reported with
+      this Discord account.
+    """
+    discordUser, wikiUser = record
+    wikiUser = mwapi.normaliseUsername(wikiUser)
+    bot.store.record_verification(discordUser,
+                                  authparse.discord_id(discordUser), wikiUser)
+    if bot.logTail is not None:
+        bot.logTail.watch(wikiUser, discordUser)
+    userBlocks = await bot.store.get_block_check(
+        wikiUser, constants.BLOCK_CHECK_TTL
+    )
+    if userBlocks is None:
+        userBlocks = await getUserBlocks(wikiUser)
+        bot.store.record_block_check(wikiUser, userBlocks)
+    if (not userBlocks
+            or await bot.store.was_reported(wikiUser, userBlocks,
+                                            discordUser)):
+        return None
+    bot.store.record_report(discordUser, wikiUser, userBlocks)
+    return (f"{discordUser} authenticated as User:{wikiUser}, "
+            "who is blocked on:\n"
+            + "\n".join(f"- {wiki}: {reason}" for wiki, reason in userBlocks))
 
-def reportBlocks(message: Message, bot: Bot) -> str:
-    authMatch = re.findall(authRegex, message.content)
-    if authMatch:
-        discordUser = authMatch[0][0]
-        wikiUser = authMatch[0][1]
-        userBlocks = getUserBlocks(wikiUser)
-        if userBlocks:
-            bot.admin_channel.send('test')
 
 class AliasDict(Dict[str, str]):
     """Create dicts for values that take many aliases (keys).
@@ -127,128 +289,304 @@ class AliasDict(Dict[str, str]):
         super().__setitem__(value, value)
 
 
-_WIKI_FAMILIES = AliasDict(
-    {('w', 'testwiki', 'test2wiki', 'nost', 'nostalgia'): 'wikipedia',
-     'wikt': 'wiktionary',
-     'b': 'wikibooks',
-     ('d', 'testwikidata'): 'wikidata',
-     'n': 'wikinews',
-     'q': 'wikiquote',
-     's': 'wikisource',
-     'species': 'wikispecies',
-     'v': 'wikiversity',
-     'voy': 'wikivoyage'},
-    value_isnt_alias={
-        ('c', 'commons', 'login', 'm', 'meta', 'metawiki',
-         'incubator'): 'wikimedia',
-        'mw': 'mediawiki'
+class FrozenAliasDict(Mapping[str, str]):
+    """An immutable, case-insensitive AliasDict.
+
+    Built once from the same arguments as `AliasDict`, but keeps only
+    the lookup table and a reverse index from each value to all of its
+    aliases, rather than copies of its input.  Keys are stored
+    lowercased, and lookups of other cases fall back to lowercasing.
+    """
+
+    __slots__ = ('_data', '_aliases')
+
+    def __init__(self,
+                 aliases: AliasDictData,
+                 value_isnt_alias: Optional[AliasDictData] = None,
+                 unaliased: Optional[Set[str]] = None) -> None:
+        """Constructs a FrozenAliasDict.
+
+        Args:
+          aliases, value_isnt_alias, unaliased:  See `AliasDict`.
+
+        Raises:
+          ValueError if the values and keys overlap.
+        """
+        def flatten(data: AliasDictData) -> Dict[str, str]:
+            return {sys.intern(key.lower()): sys.intern(value)
+                    for keys, value in data.items()
+                    for key in (keys if isinstance(keys, tuple) else (keys,))}
+
+        unaliased = unaliased if unaliased is not None else set()
+        # The same check as AliasDict's, so a tuple of keys may include
+        # its own value (e.g. `('edits', 'topedits'): 'topedits'`).
+        if aliases.keys() & aliases.values() or aliases.keys() & unaliased:
+            raise ValueError(AliasDict._error_message)
+        aliased = flatten(aliases)
+        data = {sys.intern(v.lower()): v
+                for v in set(aliased.values()) | unaliased}
+        data.update(aliased)
+        data.update(flatten(value_isnt_alias or {}))
+        reverse: Dict[str, List[str]] = {}
+        for key, value in data.items():
+            reverse.setdefault(value, []).append(key)
+        self._data = data
+        self._aliases = {value: tuple(sorted(keys))
+                         for value, keys in reverse.items()}
+
+    def __getitem__(self, key: str) -> str:
+        try:
+            return self._data[key]
+        except KeyError:
+            return self._data[key.lower()]
+
+    def __contains__(self, key: object) -> bool:
+        return isinstance(key, str) and (key in self._data
+                                         or key.lower() in self._data)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._data)
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def keys(self) -> KeysView[str]:
+        return self._data.keys()
+
+    def aliases(self, value: str) -> Tuple[str, ...]:
+        """Return every key that maps to `value`, sorted."""
+        return self._aliases.get(value, ())
+
+    def __repr__(self) -> str:
+        # Every key is explicit in the reverse index, so this rebuilds
+        # an equal FrozenAliasDict.
+        by_keys = {keys: value for value, keys in self._aliases.items()}
+        return f"FrozenAliasDict({{}}, value_isnt_alias={by_keys!r})"
+
+
+WikiPrefix = Tuple[Optional[str], Optional[str]]
+
+
+class WikiTables(NamedTuple):
+    """The interwiki prefix tables used by `get_wiki_page`."""
+    families: FrozenAliasDict
+    langs: FrozenSet[str]
+    pseudolangs: FrozenAliasDict
+    # Every prefix that is a family, lang or pseudolang, lowercase.
+    valid_prefixes: FrozenSet[str]
+    # See `_build_prefix_table`.
+    prefixes: Dict[Tuple[str, ...], WikiPrefix]
+
+
+def _build_wiki_tables(langs: FrozenSet[str]) -> WikiTables:
+    """Build the interwiki prefix tables for a set of language codes."""
+    families = FrozenAliasDict(
+        {('w', 'testwiki', 'test2wiki', 'nost', 'nostalgia'): 'wikipedia',
+         'wikt': 'wiktionary',
+         'b': 'wikibooks',
+         ('d', 'testwikidata'): 'wikidata',
+         'n': 'wikinews',
+         'q': 'wikiquote',
+         's': 'wikisource',
+         'species': 'wikispecies',
+         'v': 'wikiversity',
+         'voy': 'wikivoyage'},
+        value_isnt_alias={
+            ('c', 'commons', 'login', 'm', 'meta', 'metawiki',
+             'incubator'): 'wikimedia',
+            'mw': 'mediawiki'
+        }
+    )
+    pseudolangs = FrozenAliasDict(
+        {'c': 'commons',
+         ('m', 'metawiki'): 'meta',
+         'nost': 'nostalgia'},
+        value_isnt_alias={('d', 'wikidata', 'mediawiki', 'species',
+                           'wikispecies'): 'www',
+                          ('testwiki', 'testwikidata'): 'test',
+                          'test2wiki': 'test2'},
+        unaliased={'login', 'incubator'}
+    )
+    valid_prefixes = frozenset(families.keys()
+                               | langs
+                               | pseudolangs.keys())
+    return WikiTables(families, langs, pseudolangs, valid_prefixes,
+                      _build_prefix_table(families, langs, pseudolangs,
+                                          valid_prefixes))
+
+
+# Language codes come from the sitematrix snapshot, refreshed in the
+# background by the bot.
+wikiMatrix = sitematrix.SiteMatrix(_build_wiki_tables,
+                                   constants.SITEMATRIX_PATH)
+
+
+def wiki_tables() -> WikiTables:
+    """Return the interwiki prefix tables.
+
+    They're built on first use, not at import, so don't slow down
+    startup, and are replaced whenever the sitematrix changes.
+    """
+    return wikiMatrix.tables
+
+
+def _build_prefix_table(
+    families: FrozenAliasDict,
+    langs: FrozenSet[str],
+    pseudolangs: FrozenAliasDict,
+    valid_prefixes: FrozenSet[str]
+) -> Dict[Tuple[str, ...], WikiPrefix]:
+    """Map every valid run of interwiki prefixes to a (family, lang).
+
+    Keys are tuples of one or two lowercase prefixes, in the order
+    they're written.  Either value may be None, meaning "use the
+    default".  Runs that aren't keys (e.g. two lang codes, or a
+    pseudolang combined with a lang code) are invalid.
+    """
+    table: Dict[Tuple[str, ...], WikiPrefix] = {
+        (prefix,): (families.get(prefix),
+                    pseudolangs.get(
+                        prefix, prefix if prefix in langs else None
+                    ))
+        for prefix in valid_prefixes
     }
-)
-_WIKI_LANGS = {
-    'aa', 'ab', 'ace', 'ady', 'af', 'ak', 'als', 'alt', 'am', 'an', 'ang',
-    'ar', 'arc', 'ary', 'arz', 'as', 'ast', 'atj', 'av', 'avk', 'awa', 'ay',
-    'az', 'azb', 'ba', 'ban', 'bar', 'bat-smg', 'bcl', 'be', 'be-tarask',
-    'be-x-old', 'bg', 'bh', 'bi', 'bjn', 'bm', 'bn', 'bo', 'bpy', 'br', 'bs',
-    'bug', 'bxr', 'ca', 'cbk-zam', 'cdo', 'ce', 'ceb', 'ch', 'cho', 'chr',
-    'chy', 'ckb', 'co', 'cr', 'crh', 'cs', 'csb', 'cu', 'cv', 'cy', 'da',
-    'dag', 'de', 'din', 'diq', 'dsb', 'dty', 'dv', 'dz', 'ee', 'el', 'eml',
-    'en', 'eo', 'es', 'et', 'eu', 'ext', 'fa', 'ff', 'fi', 'fiu-vro', 'fj',
-    'fo', 'fr', 'frp', 'frr', 'fur', 'fy', 'ga', 'gag', 'gan', 'gcr', 'gd',
-    'gl', 'glk', 'gn', 'gom', 'gor', 'got', 'gu', 'gv', 'ha', 'hak', 'haw',
-    'he', 'hi', 'hif', 'ho', 'hr', 'hsb', 'ht', 'hu', 'hy', 'hyw', 'hz', 'ia',
-    'id', 'ie', 'ig', 'ii', 'ik', 'ilo', 'inh', 'io', 'is', 'it', 'iu', 'ja',
-    'jam', 'jbo', 'jv', 'ka', 'kaa', 'kab', 'kbd', 'kbp', 'kg', 'ki', 'kj',
-    'kk', 'kl', 'km', 'kn', 'ko', 'koi', 'kr', 'krc', 'ks', 'ksh', 'ku', 'kv',
-    'kw', 'ky', 'la', 'lad', 'lb', 'lbe', 'lez', 'lfn', 'lg', 'li', 'lij',
-    'lld', 'lmo', 'ln', 'lo', 'lrc', 'lt', 'ltg', 'lv', 'mad', 'mai',
-    'map-bms', 'mdf', 'mg', 'mh', 'mhr', 'mi', 'min', 'mk', 'ml', 'mn', 'mni',
-    'mnw', 'mo', 'mr', 'mrj', 'ms', 'mt', 'mus', 'mwl', 'my', 'myv', 'mzn',
-    'na', 'nah', 'nap', 'nds', 'nds-nl', 'ne', 'new', 'ng', 'nia', 'nl', 'nn',
-    'no', 'nov', 'nqo', 'nrm', 'nso', 'nv', 'ny', 'oc', 'olo', 'om', 'or',
-    'os', 'pa', 'pag', 'pam', 'pap', 'pcd', 'pdc', 'pfl', 'pi', 'pih', 'pl',
-    'pms', 'pnb', 'pnt', 'ps', 'pt', 'qu', 'rm', 'rmy', 'rn', 'ro', 'roa-rup',
-    'roa-tara', 'ru', 'rue', 'rw', 'sa', 'sah', 'sat', 'sc', 'scn', 'sco',
-    'sd', 'se', 'sg', 'sh', 'shi', 'shn', 'shy', 'si', 'simple', 'sk', 'skr',
-    'sl', 'sm', 'smn', 'sn', 'so', 'sq', 'sr', 'srn', 'ss', 'st', 'stq', 'su',
-    'sv', 'sw', 'szl', 'szy', 'ta', 'tay', 'tcy', 'te', 'tet', 'tg', 'th',
-    'ti', 'tk', 'tl', 'tn', 'to', 'tpi', 'tr', 'trv', 'ts', 'tt', 'tum', 'tw',
-    'ty', 'tyv', 'udm', 'ug', 'uk', 'ur', 'uz', 've', 'vec', 'vep', 'vi',
-    'vls', 'vo', 'wa', 'war', 'wo', 'wuu', 'xal', 'xh', 'xmf', 'yi', 'yo',
-    'yue', 'za', 'zea', 'zh', 'zh-classical', 'zh-min-nan', 'zh-yue', 'zu'
-}
-_WIKI_PSEUDOLANGS = AliasDict(
-    {'c': 'commons',
-     ('m', 'metawiki'): 'meta',
-     'nost': 'nostalgia'},
-    value_isnt_alias={('d', 'wikidata', 'mediawiki', 'species',
-                       'wikispecies'): 'www',
-                      ('testwiki', 'testwikidata'): 'test',
-                      'test2wiki': 'test2'},
-    unaliased={'login', 'incubator'}
-)
-_VALID_PREFIXES = (_WIKI_FAMILIES.keys()
-                   | _WIKI_LANGS
-                   | _WIKI_PSEUDOLANGS.keys())
+    # Cases like `d:fr:User` are invalid, so pseudolangs are excluded.
+    for family in families.keys() - pseudolangs.keys():
+        for lang in langs:
+            table[family, lang] = table[lang, family] = (
+                families[family], lang
+            )
+    return table
+
+
+# The tables' old module-level names, for `from utils import ...`.
+_LAZY_TABLES = {'_WIKI_FAMILIES': 'families',
+                '_WIKI_LANGS': 'langs',
+                '_WIKI_PSEUDOLANGS': 'pseudolangs',
+                '_VALID_PREFIXES': 'valid_prefixes',
+                '_WIKI_PREFIXES': 'prefixes'}
+
+
+def __getattr__(name: str) -> Any:
+    try:
+        field = _LAZY_TABLES[name]
+    except KeyError:
+        raise AttributeError(
+            f"module {__name__!r} has no attribute {name!r}"
+        ) from None
+    return getattr(wiki_tables(), field)
+
+
+class ComparisonSpec:
+    """A user-comparison command (e.g. EIA or the Timeline), precompiled.
+
+    Build one per command, as a class attribute of its cog, so that the
+    flag tables are built once when the cog loads rather than on every
+    invocation.
+
+    Attributes:
+      command:  A str of the command's name, for error messages.
+      base_url:  A str of the base URL of the service being used.
+    """
+
+    __slots__ = ('command', 'base_url', '_user_param', '_defaults',
+                 '_keywords', '_help')
+
+    def __init__(self, *,
+                 command: str,
+                 base_url: str,
+                 defaults: Dict[str, str],
+                 keywords: Dict[str, str]) -> None:
+        """Constructs a ComparisonSpec.
+
+        Args:
+          command, base_url:  See class docstring.
+          defaults:  A dict of the default params to pass to the URL.
+          keywords:  A dict mapping user-facing keywords (keys) to URL
+            params (values).  For the user field, which is not
+            specified by keyword, use the key 'user'.
+        """
+        self.command = command
+        self.base_url = base_url
+        self._user_param = keywords['user']
+        self._defaults = dict(defaults)
+        self._keywords = {k.strip(): v for k, v in keywords.items()}
+        self._help = f"For more information, type `?help {command}`."
+
+    def __call__(self, args: str) -> str:
+        """Build a comparison URL from user args.
+
+        Args:
+          args:  A str of `|`-separated usernames, optionally followed
+            by `#keyword:value` flags.
+
+        Returns:
+          A str of a URL, or, if any flags are invalid, a str of an
+          error message.
+
+        Raises:
+          UserInputError:  If fewer than two usernames are specified.
+        """
+        names, _, flagstring = args.partition("#")
+        usernames = [name.strip() for name in names.split("|")]
+        if len(usernames) < 2:
+            raise UserInputError
+
+        params = self._defaults
+        if flagstring:
+            flags = [flag.split(":", maxsplit=1)
+                     for flag in flagstring.split("#")]
+            badsyntax = [i[0].strip() for i in flags if len(i) == 1]
+            if badsyntax:
+                return (
+                    "Invalid syntax with the following paramater"
+                    + "s" * (len(badsyntax) > 1) + ": "
+                    + ", ".join(f"`{flag}`" for flag in badsyntax)
+                    + ". Remember to include a colon and value after each"
+                    f" parameter.  {self._help}"
+                )
+            badflags = [i.strip() for i, _ in flags
+                        if i.strip() not in self._keywords]
+            if badflags:
+                return (f"`?{self.command}` does not accept the following "
+                        "parameter" + "s" * (len(badflags) > 1) + ": "
+                        + ", ".join(f"`{flag}`" for flag in badflags)
+                        + f". {self._help}")
+            params = {**params, **{self._keywords[i.strip()]: j.strip()
+                                   for i, j in flags}}
+
+        return (
+            f"<{self.base_url}"
+            + urllib.parse.urlencode(
+                [(self._user_param, name) for name in usernames]
+                + list(params.items())
+            ) + ">"
+        )
 
 
 def get_comparison(args: str,
                    base_url: str,
                    defaults: Dict[str, str],
-                   keywords: Dict[str, str]) -> str:
+                   keywords: Dict[str, str],
+                   *,
+                   command: str) -> str:
     """For getting user comparisons from EIA or the Timeline.
 
+    A one-off wrapper around `ComparisonSpec`; commands should hold a
+    ComparisonSpec instead, so its tables are built only once.
+
     Args:
-      args:  A str of user args.
-      base_url:  A str of the base URL of the service being used.
-      defaults:  A dict of the default params to pass to the URL.
-      keywords:  A dict mapping user-facing keywords (keys) to URL
-        params (values).  For the user field, which is not specified by
-        keyword, use the key 'user'.
+      args, command:  See `ComparisonSpec`.
+      base_url, defaults, keywords:  See `ComparisonSpec.__init__`.
 
     Returns:
-      A str of a URL, or, if less than 2 users were specified, a str of
-      a request to specify usernames
+      A str of a URL, or of an error message.  See `ComparisonSpec`.
 
     Raises:
       UserInputError:  If fewer than two usernames are specified.
     """
-    args: List[str] = args.split("#", maxsplit=1)
-    usernames = [name.strip() for name in args[0].split("|")]
-    if len(usernames) < 2:
-        raise UserInputError
-
-    try:
-        flags = [flag.split(":", maxsplit=1) for flag in args[1].split("#")]
-    except IndexError:
-        flagparams = defaults
-    else:
-        command = inspect.stack()[1].function
-        try:
-            flagparams = {**defaults,
-                          **{keywords[i.strip()]: j.strip() for i, j in flags}}
-        except KeyError:
-            badflags = [i.strip() for i, _ in flags if i not in defaults]
-            return (f"`?{command}` does not accept the following parameter"
-                    + "s" * (len(badflags) > 1) + ": "
-                    + ", ".join(f"`{flag}`" for flag in badflags)
-                    + f". For more information, type `?help {command}`.")
-        except ValueError:
-            badflags = [i[0].strip() for i in flags if len(i) == 1]
-            return (
-                "Invalid syntax with the following paramater"
-                + "s" * (len(badflags) > 1) + ": "
-                + ", ".join(f"`{flag}`" for flag in badflags)
-                + ". Remember to include a colon and value after each"
-                f"parameter.  For more information, type `?help {command}`."
-            )
-
-    return (
-        f"<{base_url}"
-        + urllib.parse.urlencode(
-            [(keywords['user'], name) for name in usernames]
-            + list(flagparams.items())
-        ) + ">"
-    )
+    return ComparisonSpec(command=command, base_url=base_url,
+                          defaults=defaults, keywords=keywords)(args)
 
 
 def get_page(*,
@@ -270,7 +608,7 @@ def get_page(*,
     Returns:
       A str of a URL.
     """
-    return f"<{base_url}{basepage}{urllib.parse.quote(subpage)}{suffix}>"
+    return f"<{base_url}{basepage}{urls.quote_title(subpage)}{suffix}>"
 
 
 # Okay this is kind of hideous, but I can't think of a better way to
@@ -301,37 +639,28 @@ def get_wiki_page(*,
       A UserInputError if the subpagename is prefixed with more than one
       valid lang code and/or more than one valid family code.
     """
+    tables = wiki_tables()
     parts = target.lstrip(':').split(':')
     # Check for text that isn't actually a lang/family code.
+    prefixes = []
     for idx, part in enumerate(parts):
-        if part.lower() not in _VALID_PREFIXES:
+        part = part.lower()
+        if part not in tables.valid_prefixes:
             subpage = ':'.join(parts[idx:])
-            prefixes = [i.lower() for i in parts[:idx]]
             break
+        prefixes.append(part)
     else:
         subpage = parts[-1]
         prefixes = []
-    family, lang = defaults
 
-    if len(prefixes) > 2:
-        raise UserInputError
-    if len(prefixes) == 2:
-        # Exactly 1 family code and exactly 1 language code.
-        if not all(len(set(prefixes) & s) == 1
-                   for s in (_WIKI_FAMILIES.keys(), _WIKI_LANGS)):
-            raise UserInputError
-        prefixes.sort(key=lambda x: x in _WIKI_FAMILIES)
-        # Cases like `?contribs d:fr:User`.
-        if prefixes[1] in _WIKI_PSEUDOLANGS:
-            raise UserInputError
-        family = _WIKI_FAMILIES[prefixes[1]]
-        lang = prefixes[0]
-    elif prefixes:
-        family = _WIKI_FAMILIES.get(prefixes[0], family)
-        lang = _WIKI_PSEUDOLANGS.get(
-            prefixes[0],
-            prefixes[0] if prefixes[0] in _WIKI_LANGS else lang
-        )
+    family, lang = defaults
+    if prefixes:
+        try:
+            prefix_family, prefix_lang = tables.prefixes[tuple(prefixes)]
+        except KeyError:
+            raise UserInputError from None
+        family = prefix_family or family
+        lang = prefix_lang or lang
 
     return get_page(base_url=f"https://{lang}.{family}.org/wiki/",
                     basepage=basepage, subpage=subpage, suffix=suffix)
@@ -349,9 +678,10 @@ async def safesend(ctx: Context,
       2. Can be called an arbitrary number of times in a single message
          (e.g. `?sock`).
 
-    It will first attempt to send `safe` and `dangerous` together, and,
-    if  that results in an HTTPException, will instead send `safe` (if
-    non-empty) as message and `unsafe` as a file.
+    If `safe` and `dangerous` together fit in one message, sends them
+    as one message; otherwise sends `safe` (if non-empty) as message
+    and `dangerous` as a file.  The length is checked before sending,
+    so an oversized message never costs a failed request.
 
     Will place a newline between `safe` and `dangerous` and will
     automatically format any JSON for display in the message as a code
@@ -363,23 +693,22 @@ async def safesend(ctx: Context,
         extremely unlikely to) exceed 2,000 characters.  This will be
         sent either way.  Can be empty.
       dangerous:  A portion of the message that will be turned into a
-        file if the first attempt to send it fails.
-      filename:  A name to assign the file constructed from `unsafe`.
-      is_json:  If True, `unsafe` will be formatted in a JSON code block
-        in the first attempt at sending; if sent as a file it will be a
+        file if the whole message would be too long.
+      filename:  A name to assign the file constructed from `dangerous`.
+      is_json:  If True, `dangerous` will be formatted in a JSON code
+        block if sent as a message; if sent as a file it will be a
         .json file rather than the default .txt.
     """
     fenced = f"```json\n{dangerous}```" if is_json else dangerous
-    try:
-        await ctx.send(f"{safe}\n{fenced}")
-    except HTTPException:
-        file_ext = 'json' if is_json else 'txt'
-        file = File(io.BytesIO(dangerous.encode('utf-8')),
-                    filename=f"{filename}.{file_ext}")
-        await ctx.send(safe
-                       + ("\n[Rest of o" if safe else "[O")
-                       + "utput too long to send as message. Sorry.]",
-                       file=file)
+    message = f"{safe}\n{fenced}"
+    if len(message) <= sender.MAX_MESSAGE_LENGTH:
+        await ctx.send(message)
+        return
+    file_ext = 'json' if is_json else 'txt'
+    await ctx.send(safe
+                   + ("\n[Rest of o" if safe else "[O")
+                   + "utput too long to send as message. Sorry.]",
+                   file=sender.as_file(dangerous, f"{filename}.{file_ext}"))
 
 
 def trim_dict(base_dict: JSONDict, dict_template: JSONDict) -> JSONDict:
@@ -400,6 +729,9 @@ def trim_dict(base_dict: JSONDict, dict_template: JSONDict) -> JSONDict:
       also in dict_template, where the same is true of any subdict or
       any list containing subdicts (in which case all subdicts in the
       list are compared to the same subdict of dict_template.)
+
+    To trim many dicts with the same template, compile it once with
+    `projection.compile_template` instead.
     """
     trimmed = {k: base_dict[k]
                for k in dict_template.keys() if k in base_dict.keys()}
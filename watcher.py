@@ -0,0 +1,165 @@
+"""Periodic re-checks of verified users for global locks and blocks.
+
+`reportBlocks` only checks a user when the auth bot announces their
+verification.  The `Watcher` re-checks every verified wiki user in
+the store on a schedule, at a fixed request budget, and alerts only
+when a user's lock or block state changes.
+"""
+import asyncio
+import logging
+import time
+from typing import Awaitable, Callable, Dict, List, Optional
+
+import metrics
+import ratelimit
+import store
+import utils
+
+log = logging.getLogger(__name__)
+
+# Seconds to wait before looking again when nobody is due.
+IDLE_SLEEP = 60.0
+
+
+def describe_change(target: store.WatchTarget, locked: bool,
+                    blocks: store.Blocks) -> List[str]:
+    """Describe how a user's state differs from their last check.
+
+    Returns:
+      A list of strs, one per change; empty if nothing changed.
+    """
+    lines = []
+    if locked != bool(target.locked):
+        lines.append("is now **globally locked**" if locked
+                     else "is no longer globally locked")
+    before = {wiki for wiki, _ in target.blocks or ()}
+    added = [f"- {wiki}: {reason}" for wiki, reason in blocks
+             if wiki not in before]
+    if added:
+        lines.append("is now blocked on:\n" + "\n".join(added))
+    lifted = before - {wiki for wiki, _ in blocks}
+    if lifted:
+        lines.append("is no longer blocked on: " + ", ".join(sorted(lifted)))
+    return lines
+
+
+class Watcher:
+    """Re-checks verified users, most urgent first, within a budget.
+
+    Each check makes one API request, for the lock and blocks together,
+    and waits for a token from a bucket that refills at
+    `requests_per_hour`, with no bursts, so the request rate is fixed
+    however many users there are.
+
+    Attributes:
+      store:  The `store.Store` of verified users and their states.
+      alert:  A coroutine function called with each alert's text.
+      interval:  A float of seconds between checks of a user.
+      active_interval:  A float of seconds between checks of a user
+        who has posted since their last check.
+      batch_size:  An int of users fetched from the store at a time.
+      activity_resolution:  A float of seconds; a member's activity is
+        written to the store at most this often.
+    """
+
+    def __init__(self, store: store.Store,
+                 alert: Callable[[str], Awaitable[None]], *,
+                 requests_per_hour: int,
+                 interval: float,
+                 active_interval: float,
+                 batch_size: int = 50,
+                 activity_resolution: float = 3600.0) -> None:
+        self.store = store
+        self.alert = alert
+        self.interval = interval
+        self.active_interval = active_interval
+        self.batch_size = batch_size
+        self.activity_resolution = activity_resolution
+        self._bucket = ratelimit.TokenBucket(1, 3600 / requests_per_hour)
+        self._seen: Dict[int, float] = {}
+        self._task: Optional['asyncio.Task[None]'] = None
+
+    def seen(self, discord_id: int) -> None:
+        """Note that a member posted.  Cheap enough for every message."""
+        if self._task is None:
+            return
+        now = time.time()
+        if now - self._seen.get(discord_id, 0.0) >= self.activity_resolution:
+            self._seen[discord_id] = now
+            self.store.record_activity(discord_id, now)
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            # The last batch's states must be visible to the query.
+            await self.store.flush()
+            targets = await self.store.due_for_watch(
+                self.interval, self.active_interval, self.batch_size
+            )
+            if not targets:
+                await asyncio.sleep(IDLE_SLEEP)
+                continue
+            for target in targets:
+                try:
+                    report = await self.check(target)
+                except Exception:
+                    metrics.WATCH_FAILURES.inc()
+                    log.exception("Failed to re-check %s", target.wiki_user)
+                    self.store.record_watch(target.wiki_user, None, None)
+                    continue
+                if report is None:
+                    continue
+                metrics.WATCH_ALERTS.inc()
+                try:
+                    await self.alert(report)
+                except Exception:
+                    # The new state is already recorded, so at least
+                    # keep the alert in the log.
+                    log.exception("Failed to send alert: %s", report)
+
+    async def check(self, target: store.WatchTarget) -> Optional[str]:
+        """Re-check one user and record their state.
+
+        Returns:
+          A str of an alert for the admin channel, or None if nothing
+          changed.
+        """
+        metrics.WATCH_CHECKS.inc()
+        await self._bucket.acquire()
+        state = await utils.getUserState(target.wiki_user)
+        if state is None:
+            # Renamed or deleted; there's nothing to watch.
+            self.store.record_watch(target.wiki_user, False, [])
+            return None
+        locked, blocks = state
+        self.store.record_watch(target.wiki_user, locked, blocks)
+        self.store.record_block_check(target.wiki_user, blocks)
+
+        if target.blocks is None:
+            # First check: blocks found at verification were already
+            # reported by reportBlocks.
+            if blocks and await self.store.was_reported(target.wiki_user,
+                                                        blocks):
+                blocks_before = blocks
+            else:
+                blocks_before = []
+            target = target._replace(locked=False, blocks=blocks_before)
+        changes = describe_change(target, locked, blocks)
+        if not changes:
+            return None
+        if blocks:
+            for discord_user in target.discord_users:
+                self.store.record_report(discord_user, target.wiki_user,
+                                         blocks)
+        who = ", ".join(target.discord_users)
+        return "\n".join(f"{who} (User:{target.wiki_user}) {change}"
+                         for change in changes)
@@ -1,5 +1,9 @@
 """Wikimedia Community Server Discord bot"""
+import asyncio
+import logging
 import random
+import resource
+import time
 import typing
 import datetime
 
@@ -8,60 +12,319 @@ from discord import Guild, Message, Embed, Member
 from discord.ext.commands import (Bot, Context, CommandError, CommandNotFound,
                                   UserInputError, MissingAnyRole)
 
-import cogs
+import authparse
+import botlog
+import bulkroles
 import constants
+import logevents
+import metrics
+import mwapi
+import prefilter
+import sender
+import store
+import throttle
 import utils
+import watcher
+import workqueue
 
 __version__ = constants.VERSION
 
-bot = Bot(command_prefix='~',
-          description=("Wikimedia Community Server Discord bot"),
-          intents=discord.Intents.all(),
-          case_insensitive=True)
+log = logging.getLogger('wmbot')
 
+# Most reports held while the admin channel is unknown; the oldest
+# are dropped, with a warning, beyond this.
+MAX_HELD_REPORTS = 100
 
-async def checkMessage(message: Message) -> bool:
-    """Check a message for non-command functions"""
-    if await utils.isDM(message):
-        # Message is a DM
+# Loaded by `main`, and reloadable at runtime with `~reload`.
+EXTENSIONS = ('cogs',)
+
+# Seconds taken by each startup phase, in order.
+startupTimes: typing.Dict[str, float] = {}
+# When startup began, for the 'total' phase.  Only `launch` can time
+# the imports (discord, aiohttp, ...); without it, this is when they
+# finished.
+startupBegan = time.perf_counter()
+
+
+def recordStartup(phase: str, seconds: float) -> None:
+    startupTimes[phase] = seconds
+    metrics.REGISTRY.gauge('wmbot_startup_seconds',
+                           "Time taken by each startup phase.",
+                           lambda: seconds, phase=phase)
+
+
+def recordImport(began: float) -> None:
+    """Record the import phase, which began at perf_counter() `began`."""
+    global startupBegan
+    startupBegan = began
+    recordStartup('import', time.perf_counter() - began)
+
+
+def startupReport() -> str:
+    return ("Startup: "
+            + ", ".join(f"{phase} {seconds:.2f}s"
+                        for phase, seconds in startupTimes.items())
+            )
+
+
+class WMBot(Bot):
+    """Bot that also manages its database and API connections."""
+
+    def __init__(self, *args: typing.Any, **kwargs: typing.Any) -> None:
+        super().__init__(*args, **kwargs)
+        self.store = store.Store(constants.DB_PATH)
+        self.sender = sender.ChannelSender(window=constants.REPORT_WINDOW)
+        self.reports: 'workqueue.OrderedWorkQueue[authparse.AuthRecord, str]'
+        self.reports = workqueue.OrderedWorkQueue(
+            process=lambda record: utils.reportBlocks(record, self),
+            deliver=self.sendReport,
+            # Per Discord account (the record's mention), so a second
+            # account verifying as the same wiki user is still reported.
+            key=lambda record: (record[0], mwapi.normaliseUsername(record[1])),
+            workers=constants.REPORT_WORKERS,
+            maxsize=constants.REPORT_QUEUE_SIZE,
+            dedupe_window=constants.REPORT_DEDUPE_WINDOW
+        )
+        self.watcher = watcher.Watcher(
+            self.store, self.sendReport,
+            requests_per_hour=constants.WATCH_REQUESTS,
+            interval=constants.WATCH_INTERVAL,
+            active_interval=constants.WATCH_ACTIVE_INTERVAL
+        ) if constants.WATCH_REQUESTS else None
+        feeds = logevents.parse_feeds(constants.LOG_FEEDS)
+        self.logTail = logevents.LogTail(
+            self.store, self.sendReport, feeds, interval=constants.LOG_POLL
+        ) if feeds else None
+        self.bulkRoles = bulkroles.BulkRoles(
+            self.store, rate=constants.ROLE_RATE, per=constants.ROLE_PER,
+            progress_interval=constants.ROLE_PROGRESS_INTERVAL
+        )
+        self.throttle = throttle.Throttle(
+            user_rate=constants.THROTTLE_USER_RATE,
+            user_per=constants.THROTTLE_USER_PER,
+            channel_rate=constants.THROTTLE_CHANNEL_RATE,
+            channel_per=constants.THROTTLE_CHANNEL_PER
+        )
+        self.add_check(self.throttle.check, call_once=True)
+        self.metricsServer: typing.Any = None
+        self.heldReports: typing.List[str] = []
+        # Set up by `main`; without it, logs aren't sent to Discord.
+        self.logPipeline: typing.Optional[botlog.Pipeline] = None
+        self.connectStarted = 0.0
+        self.sitematrixTask: typing.Optional[asyncio.Task] = None
+        self.commandLatency: typing.Dict[str, metrics.Histogram] = {}
+        self.registerGauges()
+
+    def registerGauges(self) -> None:
+        gauge = metrics.REGISTRY.gauge
+        gauge('wmbot_report_queue_depth', "Auth-bot reports waiting.",
+              lambda: len(self.reports))
+        gauge('wmbot_report_queue_dropped',
+              "Auth-bot reports dropped as duplicates.",
+              lambda: self.reports.dropped)
+        gauge('wmbot_store_pending_writes', "Database writes waiting.",
+              lambda: self.store.pending)
+        gauge('wmbot_role_jobs_running', "Bulk role jobs in progress.",
+              lambda: len(self.bulkRoles))
+        gauge('wmbot_log_index_size', "Wiki usernames watched in the logs.",
+              lambda: len(self.logTail) if self.logTail else 0)
+        for label, ttlcache in (('centralauth', mwapi.centralAuthCache),
+                                ('blocks', utils.userBlocksCache)):
+            gauge('wmbot_cache_hit_rate', "Cache hit rate, by cache.",
+                  lambda c=ttlcache: c.stats()['hit_rate'], cache=label)
+            gauge('wmbot_cache_size', "Cache entries, by cache.",
+                  lambda c=ttlcache: len(c), cache=label)
+
+    async def sendReport(self, report: str) -> None:
+        channel = getattr(self, 'admin_channel', None)
+        if channel is None:
+            # Before on_ready, e.g. from the watcher; sent once it is.
+            if len(self.heldReports) >= MAX_HELD_REPORTS:
+                log.warning("No admin channel; dropped held report: %s",
+                            self.heldReports.pop(0))
+            self.heldReports.append(report)
+            return
+        # Merged with any other reports sent in the same window.
+        self.sender.enqueue(channel, report)
+
+    def releaseReports(self) -> None:
+        """Send the reports held until the admin channel was known."""
+        reports, self.heldReports = self.heldReports, []
+        for report in reports:
+            self.sender.enqueue(self.admin_channel, report)
+
+    def sendLog(self, digest: str) -> bool:
+        channel = getattr(self, 'admin_channel', None)
+        if channel is None:
+            return False  # Not ready yet; kept for the next digest.
+        self.sender.enqueue(channel, digest)
+        return True
+
+    async def startServices(self) -> None:
+        """Start everything but the gateway connection.
+
+        Separate from `start` so the handlers can be driven without
+        connecting, e.g. by `benchmarks.loadtest`.
+        """
+        await self.store.open()
+        self.reports.start()
+        if self.watcher is not None:
+            self.watcher.start()
+        if self.logTail is not None:
+            await self.logTail.start()
+        if self.logPipeline is not None:
+            self.logPipeline.start_digests(self.sendLog)
+        if constants.METRICS_PORT:
+            self.metricsServer = await metrics.serve('127.0.0.1',
+                                                     constants.METRICS_PORT)
+        if constants.SITEMATRIX_REFRESH:
+            self.sitematrixTask = asyncio.create_task(
+                utils.wikiMatrix.run(constants.SITEMATRIX_REFRESH)
+            )
+
+    async def start(self, *args: typing.Any, **kwargs: typing.Any) -> None:
+        started = time.perf_counter()
+        await self.startServices()
+        self.connectStarted = time.perf_counter()
+        recordStartup('services', self.connectStarted - started)
+        await super().start(*args, **kwargs)
+
+    async def close(self) -> None:
+        if self.sitematrixTask is not None:
+            self.sitematrixTask.cancel()
+        if self.metricsServer is not None:
+            await self.metricsServer.cleanup()
+        if self.watcher is not None:
+            await self.watcher.close()
+        if self.logTail is not None:
+            await self.logTail.close()
+        await self.bulkRoles.close()
+        await self.reports.close()
+        if self.logPipeline is not None:
+            await self.logPipeline.close_digests()
+        await self.sender.close()
+        await mwapi.close()
+        await self.store.close()
+        await super().close()
+
+
+def buildIntents() -> discord.Intents:
+    """Only the gateway events the cogs use.
+
+    Presences, typing, voice states, reactions etc. are left off, so
+    they are neither received nor cached.
+    """
+    return discord.Intents(guilds=True,
+                           guild_messages=True,
+                           dm_messages=True,
+                           members=constants.MEMBERS_INTENT)
+
+
+def buildMemberCacheFlags() -> discord.MemberCacheFlags:
+    flags = discord.MemberCacheFlags.none()
+    flags.joined = constants.MEMBERS_INTENT and constants.MEMBER_CACHE
+    return flags
+
+
+bot = WMBot(command_prefix=constants.COMMAND_PREFIX,
+            description=("Wikimedia Community Server Discord bot"),
+            intents=buildIntents(),
+            member_cache_flags=buildMemberCacheFlags(),
+            chunk_guilds_at_startup=(constants.MEMBERS_INTENT
+                                     and constants.CHUNK_GUILDS),
+            max_messages=constants.MAX_MESSAGES or None,
+            case_insensitive=True)
+
+
+messageFilter = prefilter.MessageFilter(prefix=constants.COMMAND_PREFIX,
+                                        auth_bot=constants.AUTH_BOT,
+                                        self_id=constants.BOT_ID)
+
+
+@metrics.REGISTRY.timed(metrics.MESSAGE_LATENCY)
+async def checkMessage(message: Message, kind: prefilter.Kind) -> None:
+    """Handle a message that isn't a command"""
+    if kind is prefilter.Kind.DM:
         await message.channel.send("Not yet implemented, sorry...")
         # TODO: Probably another function to deal with any DM commands
-        return True
-    elif message.author.id == constants.AUTH_BOT:
-        # Message is from WM Auth Bot
-        utils.reportBlocks(message, bot)
-    else:
-        # Message isn't a non-command
-        return False
+    elif kind is prefilter.Kind.AUTH_BOT:
+        # Message is from WM Auth Bot; reports are sent in the background.
+        for record in authparse.parse_all(message.content):
+            await bot.reports.submit(record)
 
 
 @bot.event
 async def on_ready() -> None:
     """Things to do when the bot readies."""
-    now_utc = await utils.getUTC()
-    print(f"{now_utc}\n" + "-" * 18)
-    if constants.DEV:
-        print("In development mode...\n" + "-" * 18)
-    print(f"Logged in as\n{bot.user.name}\n{bot.user.id}\nv{constants.VERSION} ({constants.VERSION_NAME})\n"
-          + "-" * 18)
+    log.info("Logged in at %s as %s (%d), v%s (%s)", await utils.getUTC(),
+             bot.user.name, bot.user.id, constants.VERSION,
+             constants.VERSION_NAME)
     bot.admin_channel = bot.get_channel(constants.ADMIN_CHANNEL)
+    if bot.admin_channel is not None:
+        bot.releaseReports()
+    else:
+        log.warning("Admin channel %d not found; holding reports",
+                    constants.ADMIN_CHANNEL)
     bot.server_owner = bot.get_user(constants.SERVER_OWNER)
     bot.custom_activity = constants.BOT_ACTIVITY
     bot.guild = bot.get_guild(constants.GUILD)
+    messageFilter.self_id = bot.user.id
     await bot.change_presence(
         activity=discord.Game(
             name=f"{bot.custom_activity}"
         )
     )
+    log.info(cacheReport())
+    # on_ready also fires after a reconnect; only time the first.
+    if 'connect' not in startupTimes:
+        now = time.perf_counter()
+        recordStartup('connect', now - bot.connectStarted)
+        recordStartup('total', now - startupBegan)
+        log.info(startupReport())
+        if bot.guild is not None:
+            resumed = await bot.bulkRoles.resume(bot.guild)
+            if resumed:
+                log.info("Resumed %d bulk role jobs", resumed)
+
+
+def cacheReport() -> str:
+    """Summarise the gateway config and what's being cached."""
+    intents = [name for name, enabled in bot.intents if enabled]
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss  # KiB
+    return (f"Intents: {', '.join(intents)}; "
+            f"guilds: {len(bot.guilds)}, "
+            f"members cached: {sum(len(g.members) for g in bot.guilds)}, "
+            f"users cached: {len(bot.users)}, "
+            f"messages cached: {len(bot.cached_messages)}; "
+            f"peak RSS: {rss / 1024:.1f} MiB")
 
 
 @bot.event
 async def on_message(message: Message) -> None:
     """Run on every message."""
-    if message.author.discriminator != "0000":  # Ignore webhooks.
-        if message.author.id != constants.BOT_ID:  # Ignore self.
-            if await checkMessage(message) is False:
-                await bot.process_commands(message)
+    kind = messageFilter.classify(message)
+    if kind is prefilter.Kind.IGNORE:
+        return
+    if bot.watcher is not None and kind is not prefilter.Kind.AUTH_BOT:
+        bot.watcher.seen(message.author.id)
+    if kind is prefilter.Kind.COMMAND:
+        await bot.process_commands(message)
+    elif kind is not prefilter.Kind.CHAT:
+        await checkMessage(message, kind)
+
+
+@bot.before_invoke
+async def startCommandTimer(ctx: Context) -> None:
+    ctx.started = time.perf_counter()
+
+
+@bot.after_invoke
+async def stopCommandTimer(ctx: Context) -> None:
+    name = ctx.command.qualified_name
+    histogram = bot.commandLatency.get(name)
+    if histogram is None:
+        histogram = bot.commandLatency[name] = metrics.command_latency(name)
+    histogram.observe(time.perf_counter() - ctx.started)
 
 
 @bot.event
@@ -70,7 +333,20 @@ async def on_command_error(ctx: Context,
     """Notify a user that they have not provided an argument."""
     if ctx.message.content.startswith("~~"):
         return
-    print(error)
+    if isinstance(error, throttle.Throttled):
+        metrics.THROTTLED[error.scope].inc()
+        if error.first:
+            await ctx.send(f"*Slow down...* Try again in "
+                           f"{error.retry_after:.0f} seconds.")
+        return
+    if isinstance(error, CommandNotFound):
+        # Not a command, so the check didn't run; still counts, so
+        # these can't be spammed for replies either.
+        try:
+            bot.throttle.allow(ctx.author.id, ctx.channel.id)
+        except throttle.Throttled:
+            return
+    metrics.COMMAND_ERRORS.inc()
     replies = {
         UserInputError: ("*You need to use the correct syntax...* "
                          f"Type `~help {ctx.command}` for more information."),
@@ -81,14 +357,38 @@ async def on_command_error(ctx: Context,
     }
     for k, v in replies.items():
         if isinstance(error, k):
+            log.info("%s from %s: %s", ctx.command, ctx.author, error)
             await ctx.send(v)
             break
     else:
+        # Same text for every failure of a command, so a storm of them
+        # collapses into one line of the admin digest.
+        log.error("Command %s failed", ctx.command, exc_info=error)
         await ctx.send("Unknown error.")
 
 
-for cog in (cogs.BotInternal, cogs.Mod, cogs.EditorInfo):
-    bot.add_cog(cog(bot))
+def main() -> None:
+    """Load the cogs and run the bot until it's stopped."""
+    if not constants.DISCORD_KEY:
+        raise SystemExit("DISCORD_BOT is not set; see .env.example")
+    pipeline = botlog.Pipeline(
+        path=constants.LOG_PATH, level=constants.LOG_LEVEL,
+        max_bytes=constants.LOG_MAX_BYTES, backups=constants.LOG_BACKUPS,
+        digest_level=constants.ADMIN_LOG_LEVEL,
+        digest_interval=constants.ADMIN_LOG_INTERVAL,
+        digest_lines=constants.ADMIN_LOG_LINES
+    )
+    pipeline.install()
+    bot.logPipeline = pipeline
+    started = time.perf_counter()
+    for extension in EXTENSIONS:
+        bot.load_extension(extension)
+    recordStartup('extensions', time.perf_counter() - started)
+    try:
+        bot.run(constants.DISCORD_KEY)
+    finally:
+        pipeline.stop()
 
 
-bot.run(constants.DISCORD_KEY)
+if __name__ == '__main__':
+    main()
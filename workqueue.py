@@ -0,0 +1,145 @@
+"""Background processing of work items with in-order delivery."""
+import asyncio
+import collections
+import logging
+import time
+from typing import (Awaitable, Callable, Generic, Hashable, List, Optional,
+                    Tuple, TypeVar)
+
+T = TypeVar('T')
+R = TypeVar('R')
+
+log = logging.getLogger(__name__)
+
+
+class OrderedWorkQueue(Generic[T, R]):
+    """A bounded queue drained by a pool of worker tasks.
+
+    Items are processed concurrently, but results are delivered in the
+    order the items were submitted.  Items whose key was already
+    submitted within `dedupe_window` seconds are dropped.
+
+    Attributes:
+      process:  A coroutine function turning an item into a result, or
+        None if there is nothing to deliver.
+      deliver:  A coroutine function called with each non-None result.
+      key:  A function returning an item's de-duplication key, or None
+        to drop the item without queueing it.
+      workers:  An int of worker tasks to run.
+      maxsize:  An int of the most items to hold before `submit`
+        waits for space.
+      dedupe_window:  A float of seconds during which a repeated key
+        is dropped.
+    """
+
+    def __init__(self, *,
+                 process: Callable[[T], Awaitable[Optional[R]]],
+                 deliver: Callable[[R], Awaitable[None]],
+                 key: Callable[[T], Optional[Hashable]],
+                 workers: int = 4,
+                 maxsize: int = 1000,
+                 dedupe_window: float = 300.0) -> None:
+        self.process = process
+        self.deliver = deliver
+        self.key = key
+        self.workers = workers
+        self.maxsize = maxsize
+        self.dedupe_window = dedupe_window
+        self.dropped = 0
+        self._seen: 'collections.OrderedDict[Hashable, float]' = (
+            collections.OrderedDict()
+        )
+        self._queue: 'asyncio.Queue[Tuple[T, asyncio.Future, asyncio.Future]]'
+        self._tasks: List['asyncio.Task[None]'] = []
+        self._last_turn: Optional[asyncio.Future] = None
+        self._closing = False
+
+    def __len__(self) -> int:
+        return self._queue.qsize() if self._tasks else 0
+
+    def start(self) -> None:
+        """Start the workers.  Idempotent."""
+        if self._tasks:
+            return
+        self._queue = asyncio.Queue(self.maxsize)
+        self._last_turn = asyncio.get_running_loop().create_future()
+        self._last_turn.set_result(None)
+        self._tasks = [asyncio.create_task(self._work())
+                       for _ in range(self.workers)]
+
+    def _is_duplicate(self, key: Hashable) -> bool:
+        now = time.monotonic()
+        cutoff = now - self.dedupe_window
+        # Keys are kept in submission order, so expired ones are at the
+        # front.
+        while self._seen and next(iter(self._seen.values())) < cutoff:
+            self._seen.popitem(last=False)
+        if key in self._seen:
+            return True
+        self._seen[key] = now
+        return False
+
+    async def submit(self, item: T) -> bool:
+        """Queue an item, waiting only if the queue is full.
+
+        Returns:
+          True if the item was queued; False if it was dropped.
+        """
+        key = self.key(item)
+        if key is None:
+            return False
+        if self._closing or self._is_duplicate(key):
+            self.dropped += 1
+            return False
+        turn = asyncio.get_running_loop().create_future()
+        previous, self._last_turn = self._last_turn, turn
+        try:
+            await self._queue.put((item, previous, turn))  # type: ignore
+        except asyncio.CancelledError:
+            # Don't leave later items waiting on a turn that never comes.
+            def release(_: asyncio.Future) -> None:
+                if not turn.done():
+                    turn.set_result(None)
+            previous.add_done_callback(release)  # type: ignore
+            raise
+        return True
+
+    async def _work(self) -> None:
+        while True:
+            item, previous, turn = await self._queue.get()
+            try:
+                try:
+                    result = await self.process(item)
+                except Exception:
+                    log.exception("Failed to process %r", item)
+                    result = None
+                # Items are dequeued in order, so the previous item is
+                # already being handled by some worker.
+                await previous
+                if result is not None:
+                    try:
+                        await self.deliver(result)
+                    except Exception:
+                        log.exception("Failed to deliver %r", result)
+            finally:
+                turn.set_result(None)
+                self._queue.task_done()
+
+    async def close(self, timeout: Optional[float] = 30.0) -> None:
+        """Stop accepting items, then drain the queue and stop workers.
+
+        Args:
+          timeout:  Seconds to wait for queued items to finish before
+            cancelling them.  None waits indefinitely.
+        """
+        if not self._tasks:
+            return
+        self._closing = True
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+        except asyncio.TimeoutError:
+            log.warning("Abandoned %d queued items", self._queue.qsize())
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []